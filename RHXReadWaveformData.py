@@ -19,23 +19,8 @@ import time, socket
 # 'matplotlib' can be installed with the command 'pip install matplotlib'
 import matplotlib.pyplot as plt
 
-def readUint32(array, arrayIndex):
-    variableBytes = array[arrayIndex : arrayIndex + 4]
-    variable = int.from_bytes(variableBytes, byteorder='little', signed=False)
-    arrayIndex = arrayIndex + 4
-    return variable, arrayIndex
-
-def readInt32(array, arrayIndex):
-    variableBytes = array[arrayIndex : arrayIndex + 4]
-    variable = int.from_bytes(variableBytes, byteorder='little', signed=True)
-    arrayIndex = arrayIndex + 4
-    return variable, arrayIndex
-
-def readUint16(array, arrayIndex):
-    variableBytes = array[arrayIndex : arrayIndex + 2]
-    variable = int.from_bytes(variableBytes, byteorder='little', signed=False)
-    arrayIndex = arrayIndex + 2
-    return variable, arrayIndex
+from tcputil.waveform_block import parse_waveform_blocks
+
 
 def ReadWaveformDataDemo():
 
@@ -111,35 +96,12 @@ def ReadWaveformDataDemo():
 
     # Read waveform data
     rawData = swaveform.recv(WAVEFORM_BUFFER_SIZE)
-    if len(rawData) % waveformBytesPerBlock != 0:
-        raise Exception('An unexpected amount of data arrived that is not an integer multiple of the expected data size per block')
-    numBlocks = int(len(rawData) / waveformBytesPerBlock)
-
-    rawIndex = 0 # Index used to read the raw data that came in through the TCP socket
-    amplifierTimestamps = [] # List used to contain scaled timestamp values in seconds
-    amplifierData = [] # List used to contain scaled amplifier data in microVolts
-
-    for block in range(numBlocks):
-        # Expect 4 bytes to be TCP Magic Number as uint32.
-        # If not what's expected, raise an exception.
-        magicNumber, rawIndex = readUint32(rawData, rawIndex)
-        if magicNumber != 0x2ef07a08:
-            raise Exception('Error... magic number incorrect')
-
-        # Each block should contain 128 frames of data - process each
-        # of these one-by-one
-        for frame in range(framesPerBlock):
-            # Expect 4 bytes to be timestamp as int32.
-            rawTimestamp, rawIndex = readInt32(rawData, rawIndex)
-            
-            # Multiply by 'timestep' to convert timestamp to seconds
-            amplifierTimestamps.append(rawTimestamp * timestep)
-
-            # Expect 2 bytes of wideband data.
-            rawSample, rawIndex = readUint16(rawData, rawIndex)
-            
-            # Scale this sample to convert to microVolts
-            amplifierData.append(0.195 * (rawSample - 32768))
+
+    # Decode every block at once: timestamps in seconds and amplifier data in
+    # microVolts (one row per enabled channel, here just A-010)
+    waveform = parse_waveform_blocks(rawData, 1, sampleRate)
+    amplifierTimestamps = waveform['t']
+    amplifierData = waveform['amplifier_data'][0]
 
     
     # If using matplotlib to plot is not desired, the following plot lines can be removed.
@@ -13,6 +13,9 @@
 
 import time, socket
 
+from tcputil.command_client import CommandClient
+from tcputil.stim_sweep import wait_for_upload
+
 def RunAndStimulateDemo():
 
     # Declare buffer size for reading from TCP command socket
@@ -42,17 +45,17 @@ def RunAndStimulateDemo():
         scommand.sendall(b'set runmode stop')
         time.sleep(0.1)
 
-    # Send commands to configure some stimulation parameters on channel A-010, and execute UploadStimParameters for that channel
-    scommand.sendall(b'set a-010.stimenabled true')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.source keypressf1')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.firstphaseamplitudemicroamps 10')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.firstphasedurationmicroseconds 500')
-    time.sleep(0.1)
-    scommand.sendall(b'execute uploadstimparameters a-010')
-    time.sleep(1)
+    # Send commands to configure some stimulation parameters on channel A-010, and execute UploadStimParameters for that channel.
+    # The commands go out as one batch, and RHX acknowledges the batch instead of a 0.1 s sleep per command
+    rhx = CommandClient(scommand)
+    with rhx.batch():
+        rhx.set('a-010.stimenabled', 'true')
+        rhx.set('a-010.source', 'keypressf1')
+        rhx.set('a-010.firstphaseamplitudemicroamps', 10)
+        rhx.set('a-010.firstphasedurationmicroseconds', 500)
+        rhx.execute('uploadstimparameters', 'a-010')
+    print('Configured stimulation in {:.3f} s'.format(rhx.latency()['seconds']))
+    wait_for_upload(rhx) # Returns as soon as RHX reports the upload finished
 
     # Send command to set board running
     scommand.sendall(b'set runmode run')
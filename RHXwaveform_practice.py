@@ -1,24 +1,10 @@
 import time, socket
-import matplotlib.pyplot as plt
-
-
-def readUint32(array, arrayIndex):
-    variableBytes = array[arrayIndex : arrayIndex + 4]
-    variable = int.from_bytes(variableBytes, byteorder='little', signed=False)
-    arrayIndex = arrayIndex + 4
-    return variable, arrayIndex
 
-def readInt32(array, arrayIndex):
-    variableBytes = array[arrayIndex : arrayIndex + 4]
-    variable = int.from_bytes(variableBytes, byteorder='little', signed=True)
-    arrayIndex = arrayIndex + 4
-    return variable, arrayIndex
+from tcputil.command_client import CommandClient
+from tcputil.stim_sweep import wait_for_upload
+from tcputil.waveform_block import parse_waveform_blocks
+import matplotlib.pyplot as plt
 
-def readUint16(array, arrayIndex):
-    variableBytes = array[arrayIndex : arrayIndex + 2]
-    variable = int.from_bytes(variableBytes, byteorder='little', signed=False)
-    arrayIndex = arrayIndex + 2
-    return variable, arrayIndex
 
 def RunAndStimulateDemo():
 
@@ -49,17 +35,17 @@ def RunAndStimulateDemo():
         scommand.sendall(b'set runmode stop')
         time.sleep(0.1)
 
-    # Send commands to configure some stimulation parameters on channel A-010, and execute UploadStimParameters for that channel
-    scommand.sendall(b'set a-010.stimenabled true')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.source keypressf1')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.firstphaseamplitudemicroamps 10')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.firstphasedurationmicroseconds 500')
-    time.sleep(0.1)
-    scommand.sendall(b'execute uploadstimparameters a-010')
-    time.sleep(1)
+    # Send commands to configure some stimulation parameters on channel A-010, and execute UploadStimParameters for that channel.
+    # The commands go out as one batch, and RHX acknowledges the batch instead of a 0.1 s sleep per command
+    rhx = CommandClient(scommand)
+    with rhx.batch():
+        rhx.set('a-010.stimenabled', 'true')
+        rhx.set('a-010.source', 'keypressf1')
+        rhx.set('a-010.firstphaseamplitudemicroamps', 10)
+        rhx.set('a-010.firstphasedurationmicroseconds', 500)
+        rhx.execute('uploadstimparameters', 'a-010')
+    print('Configured stimulation in {:.3f} s'.format(rhx.latency()['seconds']))
+    wait_for_upload(rhx) # Returns as soon as RHX reports the upload finished
 
     # Send command to set board running
     scommand.sendall(b'set runmode run')
@@ -150,35 +136,12 @@ def ReadWaveformDataDemo():
 
     # Read waveform data
     rawData = swaveform.recv(WAVEFORM_BUFFER_SIZE)
-    if len(rawData) % waveformBytesPerBlock != 0:
-        raise Exception('An unexpected amount of data arrived that is not an integer multiple of the expected data size per block')
-    numBlocks = int(len(rawData) / waveformBytesPerBlock)
 
-    rawIndex = 0 # Index used to read the raw data that came in through the TCP socket
-    amplifierTimestamps = [] # List used to contain scaled timestamp values in seconds
-    amplifierData = [] # List used to contain scaled amplifier data in microVolts
-
-    for block in range(numBlocks):
-        # Expect 4 bytes to be TCP Magic Number as uint32.
-        # If not what's expected, raise an exception.
-        magicNumber, rawIndex = readUint32(rawData, rawIndex)
-        if magicNumber != 0x2ef07a08:
-            raise Exception('Error... magic number incorrect')
-
-        # Each block should contain 128 frames of data - process each
-        # of these one-by-one
-        for frame in range(framesPerBlock):
-            # Expect 4 bytes to be timestamp as int32.
-            rawTimestamp, rawIndex = readInt32(rawData, rawIndex)
-            
-            # Multiply by 'timestep' to convert timestamp to seconds
-            amplifierTimestamps.append(rawTimestamp * timestep)
-
-            # Expect 2 bytes of wideband data.
-            rawSample, rawIndex = readUint16(rawData, rawIndex)
-            
-            # Scale this sample to convert to microVolts
-            amplifierData.append(0.195 * (rawSample - 32768))
+    # Decode every block at once: timestamps in seconds and amplifier data in
+    # microVolts (one row per enabled channel, here just A-001)
+    waveform = parse_waveform_blocks(rawData, 1, sampleRate)
+    amplifierTimestamps = waveform['t']
+    amplifierData = waveform['amplifier_data'][0]
 
     
     # If using matplotlib to plot is not desired, the following plot lines can be removed.
@@ -230,17 +193,17 @@ def RunStimReadWave():
 
 
 
-    # Send commands to configure some stimulation parameters on channel A-010, and execute UploadStimParameters for that channel
-    scommand.sendall(b'set a-010.stimenabled true')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.source keypressf1')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.firstphaseamplitudemicroamps 10')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.firstphasedurationmicroseconds 500')
-    time.sleep(0.1)
-    scommand.sendall(b'execute uploadstimparameters a-010')
-    time.sleep(1)
+    # Send commands to configure some stimulation parameters on channel A-010, and execute UploadStimParameters for that channel.
+    # The commands go out as one batch, and RHX acknowledges the batch instead of a 0.1 s sleep per command
+    rhx = CommandClient(scommand)
+    with rhx.batch():
+        rhx.set('a-010.stimenabled', 'true')
+        rhx.set('a-010.source', 'keypressf1')
+        rhx.set('a-010.firstphaseamplitudemicroamps', 10)
+        rhx.set('a-010.firstphasedurationmicroseconds', 500)
+        rhx.execute('uploadstimparameters', 'a-010')
+    print('Configured stimulation in {:.3f} s'.format(rhx.latency()['seconds']))
+    wait_for_upload(rhx) # Returns as soon as RHX reports the upload finished
 
 
     # Query sample rate from RHX software
@@ -292,31 +255,12 @@ def RunStimReadWave():
         # raise Exception('An unexpected amount of data arrived that is not an integer multiple of the expected data size per block')
     numBlocks = int(len(rawData) / waveformBytesPerBlock)
 
-    rawIndex = 0 # Index used to read the raw data that came in through the TCP socket
-    amplifierTimestamps = [] # List used to contain scaled timestamp values in seconds
-    amplifierData = [] # List used to contain scaled amplifier data in microVolts
-
-    for block in range(numBlocks):
-        # Expect 4 bytes to be TCP Magic Number as uint32.
-        # If not what's expected, raise an exception.
-        magicNumber, rawIndex = readUint32(rawData, rawIndex)
-        if magicNumber != 0x2ef07a08:
-            raise Exception('Error... magic number incorrect')
-
-        # Each block should contain 128 frames of data - process each
-        # of these one-by-one
-        for frame in range(framesPerBlock):
-            # Expect 4 bytes to be timestamp as int32.
-            rawTimestamp, rawIndex = readInt32(rawData, rawIndex)
-            
-            # Multiply by 'timestep' to convert timestamp to seconds
-            amplifierTimestamps.append(rawTimestamp * timestep)
-
-            # Expect 2 bytes of wideband data.
-            rawSample, rawIndex = readUint16(rawData, rawIndex)
-            
-            # Scale this sample to convert to microVolts
-            amplifierData.append(0.195 * (rawSample - 32768))
+    # Decode every whole block at once (a trailing partial block is left
+    # out, as before): timestamps in seconds and amplifier data in
+    # microVolts (one row per enabled channel, here just A-001)
+    waveform = parse_waveform_blocks(rawData[:numBlocks * waveformBytesPerBlock], 1, sampleRate)
+    amplifierTimestamps = waveform['t']
+    amplifierData = waveform['amplifier_data'][0]
 
     
     # If using matplotlib to plot is not desired, the following plot lines can be removed.
@@ -369,17 +313,17 @@ def RunStimReadWave():
 
 
 
-    # Send commands to configure some stimulation parameters on channel A-010, and execute UploadStimParameters for that channel
-    scommand.sendall(b'set a-010.stimenabled true')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.source keypressf1')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.firstphaseamplitudemicroamps 10')
-    time.sleep(0.1)
-    scommand.sendall(b'set a-010.firstphasedurationmicroseconds 500')
-    time.sleep(0.1)
-    scommand.sendall(b'execute uploadstimparameters a-010')
-    time.sleep(1)
+    # Send commands to configure some stimulation parameters on channel A-010, and execute UploadStimParameters for that channel.
+    # The commands go out as one batch, and RHX acknowledges the batch instead of a 0.1 s sleep per command
+    rhx = CommandClient(scommand)
+    with rhx.batch():
+        rhx.set('a-010.stimenabled', 'true')
+        rhx.set('a-010.source', 'keypressf1')
+        rhx.set('a-010.firstphaseamplitudemicroamps', 10)
+        rhx.set('a-010.firstphasedurationmicroseconds', 500)
+        rhx.execute('uploadstimparameters', 'a-010')
+    print('Configured stimulation in {:.3f} s'.format(rhx.latency()['seconds']))
+    wait_for_upload(rhx) # Returns as soon as RHX reports the upload finished
 
 
     # Query sample rate from RHX software
@@ -431,31 +375,12 @@ def RunStimReadWave():
         # raise Exception('An unexpected amount of data arrived that is not an integer multiple of the expected data size per block')
     numBlocks = int(len(rawData) / waveformBytesPerBlock)
 
-    rawIndex = 0 # Index used to read the raw data that came in through the TCP socket
-    amplifierTimestamps = [] # List used to contain scaled timestamp values in seconds
-    amplifierData = [] # List used to contain scaled amplifier data in microVolts
-
-    for block in range(numBlocks):
-        # Expect 4 bytes to be TCP Magic Number as uint32.
-        # If not what's expected, raise an exception.
-        magicNumber, rawIndex = readUint32(rawData, rawIndex)
-        if magicNumber != 0x2ef07a08:
-            raise Exception('Error... magic number incorrect')
-
-        # Each block should contain 128 frames of data - process each
-        # of these one-by-one
-        for frame in range(framesPerBlock):
-            # Expect 4 bytes to be timestamp as int32.
-            rawTimestamp, rawIndex = readInt32(rawData, rawIndex)
-            
-            # Multiply by 'timestep' to convert timestamp to seconds
-            amplifierTimestamps.append(rawTimestamp * timestep)
-
-            # Expect 2 bytes of wideband data.
-            rawSample, rawIndex = readUint16(rawData, rawIndex)
-            
-            # Scale this sample to convert to microVolts
-            amplifierData.append(0.195 * (rawSample - 32768))
+    # Decode every whole block at once (a trailing partial block is left
+    # out, as before): timestamps in seconds and amplifier data in
+    # microVolts (one row per enabled channel, here just A-001)
+    waveform = parse_waveform_blocks(rawData[:numBlocks * waveformBytesPerBlock], 1, sampleRate)
+    amplifierTimestamps = waveform['t']
+    amplifierData = waveform['amplifier_data'][0]
 
     
     # If using matplotlib to plot is not desired, the following plot lines can be removed.
@@ -0,0 +1,253 @@
+#! /bin/env python
+#
+# Benchmarks for the RHS loader.
+#
+#   python benchmark.py workers recording.rhs --workers 1,2,4,8,16,32
+#   python benchmark.py headers archive/*.rhs --workers 1,8
+#   python benchmark.py suite --channels 32,128 --seconds 10,60 --output results.json
+
+import argparse, contextlib, io, json, multiprocessing, os, platform, resource, subprocess, sys, tempfile, time
+import numpy as np
+
+from intanutil.scan_headers import read_header_only, scan_headers
+from intanutil.read_all_data_blocks import read_all_data_blocks
+from intanutil.parse_data_parallel import parse_data_parallel
+from intanutil.write_rhs import write_synthetic_rhs
+
+# The TCP parsers live in ../tcputil.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+SUITE_CASES = ('read_header', 'read_data', 'read_data_raw', 'read_data_notch', 'notch_filter', 'tcp_waveform')
+
+
+def bench_workers(filename, worker_counts, repeats=3):
+    """Times the post-processing stage of read_data() for each thread count.
+
+    Returns a list of {'workers', 'seconds', 'speedup'} dictionaries, where
+    seconds is the best of repeats runs and speedup is relative to the
+    first entry of worker_counts.
+    """
+    header, data_offset, num_data_blocks = read_header_only(filename, check_size=False)
+
+    results = []
+    for workers in worker_counts:
+        best = float('inf')
+        for _ in range(repeats):
+            with open(filename, 'rb') as fid:
+                fid.seek(data_offset)
+                data = read_all_data_blocks(header, fid, num_data_blocks)
+            tic = time.perf_counter()
+            parse_data_parallel(data, header, workers)
+            best = min(best, time.perf_counter() - tic)
+        results.append({'workers': workers, 'seconds': best, 'speedup': results[0]['seconds'] / best if results else 1.0})
+    return results
+
+
+def bench_headers(filenames, worker_counts, repeats=3):
+    """Times scan_headers() over filenames for each thread count.
+
+    Returns a list of {'workers', 'seconds', 'files_per_second'} dictionaries
+    (best of repeats runs).
+    """
+    results = []
+    for workers in worker_counts:
+        best = float('inf')
+        for _ in range(repeats):
+            tic = time.perf_counter()
+            scan_headers(filenames, workers)
+            best = min(best, time.perf_counter() - tic)
+        results.append({'workers': workers, 'seconds': best, 'files_per_second': len(filenames) / best})
+    return results
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far (ru_maxrss is in kB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else 1024 * peak
+
+
+def run_case(case, filename, repeats, results):
+    """Runs one suite case in this (fresh) process and puts its measurements on results.
+
+    These are 'seconds', the best of repeats runs, 'bytes', the amount of
+    input each run processed, 'peak_rss_bytes', the process's peak resident
+    size, and 'run_rss_bytes', how far the runs raised that peak above the
+    peak reached while setting the case up.  Peak resident size is a
+    high-water mark, so run_rss_bytes is 0 (and understates the runs' own
+    use) when setting up took more memory than running.
+    """
+    from load_intan_rhs_format import read_data
+    from intanutil.notch_filter import notch_filter_channels
+    from tcputil.waveform_block import pack_waveform_blocks, parse_waveform_blocks
+
+    header, data_offset, num_data_blocks = read_header_only(filename)
+    num_samples = 128 * num_data_blocks
+    num_channels = header['num_amplifier_channels']
+
+    if case == 'read_header':
+        run, size = lambda: read_header_only(filename), data_offset
+    elif case in ('read_data', 'read_data_raw', 'read_data_notch'):
+        dtype = 'raw' if case == 'read_data_raw' else 'float64'
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                read_data(filename, dtype=dtype)
+        size = os.path.getsize(filename)
+    elif case == 'notch_filter':
+        data = np.random.default_rng(0).standard_normal((num_channels, num_samples))
+        run, size = lambda: notch_filter_channels(data, header['sample_rate'], 60, 10), data.nbytes
+    elif case == 'tcp_waveform':
+        # The same channels and duration as the file, as wide-band streams on the waveform port.
+        rng = np.random.default_rng(0)
+        buffer = pack_waveform_blocks(np.arange(num_samples, dtype=np.int32),
+                                      rng.integers(0, 65536, (num_channels, num_samples), dtype=np.uint16))
+        run, size = lambda: parse_waveform_blocks(buffer, num_channels, header['sample_rate']), len(buffer)
+    else:
+        raise Exception('Unknown benchmark case {}.'.format(case))
+
+    setup_peak = peak_rss_bytes()
+    best = float('inf')
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - tic)
+    peak = peak_rss_bytes()
+    results.put({'seconds': best, 'bytes': size, 'peak_rss_bytes': peak, 'run_rss_bytes': peak - setup_peak})
+
+
+def bench_suite(channel_counts=(32, 128), durations=(10,), dc_saved=(True, False), cases=SUITE_CASES, repeats=3,
+                directory=None):
+    """Times each of cases on synthetic recordings of every channel count, duration and DC setting.
+
+    The recordings (durations in seconds of 30 kHz data, written by
+    write_synthetic_rhs() into directory, or a temporary directory) each
+    get a fresh process per case, so that peak memory is measured for that
+    case alone.  The read_data_notch case reads a version 1.0 copy of each
+    recording with the 60 Hz notch filter enabled.  Returns a list of dictionaries with the case, the
+    recording's 'channels', 'dc_amplifier_data_saved', 'seconds_of_data'
+    and 'file_bytes', and 'seconds', 'megabytes_per_second' (input
+    processed per second), 'peak_rss_megabytes' and 'run_rss_megabytes'
+    (see run_case()).
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as temporary:
+        for num_channels in channel_counts:
+            for seconds_of_data in durations:
+                for dc in dc_saved:
+                    filename = os.path.join(directory or temporary, 'synthetic_{}ch_{:g}s_{}dc.rhs'.format(
+                        num_channels, seconds_of_data, int(dc)))
+                    num_data_blocks = int(np.ceil(seconds_of_data * 30000 / 128))
+                    file_bytes = write_synthetic_rhs(filename, num_channels, num_data_blocks, 2, 2, 16, 16, dc)
+                    # read_data() only applies the notch filter to files older than version 3.
+                    notch_filename = filename[:-len('.rhs')] + '_notch.rhs'
+                    if 'read_data_notch' in cases:
+                        write_synthetic_rhs(notch_filename, num_channels, num_data_blocks, 2, 2, 16, 16, dc,
+                                            notch_filter_frequency=60, version=(1, 0))
+
+                    for case in cases:
+                        if case in ('notch_filter', 'tcp_waveform') and not dc and True in dc_saved:
+                            continue # these do not depend on the DC setting; run them once
+                        queue = context.Queue()
+                        process = context.Process(target=run_case, args=(
+                            case, notch_filename if case == 'read_data_notch' else filename, repeats, queue))
+                        process.start()
+                        measured = queue.get()
+                        process.join()
+                        results.append({'case': case, 'channels': num_channels, 'dc_amplifier_data_saved': dc,
+                                        'seconds_of_data': 128 * num_data_blocks / 30000, 'file_bytes': file_bytes,
+                                        'seconds': measured['seconds'],
+                                        'megabytes_per_second': measured['bytes'] / 1e6 / measured['seconds'],
+                                        'peak_rss_megabytes': measured['peak_rss_bytes'] / 1e6,
+                                        'run_rss_megabytes': measured['run_rss_bytes'] / 1e6})
+                    if directory is None:
+                        os.remove(filename)
+                        if 'read_data_notch' in cases:
+                            os.remove(notch_filename)
+    return results
+
+
+def compare_to_baseline(results, baseline):
+    """Adds 'baseline_ratio' (throughput relative to the matching baseline result, if any) to each result.
+
+    baseline is a list of results from an earlier bench_suite() run (e.g.
+    the 'results' of a saved JSON file); a ratio below 1 is a slowdown.
+    """
+    def key(r):
+        return r['case'], r['channels'], r['dc_amplifier_data_saved'], round(r['seconds_of_data'], 3)
+    previous = {key(r): r for r in baseline}
+    for r in results:
+        if key(r) in previous:
+            r['baseline_ratio'] = r['megabytes_per_second'] / previous[key(r)]['megabytes_per_second']
+    return results
+
+
+def suite_environment():
+    """Where the suite ran, stored with its results so that runs can be compared."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the RHS loader.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    workers_parser = subparsers.add_parser('workers', help='thread scaling of the read_data() parsing stage')
+    workers_parser.add_argument('filename')
+    workers_parser.add_argument('--workers', default='1,2,4,8,16,32',
+                                help='comma-separated thread counts (default: %(default)s)')
+    workers_parser.add_argument('--repeats', type=int, default=3)
+
+    headers_parser = subparsers.add_parser('headers', help='header-only scanning of many files')
+    headers_parser.add_argument('filenames', nargs='+')
+    headers_parser.add_argument('--workers', default='1,8',
+                                help='comma-separated thread counts (default: %(default)s)')
+    headers_parser.add_argument('--repeats', type=int, default=3)
+
+    suite_parser = subparsers.add_parser('suite', help='throughput and peak memory on synthetic recordings')
+    suite_parser.add_argument('--channels', default='32,128',
+                              help='comma-separated amplifier channel counts (default: %(default)s)')
+    suite_parser.add_argument('--seconds', default='10',
+                              help='comma-separated seconds of 30 kHz data per recording (default: %(default)s)')
+    suite_parser.add_argument('--dc', default='on,off', help='DC amplifier data saved: on, off or on,off')
+    suite_parser.add_argument('--cases', default=','.join(SUITE_CASES), help='comma-separated cases (default: all)')
+    suite_parser.add_argument('--repeats', type=int, default=3)
+    suite_parser.add_argument('--directory', help='keep the synthetic recordings here instead of a temporary directory')
+    suite_parser.add_argument('--output', help='write the results, with the environment, to this JSON file')
+    suite_parser.add_argument('--baseline', help='JSON file from an earlier run to compare throughput against')
+
+    args = parser.parse_args()
+    if args.command == 'workers':
+        worker_counts = [int(w) for w in args.workers.split(',')]
+        print('{} ({} CPUs available)'.format(args.filename, os.cpu_count()))
+        print('{:>8} {:>10} {:>8} {:>11}'.format('workers', 'seconds', 'speedup', 'efficiency'))
+        for r in bench_workers(args.filename, worker_counts, args.repeats):
+            print('{:>8} {:>10.3f} {:>8.2f} {:>10.0%}'.format(r['workers'], r['seconds'], r['speedup'],
+                                                              r['speedup'] / r['workers'] * worker_counts[0]))
+    elif args.command == 'headers':
+        worker_counts = [int(w) for w in args.workers.split(',')]
+        print('{} files'.format(len(args.filenames)))
+        print('{:>8} {:>10} {:>12}'.format('workers', 'seconds', 'files/s'))
+        for r in bench_headers(args.filenames, worker_counts, args.repeats):
+            print('{:>8} {:>10.3f} {:>12.0f}'.format(r['workers'], r['seconds'], r['files_per_second']))
+    elif args.command == 'suite':
+        results = bench_suite([int(c) for c in args.channels.split(',')], [float(s) for s in args.seconds.split(',')],
+                              [dc == 'on' for dc in args.dc.split(',')], args.cases.split(','), args.repeats,
+                              args.directory)
+        if args.baseline:
+            with open(args.baseline) as f:
+                compare_to_baseline(results, json.load(f)['results'])
+        print('{:>15} {:>8} {:>8} {:>4} {:>10} {:>10} {:>8} {:>8} {:>9}'.format(
+            'case', 'channels', 'data s', 'dc', 'seconds', 'MB/s', 'peak MB', 'run MB', 'vs base'))
+        for r in results:
+            ratio = '{:.2f}x'.format(r['baseline_ratio']) if 'baseline_ratio' in r else '-'
+            print('{:>15} {:>8} {:>8.1f} {:>4} {:>10.4f} {:>10.1f} {:>8.1f} {:>8.1f} {:>9}'.format(
+                r['case'], r['channels'], r['seconds_of_data'], 'on' if r['dc_amplifier_data_saved'] else 'off',
+                r['seconds'], r['megabytes_per_second'], r['peak_rss_megabytes'], r['run_rss_megabytes'], ratio))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'environment': suite_environment(), 'results': results}, f, indent=1)
@@ -0,0 +1,151 @@
+#! /bin/env python
+#
+# Columnar on-disk cache of decoded recordings.
+#
+# A cache directory holds one .npy file per signal array of the read_data()
+# result and a meta.json file with everything else (channel lists,
+# stim_parameters, frequency_parameters, ...) plus the size and mtime of the
+# source file.  Arrays are opened with np.load(mmap_mode='r'), so reopening a
+# cache costs a few small reads no matter how long the recording is.
+#
+# The arrays are written in fixed-size time chunks (e.g. from iter_chunks()),
+# so building a cache needs one chunk in memory rather than the whole
+# decoded recording; meta.json lists the chunks' [first sample, samples],
+# and iter_cached_chunks() reads them back one at a time.  Each signal
+# stays one file, allocated at its full length up front (the length is
+# known from the header), because a single memory map per signal is what
+# keeps reopening cheap; the price is that a cache cannot be appended to.
+
+import os, json
+import numpy as np
+
+CACHE_VERSION = 2
+
+
+def cache_directory(filename):
+    """Default cache location: 'recording.rhs' is cached in 'recording.rhs.cache'."""
+    return filename + '.cache'
+
+
+def source_stamp(filename):
+    """Size and modification time of filename; the cache is stale when either changes."""
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def plain(value):
+    """Round-trips value through JSON (NumPy scalars and arrays become numbers and lists)."""
+    return json.loads(json.dumps(value, default=lambda x: x.tolist()))
+
+
+class NpyWriter(object):
+    """A .npy file of known shape whose samples (last axis) are written a range at a time.
+
+    Plain positioned writes rather than a memory map, so that the pages
+    written do not stay in the process's resident memory.
+    """
+
+    def __init__(self, filename, dtype, shape):
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.file = open(filename, 'wb')
+        np.lib.format.write_array_header_1_0(self.file, {'descr': np.lib.format.dtype_to_descr(self.dtype),
+                                                         'fortran_order': False, 'shape': self.shape})
+        self.data_offset = self.file.tell()
+        self.file.truncate(self.data_offset + int(np.prod(self.shape)) * self.dtype.itemsize)
+
+    def write_samples(self, value, first):
+        """Writes value (shape[:-1] x n) into samples first ... first + n - 1 of every row."""
+        rows = np.asarray(value, dtype=self.dtype).reshape(-1, np.shape(value)[-1])
+        row_bytes = self.shape[-1] * self.dtype.itemsize
+        for i, row in enumerate(rows):
+            self.file.seek(self.data_offset + i * row_bytes + first * self.dtype.itemsize)
+            self.file.write(np.ascontiguousarray(row).data)
+
+    def close(self):
+        self.file.close()
+
+
+def write_cache(filename, metadata, chunks, num_samples, cache_dir=None, options=None):
+    """Writes a decoded recording of filename into a cache directory, chunk by chunk.
+
+    metadata holds the non-array entries of the read_data() result (channel
+    lists, stim_parameters, ...); chunks yields consecutive dictionaries of
+    signal arrays with samples along the last axis, as iter_chunks() does,
+    together covering num_samples samples.  Each chunk is copied into the
+    .npy files before the next one is taken.  options records how the
+    recording was read (dtype, channels, signals) so that open_cache() can
+    tell whether the cache matches a later request.  meta.json is written
+    last, so an interrupted write leaves no valid cache.
+    """
+    if cache_dir is None:
+        cache_dir = cache_directory(filename)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Invalidate any previous cache before its arrays are overwritten.
+    if os.path.exists(os.path.join(cache_dir, 'meta.json')):
+        os.remove(os.path.join(cache_dir, 'meta.json'))
+
+    meta = {'version': CACHE_VERSION, 'source': source_stamp(filename), 'options': plain(options or {}),
+            'arrays': [], 'chunks': [], 'metadata': dict(metadata)}
+    files = {}
+    first = 0
+    try:
+        for chunk in chunks:
+            n = len(chunk['t'])
+            if not files:
+                for key, value in chunk.items():
+                    files[key] = NpyWriter(os.path.join(cache_dir, key + '.npy'), value.dtype,
+                                           value.shape[:-1] + (num_samples,))
+                meta['arrays'] = list(files)
+            for key, value in chunk.items():
+                files[key].write_samples(value, first)
+            meta['chunks'].append([first, n])
+            first += n
+    finally:
+        for f in files.values():
+            f.close()
+    if first != num_samples:
+        raise Exception('Expected {} samples for the cache, got {}.'.format(num_samples, first))
+
+    temp_filename = os.path.join(cache_dir, 'meta.json.tmp')
+    with open(temp_filename, 'w') as f:
+        json.dump(meta, f, indent=1, default=lambda x: x.tolist())
+    os.replace(temp_filename, os.path.join(cache_dir, 'meta.json'))
+    return cache_dir
+
+
+def open_cache(filename, cache_dir=None, options=None):
+    """Opens the cached result for filename, or returns None if there is no valid cache.
+
+    A cache is valid if it was written from a file of the same size and
+    mtime with the same options.  Arrays are read-only memory maps.
+    """
+    if cache_dir is None:
+        cache_dir = cache_directory(filename)
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (meta.get('version') != CACHE_VERSION or meta['source'] != source_stamp(filename)
+            or meta['options'] != plain(options or {})):
+        return None
+
+    result = dict(meta['metadata'])
+    for key in meta['arrays']:
+        result[key] = np.load(os.path.join(cache_dir, key + '.npy'), mmap_mode='r')
+    return result
+
+
+def iter_cached_chunks(cache_dir):
+    """Yields the signal arrays of a cache directory chunk by chunk, in the chunks they were written in.
+
+    Each dictionary holds read-only memory-mapped views of one chunk's
+    samples, so only the chunk being used is read from disk.
+    """
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    arrays = {key: np.load(os.path.join(cache_dir, key + '.npy'), mmap_mode='r') for key in meta['arrays']}
+    for first, n in meta['chunks']:
+        yield {key: array[..., first:first + n] for key, array in arrays.items()}
@@ -4,11 +4,48 @@
 # Modified Zeke Arneodo Dec 2017
 # Modified Adrian Foy Sep 2018
 
-def data_to_result(header, data, data_present):
-    """Moves the header and data (if present) into a common object."""
-    
+from intanutil.scale_data import scale_parameters
+from intanutil.select_data import signal_selected
+
+
+def result_data_keys(header, digital='dense'):
+    """Names of the signal arrays that data_to_result() moves into the result for header.
+
+    Signals of boards with no channels (and signals left out by
+    select_header()) are not among them.
+    """
+    suffix = '_edges' if digital == 'edges' else '_data'
+    keys = []
+    if signal_selected(header, 'stim'):
+        keys.append('stim_data')
+    if header['dc_amplifier_data_saved']:
+        keys.append('dc_amplifier_data')
+    if header['num_amplifier_channels'] > 0 and signal_selected(header, 'stim'):
+        keys += ['compliance_limit' + suffix, 'charge_recovery' + suffix, 'amp_settle' + suffix]
+    for signal in ('board_dig_out', 'board_dig_in'):
+        if header['num_' + signal + '_channels'] > 0:
+            keys.append(signal + suffix)
+    for signal in ('board_dac', 'board_adc'):
+        if header['num_' + signal + '_channels'] > 0:
+            keys.append(signal + '_data')
+    if header['num_amplifier_channels'] > 0 and signal_selected(header, 'amplifier'):
+        keys.append('amplifier_data')
+    return keys
+
+
+def data_to_result(header, data, data_present, dtype='float64', digital='dense'):
+    """Moves the header and data (if present) into a common object.
+
+    For the 'raw' dtype policy the factors needed to scale each signal are
+    added as result['scale_parameters']; otherwise scaled signals are stored
+    as the given float type ('float32' or 'float64').  With the 'edges'
+    digital policy, digital and stimulation flag signals are moved as their
+    '..._edges' tables instead of '..._data' arrays.
+    """
     result = {}
     result['t'] = data['t']
+    if dtype == 'raw':
+        result['scale_parameters'] = scale_parameters(header)
     
     stim_parameters = {}
     stim_parameters['stim_step_size'] = header['stim_step_size']
@@ -18,43 +55,22 @@ def data_to_result(header, data, data_present):
     stim_parameters['charge_recovery_mode'] = header['charge_recovery_mode']
     result['stim_parameters'] = stim_parameters
     
-    result['stim_data'] = data['stim_data']
     result['spike_triggers'] = header['spike_triggers']
     result['notes'] = header['notes']
     result['frequency_parameters'] = header['frequency_parameters']
-    
-    if header['dc_amplifier_data_saved']:
-        result['dc_amplifier_data'] = data['dc_amplifier_data']
-        
-    if header['num_amplifier_channels'] > 0:
-        if data_present:
-            result['compliance_limit_data'] = data['compliance_limit_data']
-            result['charge_recovery_data'] = data['charge_recovery_data']
-            result['amp_settle_data'] = data['amp_settle_data']
-    
-    if header['num_board_dig_out_channels'] > 0:
-        result['board_dig_out_channels'] = header['board_dig_out_channels']
-        if data_present:
-            result['board_dig_out_data'] = data['board_dig_out_data']
-        
-    if header['num_board_dig_in_channels'] > 0:
-        result['board_dig_in_channels'] = header['board_dig_in_channels']
-        if data_present:
-            result['board_dig_in_data'] = data['board_dig_in_data']
-        
-    if header['num_board_dac_channels'] > 0:
-        result['board_dac_channels'] = header['board_dac_channels']
-        if data_present:
-            result['board_dac_data'] = data['board_dac_data']
-        
-    if header['num_board_adc_channels'] > 0:
-        result['board_adc_channels'] = header['board_adc_channels']
-        if data_present:
-            result['board_adc_data'] = data['board_adc_data']
-            
-    if header['num_amplifier_channels'] > 0:
-        result['amplifier_channels'] = header['amplifier_channels']
-        if data_present:
-            result['amplifier_data'] = data['amplifier_data']
+
+    for signal in ('board_dig_out', 'board_dig_in', 'board_dac', 'board_adc', 'amplifier'):
+        if header['num_' + signal + '_channels'] > 0:
+            result[signal + '_channels'] = header[signal + '_channels']
+
+    if data_present:
+        for key in result_data_keys(header, digital):
+            result[key] = data[key]
+
+    if dtype != 'raw':
+        # Scaled signals follow the requested float type.
+        for key in ('stim_data', 'dc_amplifier_data', 'board_adc_data', 'board_dac_data', 'amplifier_data'):
+            if key in result:
+                result[key] = result[key].astype(dtype, copy=False)
             
     return result
\ No newline at end of file
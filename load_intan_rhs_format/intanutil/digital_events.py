@@ -0,0 +1,208 @@
+#! /bin/env python
+#
+# Sparse rising / falling edge tables for the digital inputs and outputs and
+# the stimulation flag bits, instead of dense boolean (channels x samples)
+# arrays that are almost always constant.
+#
+# An edge table is a dictionary with
+#
+#   'sample'       sample number of each edge (int64), counted from the start
+#                  of the data, in time order
+#   'channel'      channel of each edge (int16 index into the signal's channels)
+#   'edge'         +1 for a rising edge, -1 for a falling one (int8)
+#   'initial'      each channel's state just before 'start' (bool)
+#   'start'        first sample covered by the table
+#   'num_samples'  number of samples covered
+#
+# edges_to_dense() turns a table (or any sample range of it) back into the
+# boolean array read_data() returns by default.
+
+import numpy as np
+
+# Flag bits of the raw stimulation words (see decode_stim_data()).
+STIM_FLAG_BITS = (('compliance_limit', 15), ('charge_recovery', 14), ('amp_settle', 13))
+
+# Samples decoded at a time by signal_edges(), to bound its temporaries.
+EDGE_CHUNK_SAMPLES = 1 << 20
+
+
+def unpack_words(words):
+    """Unpacks 16-bit words into an (n x 16) uint8 array of bits, least significant bit first."""
+    words = np.ascontiguousarray(words, dtype='<u2').reshape(-1)
+    return np.unpackbits(words.view(np.uint8).reshape(-1, 2), axis=1, bitorder='little')
+
+
+def find_edges(words, bits, state=None):
+    """Finds the samples where any of the given bits of (rows x samples) 16-bit words change.
+
+    Consecutive words are XORed, so only the samples where a selected bit
+    changed are unpacked (with np.unpackbits(), all bits at once).  Returns
+    (edges, state), where edges is a dictionary with 'row', 'bit' (index
+    into bits), 'sample' and 'rising' per edge, in time order, and
+    'initial', the (rows x bits) state before the first sample.  Pass state
+    back in with the next consecutive chunk of words; an edge between two
+    chunks is then reported at the first sample of the second, and samples
+    are counted from the start of the first chunk.
+    """
+    words = np.atleast_2d(words)
+    bits = np.asarray(bits, dtype=np.intp)
+    num_rows, num_samples = words.shape
+    if state is None:
+        previous = words[:, 0] if num_samples > 0 else np.zeros(num_rows, dtype=np.uint16)
+        state = {'previous': np.array(previous, dtype=np.uint16), 'samples': 0}
+    previous = state['previous']
+    mask = np.uint16(np.bitwise_or.reduce(np.left_shift(1, bits)) if len(bits) > 0 else 0)
+
+    changed = np.empty(words.shape, dtype=np.uint16)
+    if num_samples > 0:
+        np.bitwise_xor(words[:, 0], previous, out=changed[:, 0])
+        np.bitwise_xor(words[:, 1:], words[:, :-1], out=changed[:, 1:])
+    np.bitwise_and(changed, mask, out=changed)
+    row, sample = np.nonzero(changed)
+
+    changed_bits = unpack_words(changed[row, sample])[:, bits]
+    new_bits = unpack_words(words[row, sample])[:, bits]
+    del changed
+    event, bit = np.nonzero(changed_bits)
+    row, sample, rising = row[event], sample[event], new_bits[event, bit].astype(bool)
+
+    # np.nonzero() went row by row; within a sample, keep rows (then bits) in order.
+    order = np.argsort(sample, kind='stable')
+    edges = {'row': row[order], 'bit': bit[order], 'sample': state['samples'] + sample[order].astype(np.int64),
+             'rising': rising[order], 'initial': unpack_words(previous)[:, bits].astype(bool)}
+
+    state = {'previous': np.array(words[:, -1], dtype=np.uint16) if num_samples > 0 else previous,
+             'samples': state['samples'] + num_samples}
+    return edges, state
+
+
+def edge_table(channel, sample, rising, initial, start, num_samples):
+    return {'sample': sample, 'channel': channel.astype(np.int16),
+            'edge': np.where(rising, 1, -1).astype(np.int8), 'initial': initial,
+            'start': start, 'num_samples': num_samples}
+
+
+def digital_edges(words, channels, state=None):
+    """Edge table of the digital channels packed into 16-bit words (e.g. the 'board_dig_in_raw' samples).
+
+    channels is the list of channel dictionaries from the header (for
+    example header['board_dig_in_channels']); each channel's 'native_order'
+    selects its bit, as in extract_digital_channels().  Returns
+    (table, state); state works as in find_edges().
+    """
+    start = state['samples'] if state is not None else 0
+    edges, state = find_edges(words, [channel['native_order'] for channel in channels], state)
+    return edge_table(edges['bit'], edges['sample'], edges['rising'], edges['initial'][0], start,
+                      state['samples'] - start), state
+
+
+def stim_flag_edges(stim_data_raw, state=None):
+    """Edge tables of the compliance limit, charge recovery and amp settle flags of raw stimulation words.
+
+    stim_data_raw is a (channels x samples) array as in read_all_data_blocks().
+    Returns (tables, state), where tables has a 'compliance_limit',
+    'charge_recovery' and 'amp_settle' entry; state works as in find_edges().
+    """
+    start = state['samples'] if state is not None else 0
+    edges, state = find_edges(stim_data_raw, [bit for _, bit in STIM_FLAG_BITS], state)
+    tables = {}
+    for i, (name, _) in enumerate(STIM_FLAG_BITS):
+        flag = edges['bit'] == i
+        tables[name] = edge_table(edges['row'][flag], edges['sample'][flag], edges['rising'][flag],
+                                  edges['initial'][:, i], start, state['samples'] - start)
+    return tables, state
+
+
+def concatenate_edges(tables):
+    """Joins the edge tables of consecutive chunks into one."""
+    return {'sample': np.concatenate([table['sample'] for table in tables]),
+            'channel': np.concatenate([table['channel'] for table in tables]),
+            'edge': np.concatenate([table['edge'] for table in tables]),
+            'initial': tables[0]['initial'], 'start': tables[0]['start'],
+            'num_samples': sum(table['num_samples'] for table in tables)}
+
+
+def signal_edges(raw, header, state=None, chunk_samples=EDGE_CHUNK_SAMPLES):
+    """Edge tables of every digital and stimulation flag signal in raw arrays.
+
+    raw uses the keys of read_all_data_blocks() ('stim_data_raw',
+    'board_dig_in_raw', 'board_dig_out_raw'); whichever are present are
+    decoded, chunk_samples samples at a time.  Returns (edges, state), where
+    edges has 'compliance_limit_edges', 'charge_recovery_edges',
+    'amp_settle_edges', 'board_dig_in_edges' and 'board_dig_out_edges'
+    entries (the counterparts of read_data()'s '..._data' arrays) and state
+    carries on into the next chunk, as for iter_chunks().
+    """
+    if state is None:
+        state = {}
+    decoders = []
+    if 'stim_data_raw' in raw:
+        decoders.append(('stim', raw['stim_data_raw'], stim_flag_edges))
+    for key in ('board_dig_in', 'board_dig_out'):
+        if key + '_raw' in raw:
+            channels = header[key + '_channels']
+            decoders.append((key, raw[key + '_raw'],
+                             lambda words, s, channels=channels: digital_edges(words, channels, s)))
+
+    edges = {}
+    for key, words, decode in decoders:
+        num_samples = np.shape(words)[-1]
+        tables = []
+        for first in range(0, max(num_samples, 1), chunk_samples):
+            table, state[key] = decode(words[..., first:first + chunk_samples], state.get(key))
+            tables.append(table)
+        if key == 'stim':
+            for name, _ in STIM_FLAG_BITS:
+                edges[name + '_edges'] = concatenate_edges([table[name] for table in tables])
+        else:
+            edges[key + '_edges'] = concatenate_edges(tables)
+    return edges, state
+
+
+def edges_to_dense(table, start=None, stop=None):
+    """Builds the boolean (channels x samples) array of an edge table, for samples start ... stop - 1.
+
+    start and stop default to the samples the table covers.  The result
+    equals the corresponding '..._data' array of read_data().
+    """
+    if start is None:
+        start = table['start']
+    if stop is None:
+        stop = table['start'] + table['num_samples']
+    sample, channel = table['sample'], table['channel']
+    num_channels = len(table['initial'])
+
+    # State at start: the initial state, flipped by every edge before it.
+    before = np.searchsorted(sample, start)
+    flips = np.bincount(channel[:before], minlength=num_channels) % 2
+    initial = table['initial'] ^ flips.astype(bool)
+
+    # Mark each edge in range, then a running XOR along time turns marks into states.
+    out = np.zeros((num_channels, max(stop - start, 0)), dtype=bool)
+    inside = slice(before, np.searchsorted(sample, stop))
+    out[channel[inside], sample[inside] - start] = True
+    np.logical_xor.accumulate(out, axis=1, out=out)
+    out ^= initial[:, np.newaxis]
+    return out
+
+
+if __name__ == '__main__':
+    # Compares the edge tables of a file with read_data()'s dense arrays.
+    # Run as a plain script, only intanutil/ is on the path; read_data() lives one level up.
+    import os, sys, time
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from load_intan_rhs_format import read_data
+
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'qwerty_210205_153318.rhs'
+    dense = read_data(filename, dtype='raw')
+    tic = time.perf_counter()
+    sparse = read_data(filename, dtype='raw', digital='edges')
+    print('read_data(digital=\'edges\') took {:.2f} s'.format(time.perf_counter() - tic))
+    for name in ('compliance_limit', 'charge_recovery', 'amp_settle', 'board_dig_in', 'board_dig_out'):
+        if name + '_edges' not in sparse:
+            continue
+        table = sparse[name + '_edges']
+        same = np.array_equal(edges_to_dense(table), dense[name + '_data'])
+        print('{}: {} edges, {:.1f} kB instead of {:.1f} kB, {}'.format(
+            name, len(table['sample']), sum(table[key].nbytes for key in ('sample', 'channel', 'edge')) / 1e3,
+            dense[name + '_data'].nbytes / 1e3, 'same' if same else 'DIFFERENT'))
@@ -0,0 +1,280 @@
+#! /bin/env python
+#
+# Stimulus-triggered averaging: trial epochs around stimulation onsets,
+# mean / SEM evoked responses and peri-stimulus spike histograms, grouped
+# by stimulation amplitude.
+
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+from intanutil.rhs_file import RhsFile
+from intanutil.select_data import amplifier_channel_indices
+
+
+def find_stim_onsets(stim, min_gap=30, state=None):
+    """Finds stimulation pulse onsets in (channels x samples) stimulation current (microamps).
+
+    Samples where any channel carries current are active; a pulse starts
+    with an active sample that follows at least min_gap inactive samples, so
+    the phases of a biphasic pulse (and their interphase gap) count as one.
+    Each onset's amplitude is the largest current magnitude on any channel
+    at its first sample.
+
+    Returns (onsets, amplitudes, state).  Pass state back in with the next
+    consecutive chunk to carry on exactly as if the whole signal had been
+    given at once; onsets are sample numbers counted from the start of the
+    first chunk.
+    """
+    stim = np.atleast_2d(stim)
+    if state is None:
+        state = {'position': 0, 'last_active': -min_gap - 1}
+    active = np.flatnonzero(np.any(stim != 0, axis=0))
+    position = state['position'] + active
+    previous = np.concatenate([[state['last_active']], position[:-1]])
+    pulse = position - previous > min_gap
+
+    state = {'position': state['position'] + stim.shape[1],
+             'last_active': int(position[-1]) if len(position) > 0 else state['last_active']}
+    amplitudes = np.max(np.abs(stim[:, active[pulse]]), axis=0) if np.any(pulse) else np.empty(0)
+    return position[pulse], amplitudes, state
+
+
+class EvokedAverager(object):
+    """Accumulates trial epochs (trials x channels x samples) into per-amplitude mean and SEM.
+
+    Batches are merged with the parallel form of Welford's algorithm, so
+    memory does not grow with the number of trials and the variance stays
+    accurate with large signal offsets.
+    """
+
+    def __init__(self):
+        self.groups = {}                        # amplitude -> [count, mean, sum of squared deviations]
+
+    def add(self, epochs, amplitudes):
+        amplitudes = np.round(np.asarray(amplitudes, dtype=np.float64), 6)
+        for amplitude in np.unique(amplitudes):
+            batch = epochs[amplitudes == amplitude]
+            count = len(batch)
+            mean = batch.mean(axis=0)
+            m2 = ((batch - mean) ** 2).sum(axis=0)
+            if amplitude not in self.groups:
+                self.groups[amplitude] = [count, mean, m2]
+                continue
+            group = self.groups[amplitude]
+            total = group[0] + count
+            delta = mean - group[1]
+            group[1] = group[1] + delta * (count / total)
+            group[2] = group[2] + m2 + delta ** 2 * (group[0] * count / total)
+            group[0] = total
+
+    def results(self):
+        """Returns 'amplitudes' (sorted), 'trials' per amplitude and 'mean' and 'sem' (amplitudes x channels x samples)."""
+        amplitudes = sorted(self.groups)
+        trials = np.array([self.groups[a][0] for a in amplitudes], dtype=np.int64)
+        if len(amplitudes) == 0:
+            return {'amplitudes': np.empty(0), 'trials': trials, 'mean': None, 'sem': None}
+        mean = np.stack([self.groups[a][1] for a in amplitudes])
+        m2 = np.stack([self.groups[a][2] for a in amplitudes])
+        shape = (-1,) + (1,) * (mean.ndim - 1)
+        variance = m2 / np.maximum(trials - 1, 1).reshape(shape)
+        sem = np.sqrt(variance / trials.reshape(shape))
+        sem[trials < 2] = np.nan
+        return {'amplitudes': np.array(amplitudes), 'trials': trials, 'mean': mean, 'sem': sem}
+
+
+def peristimulus_histogram(spike_timestamps, spike_channels, num_channels, onset_timestamps, onset_groups, num_groups,
+                           pre, post, bin_size):
+    """Counts spikes in bins of bin_size samples from pre samples before to post samples after every onset.
+
+    spike_channels index 0 ... num_channels - 1 (others are ignored) and
+    onset_groups 0 ... num_groups - 1.  Returns spike counts summed over the
+    trials of each group, as a (groups x channels x bins) array.
+    """
+    num_bins = int(np.ceil((pre + post) / bin_size))
+    counts = np.zeros((num_groups, num_channels, num_bins), dtype=np.int64)
+    spike_timestamps = np.asarray(spike_timestamps, dtype=np.int64)
+    spike_channels = np.asarray(spike_channels, dtype=np.int64)
+    onset_timestamps = np.asarray(onset_timestamps, dtype=np.int64)
+    valid = (spike_channels >= 0) & (spike_channels < num_channels)
+    spike_timestamps, spike_channels = spike_timestamps[valid], spike_channels[valid]
+    order = np.argsort(spike_timestamps, kind='stable')
+    spike_timestamps, spike_channels = spike_timestamps[order], spike_channels[order]
+
+    # Every (trial, spike) pair within the trial's window, found with two binary searches per trial.
+    first = np.searchsorted(spike_timestamps, onset_timestamps - pre)
+    last = np.searchsorted(spike_timestamps, onset_timestamps + post)
+    lengths = last - first
+    trial = np.repeat(np.arange(len(onset_timestamps)), lengths)
+    spike = first[trial] + np.arange(trial.size) - (np.cumsum(lengths) - lengths)[trial]
+    bins = (spike_timestamps[spike] - onset_timestamps[trial] + pre) // bin_size
+    flat = (np.asarray(onset_groups)[trial] * num_channels + spike_channels[spike]) * num_bins + bins
+    counts.reshape(-1)[...] = np.bincount(flat, minlength=counts.size)
+    return counts
+
+
+def spike_channel_positions(header, channel_index, names):
+    """Maps spike event channel names to positions in channel_index (-1 where the channel was not selected).
+
+    Names are native or custom amplifier channel names, or amplifier channel
+    numbers as digit strings (as SpikeDetector uses by default).
+    """
+    positions = np.full(len(names), -1, dtype=np.int64)
+    selected = {int(channel): i for i, channel in enumerate(channel_index)}
+    for i, name in enumerate(names):
+        name = str(name)
+        try:
+            channel = amplifier_channel_indices(header, [int(name) if name.isdigit() else name])[0]
+        except Exception:
+            continue
+        positions[i] = selected.get(int(channel), -1)
+    return positions
+
+
+def evoked_responses(filename, pre=0.005, post=0.05, channels=None, stim_channels=None, onsets=None, amplitudes=None,
+                     min_gap=0.001, spikes=None, bin_width=0.001, blocks_per_chunk=1000, keep_epochs=False):
+    """Stimulus-triggered averages of an RHS file's amplifier data, in one pass over the memory-mapped file.
+
+    Trials start at stimulation onsets found in the stimulation current of
+    stim_channels (default: all; see find_stim_onsets(), min_gap in seconds)
+    or, if onsets is given, at those timestamps (in samples, e.g. the
+    stream timestamps of manualstimtriggerpulse commands), with amplitudes
+    (default: all 0) for grouping.  Each trial's epoch runs from pre seconds
+    before to post seconds after the onset on every channel in channels
+    (default: all); trials whose epoch runs off the file are skipped.  The
+    file is read blocks_per_chunk datablocks at a time, so thousands of
+    trials take a single pass and memory does not grow with their number.
+
+    spikes is an optional event table (parse_spike_events(),
+    SpikeDetector.process() or index-compatible: 'channels' names,
+    'channel' indices, 'timestamp'), giving peri-stimulus histograms with
+    bin_width second bins.
+
+    Returns a dictionary with 'amplitudes' (sorted, microamps), 'trials'
+    per amplitude, 't' (epoch sample times relative to the onset, seconds),
+    'mean' and 'sem' (amplitudes x channels x samples, microvolts),
+    'onset_timestamps', 'onset_amplitudes', 'skipped', 'channels' (the
+    amplifier channel indices), and with spikes 'psth' (spikes per second
+    per trial, amplitudes x channels x bins), 'psth_counts' and
+    'bin_edges'.  With keep_epochs, 'epochs' holds every trial
+    (trials x channels x samples, float32).
+    """
+    rhs = filename if isinstance(filename, RhsFile) else RhsFile(filename)
+    header = rhs.header
+    sample_rate = rhs.sample_rate
+    num_samples = rhs.num_samples
+    pre_samples = int(round(pre * sample_rate))
+    post_samples = int(round(post * sample_rate))
+    length = pre_samples + post_samples
+
+    channel_index = (np.arange(header['num_amplifier_channels']) if channels is None
+                     else amplifier_channel_indices(header, channels))
+    stim_index = (np.arange(header['num_amplifier_channels']) if stim_channels is None
+                  else amplifier_channel_indices(header, stim_channels))
+    if onsets is not None:
+        onsets = np.asarray(onsets, dtype=np.int64)
+        amplitudes = np.zeros(len(onsets)) if amplitudes is None else np.asarray(amplitudes, dtype=np.float64)
+        order = np.argsort(onsets, kind='stable')
+        onsets, amplitudes = onsets[order], amplitudes[order]
+
+    averager = EvokedAverager()
+    onset_timestamps = []
+    onset_amplitudes = []
+    epochs = []
+    skipped = 0
+    state = None
+    chunk_samples = 128 * blocks_per_chunk
+    for first in range(0, num_samples, chunk_samples):
+        last = min(first + chunk_samples, num_samples)
+        if onsets is None:
+            samples, chunk_amplitudes, state = find_stim_onsets(rhs.stim[stim_index, first:last],
+                                                                int(round(min_gap * sample_rate)), state)
+        else:
+            timestamps = rhs.t.read_raw(None, slice(first, last))
+            inside = (onsets >= timestamps[0]) & (onsets <= timestamps[-1])
+            local = np.searchsorted(timestamps, onsets[inside])
+            found = timestamps[local] == onsets[inside]
+            samples, chunk_amplitudes = first + local[found], amplitudes[inside][found]
+
+        whole = (samples - pre_samples >= 0) & (samples + post_samples <= num_samples)
+        skipped += int(np.count_nonzero(~whole))
+        samples, chunk_amplitudes = samples[whole], np.round(chunk_amplitudes[whole], 6)
+        if len(samples) == 0 or length == 0:
+            continue
+
+        # One read covering every epoch of the chunk, which may reach into its neighbours.
+        start = int(samples[0]) - pre_samples
+        data = rhs.amplifier[channel_index, start:int(samples[-1]) + post_samples]
+        chunk_epochs = sliding_window_view(data, length, axis=1)[:, samples - pre_samples - start].transpose(1, 0, 2)
+        averager.add(chunk_epochs, chunk_amplitudes)
+        if keep_epochs:
+            epochs.append(chunk_epochs.astype(np.float32))
+        onset_timestamps.append(rhs.t.read_raw(None, samples))
+        onset_amplitudes.append(chunk_amplitudes)
+
+    result = averager.results()
+    result['t'] = (np.arange(length) - pre_samples) / sample_rate
+    result['onset_timestamps'] = np.concatenate(onset_timestamps) if onset_timestamps else np.empty(0, dtype=np.int32)
+    result['onset_amplitudes'] = np.concatenate(onset_amplitudes) if onset_amplitudes else np.empty(0)
+    # Given onsets that are not in the file at all count as skipped too.
+    result['skipped'] = skipped if onsets is None else len(onsets) - len(result['onset_timestamps'])
+    result['channels'] = channel_index
+    if keep_epochs:
+        result['epochs'] = (np.concatenate(epochs) if epochs
+                            else np.empty((0, len(channel_index), length), dtype=np.float32))
+    if spikes is not None:
+        positions = spike_channel_positions(header, channel_index, spikes['channels'])
+        add_psth(result, positions[spikes['channel']], spikes['timestamp'], len(channel_index), sample_rate,
+                 pre_samples, post_samples, bin_width)
+    return result
+
+
+def evoked_responses_from_arrays(amplifier_data, timestamps, onset_timestamps, sample_rate, amplitudes=None, pre=0.005,
+                                 post=0.05, spikes=None, bin_width=0.001):
+    """Like evoked_responses(), for data already in memory, e.g. decoded from the TCP waveform port.
+
+    amplifier_data is (channels x samples) with the sample timestamps in
+    timestamps; onset_timestamps are stimulation onsets (e.g. from
+    find_stim_onsets() on the stim band, or recorded trigger times) with
+    optional amplitudes.  spikes channel names are taken as row numbers of
+    amplifier_data.
+    """
+    amplifier_data = np.atleast_2d(amplifier_data)
+    timestamps = np.asarray(timestamps)
+    pre_samples = int(round(pre * sample_rate))
+    post_samples = int(round(post * sample_rate))
+    length = pre_samples + post_samples
+    onset_timestamps = np.asarray(onset_timestamps, dtype=np.int64)
+    amplitudes = np.zeros(len(onset_timestamps)) if amplitudes is None else np.asarray(amplitudes, dtype=np.float64)
+
+    samples = np.searchsorted(timestamps, onset_timestamps)
+    found = samples < len(timestamps)
+    found[found] = timestamps[samples[found]] == onset_timestamps[found]
+    whole = found & (samples - pre_samples >= 0) & (samples + post_samples <= amplifier_data.shape[1])
+
+    averager = EvokedAverager()
+    if np.any(whole) and length > 0:
+        windows = sliding_window_view(amplifier_data, length, axis=1)[:, samples[whole] - pre_samples]
+        averager.add(windows.transpose(1, 0, 2), amplitudes[whole])
+    result = averager.results()
+    result['t'] = (np.arange(length) - pre_samples) / sample_rate
+    result['onset_timestamps'] = onset_timestamps[whole]
+    result['onset_amplitudes'] = np.round(amplitudes[whole], 6)
+    result['skipped'] = int(np.count_nonzero(~whole))
+    if spikes is not None:
+        positions = np.array([int(name) if str(name).isdigit() else -1 for name in spikes['channels']], dtype=np.int64)
+        add_psth(result, positions[spikes['channel']], spikes['timestamp'], amplifier_data.shape[0], sample_rate,
+                 pre_samples, post_samples, bin_width)
+    return result
+
+
+def add_psth(result, spike_channels, spike_timestamps, num_channels, sample_rate, pre_samples, post_samples, bin_width):
+    """Adds 'psth_counts', 'psth' and 'bin_edges' for the onsets and amplitude groups in result."""
+    bin_size = max(1, int(round(bin_width * sample_rate)))
+    groups = np.searchsorted(result['amplitudes'], np.round(result['onset_amplitudes'], 6))
+    counts = peristimulus_histogram(spike_timestamps, spike_channels, num_channels, result['onset_timestamps'], groups,
+                                    len(result['amplitudes']), pre_samples, post_samples, bin_size)
+    result['psth_counts'] = counts
+    trials = np.maximum(result['trials'], 1)[:, np.newaxis, np.newaxis]
+    result['psth'] = counts / trials / (bin_size / sample_rate)
+    result['bin_edges'] = (np.arange(counts.shape[2] + 1) * bin_size - pre_samples) / sample_rate
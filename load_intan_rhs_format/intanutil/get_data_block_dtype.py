@@ -0,0 +1,39 @@
+#! /bin/env python
+#
+# Structured dtype matching the layout summed up by get_bytes_per_data_block().
+
+import numpy as np
+
+
+def get_data_block_dtype(header):
+    """Builds a NumPy structured dtype describing one 128-sample datablock.
+
+    Fields are only present for signals that are actually stored in the file,
+    in the same order (and with the same sizes) as get_bytes_per_data_block().
+    """
+    N = 128 # n of amplifier samples
+    fields = [('timestamps', '<i4', (N,))]
+
+    if header['num_amplifier_channels'] > 0:
+        fields.append(('amplifier', '<u2', (header['num_amplifier_channels'], N)))
+
+        # DC amplifier voltage (absent if flag was off)
+        if header['dc_amplifier_data_saved'] > 0:
+            fields.append(('dc_amplifier', '<u2', (header['num_amplifier_channels'], N)))
+
+        # Stimulation data, one per enabled amplifier channels
+        fields.append(('stim', '<u2', (header['num_amplifier_channels'], N)))
+
+    if header['num_board_adc_channels'] > 0:
+        fields.append(('board_adc', '<u2', (header['num_board_adc_channels'], N)))
+
+    if header['num_board_dac_channels'] > 0:
+        fields.append(('board_dac', '<u2', (header['num_board_dac_channels'], N)))
+
+    if header['num_board_dig_in_channels'] > 0:
+        fields.append(('board_dig_in', '<u2', (N,)))
+
+    if header['num_board_dig_out_channels'] > 0:
+        fields.append(('board_dig_out', '<u2', (N,)))
+
+    return np.dtype(fields)
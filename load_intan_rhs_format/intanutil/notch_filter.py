@@ -5,6 +5,11 @@
 import math
 import numpy as np
 
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
+
 def notch_filter(input, fSample, fNotch, Bandwidth):
     """Implements a notch filter (e.g., for 50 or 60 Hz) on vector 'input'.
 
@@ -21,12 +26,31 @@ def notch_filter(input, fSample, fNotch, Bandwidth):
     out = notch_filter(input, 30000, 60, 10);
     """
 
-    tstep = 1.0/fSample
-    Fc = fNotch*tstep
-
     L = len(input)
 
     # Calculate IIR filter parameters
+    b, a = notch_filter_coefficients(fSample, fNotch, Bandwidth)
+    (b0, b1, b2), (a0, a1, a2) = b.tolist(), a.tolist()
+
+    out = np.zeros(len(input))
+    out[0] = input[0]
+    out[1] = input[1]
+    # (If filtering a continuous data stream, change out[0:1] to the
+    #  previous final two values of out.)
+
+    # Run filter
+    for i in range(2,L):
+        out[i] = (b2*input[i-2] + b1*input[i-1] + b0*input[i] - a2*out[i-2] - a1*out[i-1])/a0
+
+    return out
+
+
+def notch_filter_coefficients(fSample, fNotch, Bandwidth):
+    """Returns the (b, a) IIR coefficients of the notch filter, as used by notch_filter() and notch_filter_channels()."""
+
+    tstep = 1.0/fSample
+    Fc = fNotch*tstep
+
     d = math.exp(-2.0*math.pi*(Bandwidth/2.0)*tstep)
     b = (1.0 + d*d) * math.cos(2.0*math.pi*Fc)
     a0 = 1.0
@@ -37,14 +61,84 @@ def notch_filter(input, fSample, fNotch, Bandwidth):
     b1 = -2.0 * math.cos(2.0*math.pi*Fc)
     b2 = 1.0
 
-    out = np.zeros(len(input))
-    out[0] = input[0]
-    out[1] = input[1]
-    # (If filtering a continuous data stream, change out[0:1] to the
-    #  previous final two values of out.)
+    return np.array([a*b0, a*b1, a*b2]), np.array([a0, a1, a2])
 
-    # Run filter
-    for i in range(2,L):
-        out[i] = (a*b2*input[i-2] + a*b1*input[i-1] + a*b0*input[i] - a2*out[i-2] - a1*out[i-1])/a0
 
-    return out
+def notch_filter_channels(input, fSample, fNotch, Bandwidth, state=None):
+    """Applies the notch_filter() IIR filter to every row of a (channels x samples) array at once.
+
+    Returns (out, state), with out as float64.  state holds the last two input and output samples
+    of each channel ({'input': channels x 2, 'output': channels x 2}); pass it
+    back in with the next consecutive chunk to continue the filter exactly as
+    if the whole signal had been filtered in a single call.  With state=None
+    the first two samples pass through unfiltered, as in notch_filter().
+
+    Uses scipy.signal.lfilter when SciPy is installed, otherwise a loop over
+    samples that is vectorized across channels.
+    """
+
+    input = np.asarray(input)
+    one_dim = input.ndim == 1
+    # Filter in float64 whatever the input type, so float32 data filtered in
+    # chunks matches a single pass.
+    x = np.atleast_2d(input).astype(np.float64, copy=False)
+
+    b, a = notch_filter_coefficients(fSample, fNotch, Bandwidth)
+    out = np.empty_like(x)
+
+    if state is None:
+        if x.shape[1] < 2:
+            raise Exception('The first chunk given to notch_filter_channels needs at least two samples.')
+        out[:, :2] = x[:, :2]
+        x_hist = x[:, :2].astype(np.float64)
+        y_hist = x_hist.copy()
+        start = 2
+    else:
+        x_hist = np.array(state['input'], dtype=np.float64)
+        y_hist = np.array(state['output'], dtype=np.float64)
+        start = 0
+
+    if x.shape[1] > start:
+        if lfilter is not None:
+            # Convert the last two inputs/outputs into direct form II transposed state.
+            zi = np.empty((x.shape[0], 2))
+            zi[:, 0] = b[1]*x_hist[:, 1] + b[2]*x_hist[:, 0] - a[1]*y_hist[:, 1] - a[2]*y_hist[:, 0]
+            zi[:, 1] = b[2]*x_hist[:, 1] - a[2]*y_hist[:, 1]
+            out[:, start:], _ = lfilter(b, a, x[:, start:], axis=1, zi=zi)
+        else:
+            xm2, xm1 = x_hist[:, 0], x_hist[:, 1]
+            ym2, ym1 = y_hist[:, 0], y_hist[:, 1]
+            for i in range(start, x.shape[1]):
+                xi = x[:, i]
+                out[:, i] = b[2]*xm2 + b[1]*xm1 + b[0]*xi - a[2]*ym2 - a[1]*ym1
+                xm2, xm1 = xm1, xi
+                ym2, ym1 = ym1, out[:, i]
+
+    # Last two samples of input and output, falling back on the previous state for short chunks.
+    state = {'input': np.concatenate([x_hist, x], axis=1)[:, -2:].astype(np.float64),
+             'output': np.concatenate([y_hist, out], axis=1)[:, -2:].astype(np.float64)}
+
+    if one_dim:
+        out = out[0]
+    return out, state
+
+
+if __name__ == '__main__':
+    # Parity check of notch_filter_channels() against notch_filter(), both for
+    # a single call and for the same data fed in uneven chunks.
+    rng = np.random.default_rng(0)
+    data = np.cumsum(rng.normal(size=(4, 30000)), axis=1) + 60 * np.sin(np.arange(30000) * 2 * np.pi * 60 / 30000)
+    expected = np.array([notch_filter(row, 30000, 60, 10) for row in data])
+
+    whole, _ = notch_filter_channels(data, 30000, 60, 10)
+    chunked, state = [], None
+    for chunk in np.array_split(data, [2, 3, 1000, 1001, 17000], axis=1):
+        out, state = notch_filter_channels(chunk, 30000, 60, 10, state)
+        chunked.append(out)
+    chunked = np.concatenate(chunked, axis=1)
+
+    scale = np.max(np.abs(expected))
+    print('single call: max abs difference {:.3g} (signal peak {:.3g})'.format(np.max(np.abs(whole - expected)), scale))
+    print('chunked:     max abs difference {:.3g} (signal peak {:.3g})'.format(np.max(np.abs(chunked - expected)), scale))
+    assert np.allclose(whole, expected, rtol=0, atol=1e-9 * scale)
+    assert np.allclose(chunked, expected, rtol=0, atol=1e-9 * scale)
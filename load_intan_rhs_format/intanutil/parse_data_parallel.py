@@ -0,0 +1,59 @@
+#! /bin/env python
+#
+# Thread-pool version of the 'Parsing data...' stage of read_data().
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from intanutil.notch_filter import notch_filter_channels
+from intanutil.select_data import notch_filter_applies
+from intanutil.scale_data import convert_signals, empty_signals
+
+
+def parse_data_parallel(data, header, workers, dtype='float64', digital='dense'):
+    """Scales and decodes the raw arrays in data in place, using a pool of workers threads.
+
+    Produces the same entries as the serial code in read_data() (digital
+    channels, stimulation flags and current, scaled amplifier / DC / ADC / DAC
+    data and, where it applies, the software notch filter).  The element-wise
+    conversions are split into column (sample) ranges and the notch filter
+    into groups of channels; NumPy releases the GIL inside these kernels, so
+    the work runs concurrently.  Timestamps, and with digital='edges' the
+    digital and stimulation flag edge tables, are left to the caller.
+    """
+    num_samples = len(data['t'])
+    num_amplifier_channels = header['num_amplifier_channels']
+
+    # Pre-allocate every output so that workers only ever write into slices.
+    out = empty_signals(header, (num_samples,), dtype, digital)
+    if dtype == 'raw':
+        # Unscaled signals are kept as they are.
+        for key in ('amplifier_data', 'dc_amplifier_data', 'board_adc_data', 'board_dac_data'):
+            if key in data:
+                out[key] = data[key]
+
+    raw_keys = ('amplifier_data', 'dc_amplifier_data', 'stim_data_raw', 'board_adc_data', 'board_dac_data',
+                'board_dig_in_raw', 'board_dig_out_raw')
+    scaled = [key for key in out if dtype != 'raw' or key not in raw_keys]
+
+    def convert_columns(columns):
+        raw = {key: data[key][..., columns] for key in raw_keys if key in data}
+        convert_signals(raw, header, dtype, out={key: out[key][..., columns] for key in scaled}, digital=digital)
+
+    def notch_rows(rows):
+        out['amplifier_data'][rows], _ = notch_filter_channels(out['amplifier_data'][rows], header['sample_rate'],
+                                                               header['notch_filter_frequency'], 10)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # A few column ranges per worker keeps the load balanced.  Ranges are
+        # whole datablocks, so each one stays a reasonable size.
+        num_blocks = num_samples // 128
+        bounds = 128 * np.linspace(0, num_blocks, min(num_blocks, 4 * workers) + 1).astype(int)
+        list(pool.map(convert_columns, [slice(b0, b1) for b0, b1 in zip(bounds[:-1], bounds[1:]) if b1 > b0]))
+
+        if notch_filter_applies(header, dtype):
+            bounds = np.linspace(0, num_amplifier_channels, min(num_amplifier_channels, workers) + 1).astype(int)
+            list(pool.map(notch_rows, [slice(r0, r1) for r0, r1 in zip(bounds[:-1], bounds[1:]) if r1 > r0]))
+
+    data.update(out)
+    return data
@@ -17,22 +17,18 @@ def read_qstring(fid):
     length, = struct.unpack('<I', fid.read(4))
     if length == int('ffffffff', 16): return ""
 
-    if length > (os.fstat(fid.fileno()).st_size - fid.tell() + 1) :
-        print(length)
-        raise Exception('Length too long.')
-
-    # convert length from bytes to 16-bit Unicode words
-    length = int(length / 2)
-
-    data = []
-    for i in range(0, length):
-        c, = struct.unpack('<H', fid.read(2))
-        data.append(c)
-
-    if sys.version_info >= (3,0):
-        a = ''.join([chr(c) for c in data])
-    else:
-        a = ''.join([unichr(c) for c in data])
+    # Only long strings are checked against the file size up front (a corrupt
+    # length word must not trigger a huge read); for short ones a short read
+    # below catches the same problem without an fstat() per string.
+    if length > 65536 and length > (os.fstat(fid.fileno()).st_size - fid.tell() + 1):
+        raise Exception('Length too long ({} bytes).'.format(length))
+
+    # Decode the whole string in one read.  Surrogate pairs become a single
+    # character; surrogatepass keeps any unpaired UTF-16 code unit as it is.
+    data = fid.read(length - length % 2)
+    if len(data) != length - length % 2:
+        raise Exception('Length too long ({} bytes).'.format(length))
+    a = data.decode('utf-16-le', 'surrogatepass')
 
     return a
   
@@ -0,0 +1,87 @@
+#! /bin/env python
+#
+# Bulk replacement for calling read_one_data_block() once per datablock.
+
+import numpy as np
+from intanutil.get_data_block_dtype import get_data_block_dtype
+from intanutil.select_data import signal_selected
+
+
+def read_all_data_blocks(header, fid, num_data_blocks):
+    """Reads num_data_blocks datablocks from fid in one bulk read.
+
+    Returns a data dictionary with the same keys and values that a
+    read_one_data_block() loop would fill in, with every signal transposed
+    into channel-major (channels x samples) arrays of the file's own 16-bit
+    (32-bit for timestamps) types.
+    """
+    block_dtype = get_data_block_dtype(header)
+    blocks = np.fromfile(fid, dtype=block_dtype, count=num_data_blocks)
+    if len(blocks) != num_data_blocks:
+        raise Exception('Error: File ended in the middle of the data section.')
+
+    return blocks_to_data(header, blocks)
+
+
+def blocks_to_data(header, blocks, out=None):
+    """Converts an array of structured datablocks into channel-major arrays.
+
+    If out is given it must hold arrays of the right shapes for every key
+    (as returned by a previous call), and they are filled in place.
+
+    header may come from select_header(), in which case only the selected
+    signals and amplifier channels are copied out of blocks (which can be a
+    memory map of the whole file).
+    """
+    num_samples = 128 * len(blocks)
+    num_amplifier_channels = header['num_amplifier_channels']
+    if out is None:
+        out = {}
+        out['t'] = np.empty(num_samples, dtype=np.int32)
+        if signal_selected(header, 'amplifier'):
+            out['amplifier_data'] = np.empty((num_amplifier_channels, num_samples), dtype=np.uint16)
+        if header['dc_amplifier_data_saved']:
+            out['dc_amplifier_data'] = np.empty((num_amplifier_channels, num_samples), dtype=np.uint16)
+        if signal_selected(header, 'stim'):
+            out['stim_data_raw'] = np.empty((num_amplifier_channels, num_samples), dtype=np.uint16)
+        if signal_selected(header, 'board_adc'):
+            out['board_adc_data'] = np.empty((header['num_board_adc_channels'], num_samples), dtype=np.uint16)
+        if signal_selected(header, 'board_dac'):
+            out['board_dac_data'] = np.empty((header['num_board_dac_channels'], num_samples), dtype=np.uint16)
+        if signal_selected(header, 'board_dig_in'):
+            out['board_dig_in_raw'] = np.zeros(num_samples, dtype=np.uint16)
+        if signal_selected(header, 'board_dig_out'):
+            out['board_dig_out_raw'] = np.zeros(num_samples, dtype=np.uint16)
+
+    names = blocks.dtype.names
+    index = header.get('amplifier_channel_index')
+    out['t'].reshape(len(blocks), 128)[...] = blocks['timestamps']
+    for field, key in (('amplifier', 'amplifier_data'), ('dc_amplifier', 'dc_amplifier_data'), ('stim', 'stim_data_raw')):
+        if field in names and key in out and num_amplifier_channels > 0:
+            channel_major(blocks, field, out[key], index)
+    for field, key in (('board_adc', 'board_adc_data'), ('board_dac', 'board_dac_data')):
+        if field in names and key in out:
+            channel_major(blocks, field, out[key])
+    if 'board_dig_in' in names and 'board_dig_in_raw' in out:
+        out['board_dig_in_raw'].reshape(len(blocks), 128)[...] = blocks['board_dig_in']
+    if 'board_dig_out' in names and 'board_dig_out_raw' in out:
+        out['board_dig_out_raw'].reshape(len(blocks), 128)[...] = blocks['board_dig_out']
+
+    return out
+
+
+def channel_major(blocks, field, out, index=None):
+    """Copies a (blocks x channels x 128) field into a (channels x samples) array.
+
+    With index, only those channels are copied, a bounded run of blocks at a
+    time so that no temporary holds more than a few MB.
+    """
+    view = out.reshape(out.shape[0], len(blocks), 128)
+    if view.size > 0 and not np.may_share_memory(view, out):
+        raise Exception('Output array must be reshapeable to (channels, blocks, 128) without copying.')
+    if index is None:
+        view[...] = blocks[field].transpose(1, 0, 2)
+    else:
+        step = max(1, (1 << 20) // max(1, 128 * len(index)))
+        for b0 in range(0, len(blocks), step):
+            view[:, b0:b0 + step] = blocks[field][b0:b0 + step, index].transpose(1, 0, 2)
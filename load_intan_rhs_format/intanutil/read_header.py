@@ -8,8 +8,11 @@ import sys, struct
 from intanutil.qstring import read_qstring
 
 
-def read_header(fid):
-    """Reads the Intan File Format header from the given file."""
+def read_header(fid, verbose=True):
+    """Reads the Intan File Format header from the given file.
+
+    With verbose=False nothing is printed (used when scanning many files).
+    """
 
     # Check 'magic number' at beginning of file to make sure this is an Intan
     # Technologies RHD2000 data file.
@@ -23,9 +26,10 @@ def read_header(fid):
     (version['major'], version['minor']) = struct.unpack('<hh', fid.read(4))
     header['version'] = version
 
-    print('')
-    print('Reading Intan Technologies RHS2000 Data File, Version {}.{}'.format(version['major'], version['minor']))
-    print('')
+    if verbose:
+        print('')
+        print('Reading Intan Technologies RHS2000 Data File, Version {}.{}'.format(version['major'], version['minor']))
+        print('')
 
     # Read information of sampling rate and amplifier frequency settings.
     header['sample_rate'], = struct.unpack('<f', fid.read(4))
@@ -95,7 +99,8 @@ def read_header(fid):
 
     # Read signal summary from data file header.
     number_of_signal_groups, = struct.unpack('<h', fid.read(2))
-    print('n signal groups {}'.format(number_of_signal_groups))
+    if verbose:
+        print('n signal groups {}'.format(number_of_signal_groups))
 
     for signal_group in range(1, number_of_signal_groups + 1):
         signal_group_name = read_qstring(fid)
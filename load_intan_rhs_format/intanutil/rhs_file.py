@@ -0,0 +1,196 @@
+#! /bin/env python
+#
+# Lazy, memory-mapped access to the data section of an RHS file.
+
+import os
+import numpy as np
+
+from intanutil.read_header import read_header
+from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+from intanutil.get_data_block_dtype import get_data_block_dtype
+from intanutil.scale_data import (scale_amplifier_data, scale_dc_amplifier_data, scale_board_analog_data,
+                                  decode_stim_current, extract_digital_channels)
+from intanutil.digital_events import signal_edges
+
+
+class RhsFile(object):
+    """Memory-mapped view of an Intan RHS2000 data file.
+
+    Only the header is parsed when the file is opened.  Each signal is exposed
+    as a sliceable attribute; indexing it reads just the datablocks that cover
+    the requested samples and scales/decodes only the returned slice:
+
+        f = RhsFile('recording.rhs')
+        uv = f.amplifier[[0, 3], 30000:60000]   # microvolts, 2 x 30000
+        amps = f.stim[:, :1000]                   # microamps
+        secs = f.t[:1000]                         # seconds
+
+    Channel-major signals take [channels, samples] indices; 't' and the raw
+    digital words take a single sample index.  The software notch filter that
+    read_data() applies to files older than version 3 is not applied here.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fid:
+            self.header = read_header(fid, verbose=False)
+            self.data_offset = fid.tell()
+
+        bytes_per_block = get_bytes_per_data_block(self.header)
+        bytes_remaining = os.path.getsize(filename) - self.data_offset
+        if bytes_remaining % bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+
+        self.num_data_blocks = bytes_remaining // bytes_per_block
+        self.num_samples = 128 * self.num_data_blocks
+        self.sample_rate = self.header['sample_rate']
+
+        if self.num_data_blocks > 0:
+            self.blocks = np.memmap(filename, dtype=get_data_block_dtype(self.header), mode='r',
+                                    offset=self.data_offset, shape=(self.num_data_blocks,))
+        else:
+            self.blocks = np.zeros(0, dtype=get_data_block_dtype(self.header))
+
+        header = self.header
+        num_amplifier_channels = header['num_amplifier_channels']
+        stim_step_size = header['stim_step_size']
+
+        self.t = SignalView(self, 'timestamps', None, lambda raw: raw / header['sample_rate'])
+        self.amplifier = SignalView(self, 'amplifier', num_amplifier_channels, scale_amplifier_data)
+        if header['dc_amplifier_data_saved']:
+            self.dc_amplifier = SignalView(self, 'dc_amplifier', num_amplifier_channels, scale_dc_amplifier_data)
+        self.stim = SignalView(self, 'stim', num_amplifier_channels,
+                               lambda raw: decode_stim_current(raw, stim_step_size))
+        self.compliance_limit = SignalView(self, 'stim', num_amplifier_channels,
+                                           lambda raw: np.bitwise_and(raw, 32768) >= 1)
+        self.charge_recovery = SignalView(self, 'stim', num_amplifier_channels,
+                                          lambda raw: np.bitwise_and(raw, 16384) >= 1)
+        self.amp_settle = SignalView(self, 'stim', num_amplifier_channels,
+                                     lambda raw: np.bitwise_and(raw, 8192) >= 1)
+        self.board_adc = SignalView(self, 'board_adc', header['num_board_adc_channels'], scale_board_analog_data)
+        self.board_dac = SignalView(self, 'board_dac', header['num_board_dac_channels'], scale_board_analog_data)
+        self.board_dig_in_raw = SignalView(self, 'board_dig_in', None)
+        self.board_dig_out_raw = SignalView(self, 'board_dig_out', None)
+
+    def board_dig_in(self, t_index=slice(None)):
+        """Boolean (channels x samples) digital input data for the given samples."""
+        return extract_digital_channels(self.board_dig_in_raw[t_index], self.header['board_dig_in_channels'])
+
+    def board_dig_out(self, t_index=slice(None)):
+        """Boolean (channels x samples) digital output data for the given samples."""
+        return extract_digital_channels(self.board_dig_out_raw[t_index], self.header['board_dig_out_channels'])
+
+    def board_dig_in_edges(self):
+        """Rising / falling edge table of the digital inputs (see digital_events.py), read straight from the map."""
+        return self.digital_edges('board_dig_in')
+
+    def board_dig_out_edges(self):
+        """Rising / falling edge table of the digital outputs (see digital_events.py), read straight from the map."""
+        return self.digital_edges('board_dig_out')
+
+    def digital_edges(self, signal):
+        if signal not in self.blocks.dtype.names:
+            raise KeyError('Signal {} is not stored in this file.'.format(signal))
+        # (blocks x 128) words are contiguous per block; signal_edges() copies them a chunk at a time.
+        words = self.blocks[signal].reshape(-1)
+        return signal_edges({signal + '_raw': words}, self.header)[0][signal + '_edges']
+
+    def close(self):
+        """Releases the memory map."""
+        self.blocks = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return 'RhsFile({!r}, {} amplifier channels, {} samples)'.format(
+            self.filename, self.header['num_amplifier_channels'], self.num_samples)
+
+
+class SignalView(object):
+    """Sliceable view of one signal of an RhsFile.
+
+    num_channels is None for single-row signals (timestamps and the packed
+    digital words).  convert is applied to the raw words of the selected slice.
+    """
+
+    def __init__(self, rhs_file, field, num_channels, convert=None):
+        self.rhs_file = rhs_file
+        self.field = field
+        self.num_channels = num_channels
+        self.convert = convert
+
+    @property
+    def shape(self):
+        if self.num_channels is None:
+            return (self.rhs_file.num_samples,)
+        return (self.num_channels, self.rhs_file.num_samples)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if self.num_channels is None:
+            ch_index, t_index = None, key
+        elif isinstance(key, tuple):
+            if len(key) != 2:
+                raise IndexError('Expected [channels, samples] index.')
+            ch_index, t_index = key
+        else:
+            ch_index, t_index = key, slice(None)
+
+        raw = self.read_raw(ch_index, t_index)
+        if self.convert is None:
+            return raw
+        return self.convert(raw)
+
+    def read_raw(self, ch_index, t_index):
+        """Returns the unscaled words for the given channel and sample indices."""
+        num_samples = self.rhs_file.num_samples
+        if isinstance(t_index, slice):
+            samples = range(*t_index.indices(num_samples))
+        else:
+            samples = np.asarray(t_index)
+            if samples.dtype == bool:
+                samples = np.flatnonzero(samples)
+            samples = np.where(samples < 0, samples + num_samples, samples)
+            if np.any((samples < 0) | (samples >= num_samples)):
+                raise IndexError('Sample index out of range.')
+
+        # Only map in the datablocks spanned by the requested samples.
+        if isinstance(samples, range):
+            bounds = (samples[0], samples[-1]) if len(samples) > 0 else None
+        else:
+            bounds = (samples.min(), samples.max()) if samples.size > 0 else None
+        if bounds is None:
+            first_block, last_block = 0, 0
+        else:
+            first_block = int(min(bounds)) // 128
+            last_block = int(max(bounds)) // 128 + 1
+        blocks = self.rhs_file.blocks[first_block:last_block]
+
+        if self.field not in blocks.dtype.names:
+            raise KeyError('Signal {} is not stored in this file.'.format(self.field))
+        raw = blocks[self.field]
+
+        if isinstance(samples, range):
+            local = slice(samples.start - 128 * first_block,
+                          samples.stop - 128 * first_block if samples.stop >= 128 * first_block else None,
+                          samples.step)
+        else:
+            local = samples - 128 * first_block
+
+        if self.num_channels is None:
+            return np.asarray(raw.reshape(-1)[local])
+
+        if ch_index is None:
+            ch_index = slice(None)
+        raw = raw[:, ch_index, :]
+        if raw.ndim == 2:
+            # A single integer channel index was given.
+            return np.asarray(raw.reshape(-1)[local])
+        raw = raw.transpose(1, 0, 2).reshape(raw.shape[1], 128 * raw.shape[0])
+        return np.asarray(raw[:, local])
@@ -0,0 +1,222 @@
+#! /bin/env python
+#
+# Conversions from raw 16-bit sample words to physical units, shared by
+# read_data() and the lazy / chunked readers.
+#
+# Every function optionally writes into a preallocated 'out' array instead of
+# allocating its result; the values are the same either way.
+
+import numpy as np
+
+from intanutil.select_data import signal_selected
+
+# How loaded signals are stored:
+#   'raw'     - the 16-bit words from the file, plus result['scale_parameters']
+#   'float32' - scaled to physical units as float32
+#   'float64' - scaled to physical units as float64
+DTYPE_POLICIES = ('raw', 'float32', 'float64')
+
+# How digital inputs / outputs and the stimulation flags are returned:
+#   'dense' - boolean (channels x samples) '..._data' arrays
+#   'edges' - sparse '..._edges' tables of rising and falling edges (see digital_events.py)
+DIGITAL_POLICIES = ('dense', 'edges')
+
+
+def check_dtype_policy(dtype):
+    """Validates a dtype policy name and returns it."""
+    if dtype not in DTYPE_POLICIES:
+        raise Exception('Unknown dtype policy {!r}; expected one of {}.'.format(dtype, ', '.join(DTYPE_POLICIES)))
+    return dtype
+
+
+def check_digital_policy(digital):
+    """Validates a digital policy name and returns it."""
+    if digital not in DIGITAL_POLICIES:
+        raise Exception('Unknown digital policy {!r}; expected one of {}.'.format(digital, ', '.join(DIGITAL_POLICIES)))
+    return digital
+
+
+def scale_parameters(header):
+    """Describes how to turn 'raw' policy arrays into physical units: value = scale * (raw - offset)."""
+    return {'t': {'scale': 1.0 / header['sample_rate'], 'offset': 0, 'units': 'seconds'},
+            'amplifier_data': {'scale': 0.195, 'offset': 32768, 'units': 'microvolts'},
+            'dc_amplifier_data': {'scale': -0.01923, 'offset': 512, 'units': 'volts'},
+            'stim_data': {'scale': header['stim_step_size'] / 1.0e-6, 'offset': 0, 'units': 'microamps'},
+            'board_adc_data': {'scale': 0.0003125, 'offset': 32768, 'units': 'volts'},
+            'board_dac_data': {'scale': 0.0003125, 'offset': 32768, 'units': 'volts'}}
+
+
+def scale_amplifier_data(raw, out=None, dtype=np.float64):
+    """Scales raw amplifier samples to microvolts."""
+    return _scale(raw, 32768, 0.195, out, dtype)  # units = microvolts
+
+
+def scale_dc_amplifier_data(raw, out=None, dtype=np.float64):
+    """Scales raw DC amplifier samples to volts."""
+    return _scale(raw, 512, -0.01923, out, dtype)  # units = volts
+
+
+def scale_board_analog_data(raw, out=None, dtype=np.float64):
+    """Scales raw board ADC or DAC samples to volts."""
+    return _scale(raw, 32768, 0.0003125, out, dtype)  # units = volts
+
+
+def _scale(raw, offset, gain, out, dtype):
+    if out is None:
+        out = np.empty(np.shape(raw), dtype=dtype)
+    # 16-bit words are exact in float32 and float64, so no integer temporary is needed.
+    np.subtract(raw, offset, out=out, dtype=out.dtype)
+    np.multiply(gain, out, out=out)
+    return out
+
+
+def decode_stim_data(stim_data_raw, stim_step_size, out=None, dtype=np.float64):
+    """Splits raw stimulation words into flags and stimulation current (in microamps).
+
+    Returns a dictionary with 'compliance_limit_data', 'charge_recovery_data',
+    'amp_settle_data' and 'stim_data' entries.  With dtype=None, 'stim_data'
+    holds the signed number of current steps as int16 instead of microamps.
+    """
+    if out is None:
+        shape = np.shape(stim_data_raw)
+        out = {'compliance_limit_data': np.empty(shape, dtype=bool),
+               'charge_recovery_data': np.empty(shape, dtype=bool),
+               'amp_settle_data': np.empty(shape, dtype=bool),
+               'stim_data': np.empty(shape, dtype=np.int16 if dtype is None else dtype)}
+
+    np.greater_equal(np.bitwise_and(stim_data_raw, 32768), 1, out=out['compliance_limit_data']) # get 2^15 bit, interpret as True or False
+    np.greater_equal(np.bitwise_and(stim_data_raw, 16384), 1, out=out['charge_recovery_data']) # get 2^14 bit, interpret as True or False
+    np.greater_equal(np.bitwise_and(stim_data_raw, 8192), 1, out=out['amp_settle_data']) # get 2^13 bit, interpret as True or False
+    if dtype is None:
+        decode_stim_steps(stim_data_raw, out=out['stim_data'])
+    else:
+        decode_stim_current(stim_data_raw, stim_step_size, out=out['stim_data'])
+    return out
+
+
+def decode_stim_steps(stim_data_raw, out=None):
+    """Decodes the signed number of stimulation current steps (int16) from raw stimulation words."""
+    if out is None:
+        out = np.empty(np.shape(stim_data_raw), dtype=np.int16)
+    np.bitwise_and(stim_data_raw, 255, out=out, casting='unsafe') # get least-significant 8 bits corresponding to the current amplitude
+    np.negative(out, out=out, where=np.bitwise_and(stim_data_raw, 256) != 0) # 2^8 bit set means negative polarity
+    return out
+
+
+def decode_stim_current(stim_data_raw, stim_step_size, out=None, dtype=np.float64):
+    """Decodes only the signed stimulation current (in microamps) from raw stimulation words."""
+    if out is None:
+        out = np.empty(np.shape(stim_data_raw), dtype=dtype)
+    np.bitwise_and(stim_data_raw, 255, out=out) # get least-significant 8 bits corresponding to the current amplitude
+    # 0 - x rather than -x, so that zero amplitudes stay +0.0
+    np.subtract(0, out, out=out, where=np.bitwise_and(stim_data_raw, 256) != 0) # 2^8 bit set means negative polarity
+    np.divide(out, 1.0e-6, out=out)
+    np.multiply(stim_step_size, out, out=out)
+    return out
+
+
+def extract_digital_channels(raw, channels, out=None):
+    """Extracts one boolean row per digital channel from the packed 16-bit words.
+
+    channels is the list of channel dictionaries from the header (for example
+    header['board_dig_in_channels']); each channel's 'native_order' selects its bit.
+    """
+    if out is None:
+        out = np.zeros([len(channels)] + list(np.shape(raw)), dtype=bool)
+    for i in range(len(channels)):
+        np.not_equal(np.bitwise_and(raw, (1 << channels[i]['native_order'])), 0, out=out[i, ...])
+    return out
+
+
+def empty_signals(header, shape, dtype='float64', digital='dense'):
+    """Allocates the arrays filled in by convert_signals().
+
+    shape is the per-channel shape (e.g. (num_samples,)); dtype is a dtype
+    policy and digital a digital policy.
+    """
+    float_dtype = np.uint16 if dtype == 'raw' else np.dtype(dtype)
+    num_amplifier_channels = header['num_amplifier_channels']
+    shape = tuple(shape)
+
+    out = {}
+    if signal_selected(header, 'amplifier'):
+        out['amplifier_data'] = np.empty((num_amplifier_channels,) + shape, dtype=float_dtype)
+    if header['dc_amplifier_data_saved']:
+        out['dc_amplifier_data'] = np.empty((num_amplifier_channels,) + shape, dtype=float_dtype)
+    if signal_selected(header, 'stim'):
+        out['stim_data'] = np.empty((num_amplifier_channels,) + shape, dtype=np.int16 if dtype == 'raw' else float_dtype)
+        if digital == 'dense':
+            for key in ('compliance_limit_data', 'charge_recovery_data', 'amp_settle_data'):
+                out[key] = np.empty((num_amplifier_channels,) + shape, dtype=bool)
+    if signal_selected(header, 'board_adc'):
+        out['board_adc_data'] = np.empty((header['num_board_adc_channels'],) + shape, dtype=float_dtype)
+    if signal_selected(header, 'board_dac'):
+        out['board_dac_data'] = np.empty((header['num_board_dac_channels'],) + shape, dtype=float_dtype)
+    if signal_selected(header, 'board_dig_in') and digital == 'dense':
+        out['board_dig_in_data'] = np.empty((header['num_board_dig_in_channels'],) + shape, dtype=bool)
+    if signal_selected(header, 'board_dig_out') and digital == 'dense':
+        out['board_dig_out_data'] = np.empty((header['num_board_dig_out_channels'],) + shape, dtype=bool)
+    return out
+
+
+def convert_signals(raw, header, dtype='float64', out=None, digital='dense'):
+    """Turns the raw arrays of read_all_data_blocks() into the signals returned by read_data().
+
+    raw uses the keys of read_all_data_blocks() ('amplifier_data',
+    'stim_data_raw', 'board_dig_in_raw', ...).  Returns a dictionary with
+    'amplifier_data', 'stim_data', 'compliance_limit_data', 'board_adc_data',
+    'board_dig_in_data' and so on, stored according to the dtype policy, for
+    whichever raw arrays are present.  If out (from empty_signals()) is given,
+    results are written into it.  With digital='edges' the digital channels
+    and stimulation flags are left out; see signal_edges() for those.
+    """
+    check_dtype_policy(dtype)
+    check_digital_policy(digital)
+    if dtype == 'raw':
+        float_dtype = None
+        if out is None:
+            out = {}
+        # Unscaled words are returned as they are (or copied into out).
+        for key in ('amplifier_data', 'dc_amplifier_data', 'board_adc_data', 'board_dac_data'):
+            if key not in raw:
+                continue
+            if key in out:
+                out[key][...] = raw[key]
+            else:
+                out[key] = raw[key]
+    else:
+        float_dtype = np.dtype(dtype)
+        if out is None:
+            out = {}
+        if 'amplifier_data' in raw:
+            out['amplifier_data'] = scale_amplifier_data(raw['amplifier_data'], out=out.get('amplifier_data'),
+                                                         dtype=float_dtype)
+        if 'dc_amplifier_data' in raw:
+            out['dc_amplifier_data'] = scale_dc_amplifier_data(raw['dc_amplifier_data'], out=out.get('dc_amplifier_data'),
+                                                               dtype=float_dtype)
+        for key in ('board_adc_data', 'board_dac_data'):
+            if key in raw:
+                out[key] = scale_board_analog_data(raw[key], out=out.get(key), dtype=float_dtype)
+
+    # Extract stimulation data
+    if 'stim_data_raw' in raw and digital == 'edges':
+        # Only the current; the flags become edge tables.
+        if float_dtype is None:
+            out['stim_data'] = decode_stim_steps(raw['stim_data_raw'], out=out.get('stim_data'))
+        else:
+            out['stim_data'] = decode_stim_current(raw['stim_data_raw'], header['stim_step_size'],
+                                                   out=out.get('stim_data'), dtype=float_dtype)
+    elif 'stim_data_raw' in raw:
+        stim_out = None
+        if 'stim_data' in out:
+            stim_out = {key: out[key] for key in ('compliance_limit_data', 'charge_recovery_data', 'amp_settle_data', 'stim_data')}
+        out.update(decode_stim_data(raw['stim_data_raw'], header['stim_step_size'], out=stim_out, dtype=float_dtype))
+
+    # Extract digital input and output channels to separate variables.
+    if 'board_dig_in_raw' in raw and digital == 'dense':
+        out['board_dig_in_data'] = extract_digital_channels(raw['board_dig_in_raw'], header['board_dig_in_channels'],
+                                                            out=out.get('board_dig_in_data'))
+    if 'board_dig_out_raw' in raw and digital == 'dense':
+        out['board_dig_out_data'] = extract_digital_channels(raw['board_dig_out_raw'], header['board_dig_out_channels'],
+                                                             out=out.get('board_dig_out_data'))
+    return out
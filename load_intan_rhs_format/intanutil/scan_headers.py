@@ -0,0 +1,82 @@
+#! /bin/env python
+#
+# Header-only scanning of many RHS files.
+
+import sys, os
+from concurrent.futures import ThreadPoolExecutor
+
+from intanutil.read_header import read_header
+from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
+
+
+def read_header_only(filename, check_size=True):
+    """Reads just the header of an RHS file, without touching the data section.
+
+    Returns (header, data_offset, num_data_blocks).  With check_size=False a
+    data section that is not a whole number of datablocks (e.g. a recording
+    that was cut short) is accepted and the trailing partial block ignored.
+    """
+    filesize = os.path.getsize(filename)
+    with open(filename, 'rb') as fid:
+        header = read_header(fid, verbose=False)
+        data_offset = fid.tell()
+
+    bytes_per_block = get_bytes_per_data_block(header)
+    bytes_remaining = filesize - data_offset
+    if check_size and bytes_remaining % bytes_per_block != 0:
+        raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+
+    return header, data_offset, bytes_remaining // bytes_per_block
+
+
+def header_summary(filename, check_size=True):
+    """Returns a flat dictionary describing one RHS file, from its header alone."""
+    header, data_offset, num_data_blocks = read_header_only(filename, check_size)
+    num_samples = 128 * num_data_blocks
+
+    return {'filename': filename,
+            'file_size': os.path.getsize(filename),
+            'version': '{}.{}'.format(header['version']['major'], header['version']['minor']),
+            'sample_rate': header['sample_rate'],
+            'num_amplifier_channels': header['num_amplifier_channels'],
+            'num_board_adc_channels': header['num_board_adc_channels'],
+            'num_board_dac_channels': header['num_board_dac_channels'],
+            'num_board_dig_in_channels': header['num_board_dig_in_channels'],
+            'num_board_dig_out_channels': header['num_board_dig_out_channels'],
+            'dc_amplifier_data_saved': bool(header['dc_amplifier_data_saved']),
+            'notch_filter_frequency': header['notch_filter_frequency'],
+            'stim_step_size': header['stim_step_size'],
+            'notes': header['notes'],
+            'amplifier_channel_names': [c['native_channel_name'] for c in header['amplifier_channels']],
+            'data_offset': data_offset,
+            'num_data_blocks': num_data_blocks,
+            'num_samples': num_samples,
+            'duration': num_samples / header['sample_rate']}
+
+
+def scan_headers(paths, workers=8, check_size=True):
+    """Returns header_summary() for each of paths, reading the headers on a pool of threads.
+
+    Results are in the order of paths.  A file that cannot be parsed does not
+    stop the scan; its entry is {'filename': ..., 'error': message} instead.
+    """
+    def scan_one(filename):
+        try:
+            return header_summary(filename, check_size)
+        except Exception as e:
+            return {'filename': filename, 'error': str(e)}
+
+    paths = list(paths)
+    if workers is None or workers <= 1:
+        return [scan_one(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(scan_one, paths))
+
+
+if __name__ == '__main__':
+    for summary in scan_headers(sys.argv[1:]):
+        if 'error' in summary:
+            print('{}: {}'.format(summary['filename'], summary['error']))
+        else:
+            print('{filename}: v{version}, {num_amplifier_channels} amplifier channels, '
+                  '{duration:0.3f} s at {sample_rate:0.0f} S/s'.format(**summary))
@@ -0,0 +1,91 @@
+#! /bin/env python
+#
+# Channel and signal selection for the loaders.
+
+import numpy as np
+
+# Signals that can be selected with signals=[...].  'stim' covers stim_data
+# and the compliance limit / charge recovery / amp settle flags.
+SIGNALS = ('amplifier', 'dc_amplifier', 'stim', 'board_adc', 'board_dac', 'board_dig_in', 'board_dig_out')
+
+
+def signal_selected(header, signal):
+    """True unless header comes from select_header() and signal was left out."""
+    return signal in header.get('signals', SIGNALS)
+
+
+def notch_filter_applies(header, dtype='float64'):
+    """True if the software notch filter used during recording should be applied to the amplifier data.
+
+    Only files older than version 3 need it, and it is never applied to
+    unscaled ('raw' dtype policy) data.
+    """
+    return (header['notch_filter_frequency'] > 0 and header['version']['major'] < 3
+            and header['num_amplifier_channels'] > 0 and signal_selected(header, 'amplifier') and dtype != 'raw')
+
+
+def amplifier_channel_indices(header, channels):
+    """Converts a list of amplifier channel numbers and/or names to an index array.
+
+    Names are matched against each channel's native name (e.g. 'A-005') and
+    then its custom name.
+    """
+    names = {}
+    for i, channel in reversed(list(enumerate(header['amplifier_channels']))):
+        names[channel['custom_channel_name']] = i
+    for i, channel in reversed(list(enumerate(header['amplifier_channels']))):
+        names[channel['native_channel_name']] = i
+
+    index = []
+    for channel in channels:
+        if isinstance(channel, str):
+            if channel not in names:
+                raise Exception('No amplifier channel named {!r}.'.format(channel))
+            index.append(names[channel])
+        else:
+            if not -header['num_amplifier_channels'] <= channel < header['num_amplifier_channels']:
+                raise Exception('Amplifier channel {} out of range.'.format(channel))
+            index.append(channel % header['num_amplifier_channels'])
+    return np.array(index, dtype=np.intp)
+
+
+def select_header(header, channels=None, signals=None):
+    """Returns a copy of header that describes only the selected data.
+
+    channels picks amplifier channels (numbers or names, in the order given)
+    and applies to amplifier, DC amplifier and stimulation data; signals is
+    a list of names from SIGNALS.  Board signals that are not selected get a
+    channel count of zero.  The copy records the selection in
+    'signals' and 'amplifier_channel_index', which blocks_to_data() uses to
+    copy nothing but the selected samples out of the datablocks.
+    """
+    if signals is None:
+        signals = SIGNALS
+    if isinstance(signals, str):
+        signals = [signals]
+    for signal in signals:
+        if signal not in SIGNALS:
+            raise Exception('Unknown signal {!r}; expected some of {}.'.format(signal, ', '.join(SIGNALS)))
+
+    selected = dict(header)
+    selected['signals'] = tuple(s for s in SIGNALS if s in signals)
+
+    if channels is not None:
+        index = amplifier_channel_indices(header, channels)
+        selected['amplifier_channel_index'] = index
+        selected['amplifier_channels'] = [header['amplifier_channels'][i] for i in index]
+        selected['spike_triggers'] = [header['spike_triggers'][i] for i in index]
+    if not any(s in selected['signals'] for s in ('amplifier', 'dc_amplifier', 'stim')):
+        selected['amplifier_channels'] = []
+        selected['spike_triggers'] = []
+    if 'dc_amplifier' not in selected['signals']:
+        selected['dc_amplifier_data_saved'] = 0
+
+    for signal in ('board_adc', 'board_dac', 'board_dig_in', 'board_dig_out'):
+        if signal not in selected['signals']:
+            selected[signal + '_channels'] = []
+
+    for signal in ('amplifier', 'board_adc', 'board_dac', 'board_dig_in', 'board_dig_out'):
+        selected['num_' + signal + '_channels'] = len(selected[signal + '_channels'])
+
+    return selected
@@ -0,0 +1,185 @@
+#! /bin/env python
+#
+# A recording split by RHX into many consecutive .rhs files, read as one.
+
+import sys, os, glob, json
+import numpy as np
+
+from intanutil.scan_headers import read_header_only
+from intanutil.get_data_block_dtype import get_data_block_dtype
+from intanutil.read_all_data_blocks import blocks_to_data
+from intanutil.scale_data import check_dtype_policy, convert_signals
+from intanutil.select_data import select_header
+from intanutil.data_to_result import result_data_keys
+
+INDEX_VERSION = 1
+
+
+def header_signature(header):
+    """The header fields that must match for files to be read as one recording."""
+    signature = {'sample_rate': header['sample_rate'],
+                 'stim_step_size': header['stim_step_size'],
+                 'dc_amplifier_data_saved': int(header['dc_amplifier_data_saved']),
+                 'notch_filter_frequency': header['notch_filter_frequency'],
+                 'block_layout': str(get_data_block_dtype(header))}
+    for signal in ('amplifier', 'board_adc', 'board_dac', 'board_dig_in', 'board_dig_out'):
+        signature[signal + '_channels'] = [c['native_channel_name'] for c in header[signal + '_channels']]
+    return signature
+
+
+def index_entry(filename):
+    """Reads the header and the first / last timestamp of one file into an index entry."""
+    header, data_offset, num_data_blocks = read_header_only(filename)
+    entry = {'filename': os.path.basename(filename),
+             'size': os.path.getsize(filename),
+             'mtime': os.path.getmtime(filename),
+             'data_offset': data_offset,
+             'num_data_blocks': num_data_blocks,
+             'first_timestamp': None,
+             'last_timestamp': None,
+             'signature': header_signature(header)}
+    if num_data_blocks > 0:
+        blocks = np.memmap(filename, dtype=get_data_block_dtype(header), mode='r', offset=data_offset,
+                           shape=(num_data_blocks,))
+        entry['first_timestamp'] = int(blocks['timestamps'][0, 0])
+        entry['last_timestamp'] = int(blocks['timestamps'][-1, -1])
+        del blocks
+    return entry
+
+
+class Session(object):
+    """A directory of consecutive .rhs files from one recording, read as a single file.
+
+    Opening a session checks that every file's header is compatible and
+    builds an index of each file's first / last timestamp and block count.
+    The index is kept next to the data (index_filename) and reused while the
+    files' sizes and modification times are unchanged, so reopening a
+    session only reads the first file's header.
+
+        s = Session('recording_dir')
+        d = s.read(120.0, 125.0, channels=['A-005'], signals=['amplifier'])
+
+    read() returns the same signals as read_data(), for the given time range
+    only; only the files and datablocks that overlap the range are read.  As
+    in RhsFile, the software notch filter is not applied.
+    """
+
+    def __init__(self, directory, pattern='*.rhs', index_filename='rhs_index.json'):
+        self.directory = directory
+        self.index_filename = os.path.join(directory, index_filename)
+        filenames = sorted(glob.glob(os.path.join(directory, pattern)))
+        if len(filenames) == 0:
+            raise Exception('No files matching {} in {}.'.format(pattern, directory))
+
+        self.files = self.update_index(filenames)
+
+        # Every file has to match the first one.
+        self.header, _, _ = read_header_only(filenames[0])
+        signature = header_signature(self.header)
+        for entry in self.files:
+            if entry['signature'] != signature:
+                mismatched = [key for key in signature if entry['signature'].get(key) != signature[key]]
+                raise Exception('{} does not match {} ({}).'.format(entry['filename'], self.files[0]['filename'],
+                                                                   ', '.join(mismatched)))
+
+        self.files = [entry for entry in self.files if entry['num_data_blocks'] > 0]
+        for previous, entry in zip(self.files[:-1], self.files[1:]):
+            if entry['first_timestamp'] <= previous['last_timestamp']:
+                raise Exception('{} does not start after {} ends.'.format(entry['filename'], previous['filename']))
+
+        self.sample_rate = self.header['sample_rate']
+        self.num_samples = sum(128 * entry['num_data_blocks'] for entry in self.files)
+
+    def update_index(self, filenames):
+        """Returns an index entry per file, reusing the saved index where it is still valid."""
+        saved = {}
+        try:
+            with open(self.index_filename) as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                saved = {entry['filename']: entry for entry in index['files']}
+        except (OSError, ValueError):
+            pass
+
+        files = []
+        changed = False
+        for filename in filenames:
+            entry = saved.get(os.path.basename(filename))
+            if (entry is None or entry['size'] != os.path.getsize(filename)
+                    or entry['mtime'] != os.path.getmtime(filename)):
+                entry = index_entry(filename)
+                changed = True
+            files.append(entry)
+
+        if changed or len(saved) != len(files):
+            try:
+                temp_filename = self.index_filename + '.tmp'
+                with open(temp_filename, 'w') as f:
+                    json.dump({'version': INDEX_VERSION, 'files': files}, f, indent=1)
+                os.replace(temp_filename, self.index_filename)
+            except OSError:
+                pass # read-only directory: the index is only kept in memory
+        return files
+
+    @property
+    def start_time(self):
+        """Time (in seconds) of the first sample of the session."""
+        return self.files[0]['first_timestamp'] / self.sample_rate if self.files else 0.0
+
+    @property
+    def end_time(self):
+        """Time (in seconds) just after the last sample of the session."""
+        return (self.files[-1]['last_timestamp'] + 1) / self.sample_rate if self.files else 0.0
+
+    def read(self, start=None, stop=None, channels=None, signals=None, dtype='float64'):
+        """Reads the samples with start <= t < stop (in seconds) across file boundaries.
+
+        channels, signals and dtype are as in read_data().  Returns a
+        dictionary with 't' and the selected signals, with the same signal
+        keys as read_data() (see result_data_keys()).
+        """
+        check_dtype_policy(dtype)
+        first = -np.inf if start is None else int(np.ceil(start * self.sample_rate))
+        last = np.inf if stop is None else int(np.ceil(stop * self.sample_rate)) - 1
+        header = select_header(self.header, channels, signals)
+        block_dtype = get_data_block_dtype(self.header)
+
+        pieces = []
+        for entry in self.files:
+            if entry['last_timestamp'] < first or entry['first_timestamp'] > last:
+                continue
+            blocks = np.memmap(os.path.join(self.directory, entry['filename']), dtype=block_dtype, mode='r',
+                               offset=entry['data_offset'], shape=(entry['num_data_blocks'],))
+
+            # Find the blocks that overlap [first, last] from their first timestamps.
+            block_starts = blocks['timestamps'][:, 0]
+            b0 = max(0, np.searchsorted(block_starts, first, side='right') - 1)
+            b1 = np.searchsorted(block_starts, last, side='right')
+            raw = blocks_to_data(header, blocks[b0:b1])
+            del blocks, block_starts
+
+            keep = (raw['t'] >= first) & (raw['t'] <= last)
+            if not keep.all():
+                raw = {key: value[..., keep] for key, value in raw.items()}
+            pieces.append(raw)
+
+        if pieces:
+            raw = {key: np.concatenate([piece[key] for piece in pieces], axis=-1) for key in pieces[0]}
+        else:
+            raw = blocks_to_data(header, np.zeros(0, dtype=block_dtype))
+
+        signals = convert_signals(raw, header, dtype)
+        data = {key: signals[key] for key in result_data_keys(header)}
+        data['t'] = raw['t'] if dtype == 'raw' else raw['t'] / self.sample_rate
+        return data
+
+    def __repr__(self):
+        return 'Session({!r}, {} files, {:0.3f} s)'.format(self.directory, len(self.files),
+                                                          self.num_samples / self.sample_rate)
+
+
+if __name__ == '__main__':
+    s = Session(sys.argv[1])
+    print(s)
+    for entry in s.files:
+        print('{filename}: timestamps {first_timestamp} to {last_timestamp}, {num_data_blocks} blocks'.format(**entry))
@@ -0,0 +1,309 @@
+#! /bin/env python
+#
+# Removal of stimulation artifacts from amplifier data, using the stim,
+# amp settle and charge recovery flags recorded with every sample.
+
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+ARTIFACT_MODES = ('blank', 'interpolate', 'template')
+STIM_FLAGS = ('stim', 'amp_settle', 'charge_recovery')
+
+
+def stim_active(signals, flags=STIM_FLAGS, out=None):
+    """Marks the samples during which stimulation affects each amplifier channel.
+
+    signals is a read_data() result or an iter_chunks() chunk (or slices of
+    one).  A sample is active if any of flags holds for it: 'stim' (non-zero
+    stimulation current), 'amp_settle' or 'charge_recovery'.  Returns a
+    boolean (channels x samples) array.
+    """
+    for flag in flags:
+        key = 'stim_data' if flag == 'stim' else flag + '_data'
+        if key not in signals:
+            raise Exception('Stimulation artifact removal needs {} (load the stim signal).'.format(key))
+        if out is None:
+            out = np.zeros(signals[key].shape, dtype=bool)
+        if flag == 'stim':
+            out |= signals[key] != 0
+        else:
+            out |= signals[key]
+    return out
+
+
+def find_runs(active, previous=None):
+    """Finds the runs of consecutive active samples on every row of a boolean (channels x samples) array.
+
+    Returns (channel, start, end, onset): one entry per run, sorted by
+    channel and start, covering samples start ... end - 1.  previous gives
+    each channel's state just before the first sample; a run that continues
+    from there has onset False.
+    """
+    num_channels, num_samples = active.shape
+    extended = np.zeros((num_channels, num_samples + 2), dtype=np.int8)
+    extended[:, 1:-1] = active
+    edges = np.diff(extended, axis=1)
+    channel, start = np.nonzero(edges == 1)
+    _, end = np.nonzero(edges == -1)
+    onset = np.ones(len(start), dtype=bool)
+    if previous is not None:
+        onset &= ~((start == 0) & previous[channel])
+    return channel, start, end, onset
+
+
+def window_positions(starts, ends):
+    """Flattened sample positions of the windows starts[i] ... ends[i] - 1.
+
+    Returns (position, window, offset): for every covered sample, its
+    position, the index of its window, and its offset from the window start.
+    """
+    lengths = ends - starts
+    window = np.repeat(np.arange(len(starts)), lengths)
+    first = np.cumsum(lengths) - lengths
+    offset = np.arange(window.size) - first[window]
+    return starts[window] + offset, window, offset
+
+
+class StimArtifactRemover(object):
+    """Removes stimulation artifacts from consecutive chunks of amplifier data.
+
+    Every run of active samples (see stim_active()) on a channel, widened by
+    pre samples before and post samples after it, is an artifact window.
+    mode selects what happens to it:
+
+        'blank'        samples are set to fill (0, or mid-scale 32768 for
+                       'raw' uint16 data)
+        'interpolate'  samples are replaced by a straight line between the
+                       samples on either side of the window
+        'template'     the channel's average artifact, over the windows
+                       pre samples before to post samples after the start
+                       of each run seen so far, is subtracted
+
+    Windows may cross chunk boundaries, so process() holds each chunk back
+    until the next one has arrived and returns the previous chunk, cleaned
+    (None for the first call); flush() returns the last one.  Windows
+    longer than a chunk are cut short at the end of the following chunk, and
+    carried on from there.
+    """
+
+    def __init__(self, pre=3, post=30, mode='interpolate', fill=None):
+        if mode not in ARTIFACT_MODES:
+            raise Exception('Unknown artifact removal mode {!r}; use one of {}.'.format(mode, ', '.join(ARTIFACT_MODES)))
+        self.pre = pre
+        self.post = post
+        self.mode = mode
+        self.fill = fill
+
+        self.held = None
+        self.held_active = None
+        self.position = 0                       # sample number of the first held sample
+        self.previous_active = None
+        self.applied_until = None               # per channel, first sample not covered by a window yet
+        self.last_onset = None                  # per channel, start of the last run a template was subtracted for
+        self.template_sum = None
+        self.template_count = None
+        self.windows_removed = 0
+
+    def process(self, amplifier_data, active, copy=True):
+        """Takes the next chunk (channels x samples) and its stim_active() flags; returns the previous chunk, cleaned."""
+        if copy:
+            amplifier_data = np.array(amplifier_data)
+            active = np.array(active, dtype=bool)
+        if self.held is None:
+            num_channels = amplifier_data.shape[0]
+            self.previous_active = np.zeros(num_channels, dtype=bool)
+            self.applied_until = np.zeros(num_channels, dtype=np.int64)
+            self.last_onset = np.full(num_channels, -1, dtype=np.int64)
+            self.template_sum = np.zeros((num_channels, self.pre + self.post))
+            self.template_count = np.zeros(num_channels, dtype=np.int64)
+            self.held, self.held_active = amplifier_data, active
+            return None
+        return self.clean(amplifier_data, active)
+
+    def flush(self):
+        """Returns the chunk still held back, cleaned, or None."""
+        if self.held is None:
+            return None
+        empty = self.held[:, :0]
+        cleaned = self.clean(empty, self.held_active[:, :0])
+        self.held = None
+        return cleaned
+
+    def clean(self, amplifier_data, active):
+        num_held = self.held.shape[1]
+        work = np.concatenate([self.held, amplifier_data], axis=1)
+        work_active = np.concatenate([self.held_active, active], axis=1)
+        channel, start, end, onset = find_runs(work_active, self.previous_active)
+
+        if self.mode == 'template':
+            self.subtract_templates(work, num_held, channel[onset], start[onset])
+        else:
+            self.replace_windows(work, num_held, channel, start, end)
+
+        if num_held > 0:
+            self.previous_active = work_active[:, num_held - 1].copy()
+        self.position += num_held
+        self.held, self.held_active = work[:, num_held:], work_active[:, num_held:]
+        return work[:, :num_held]
+
+    def replace_windows(self, work, num_held, channel, start, end):
+        num_samples = work.shape[1]
+        # Runs that reach the end of the data may go on; no post window yet.
+        window_start = np.maximum(start - self.pre, 0)
+        window_end = np.where(end < num_samples, np.minimum(end + self.post, num_samples), num_samples)
+
+        # Merge overlapping windows on the same channel.
+        if len(channel) > 0:
+            first = np.ones(len(channel), dtype=bool)
+            first[1:] = (channel[1:] != channel[:-1]) | (window_start[1:] > window_end[:-1])
+            groups = np.flatnonzero(first)
+            channel, window_start = channel[groups], window_start[groups]
+            window_end = np.maximum.reduceat(window_end, groups)
+
+        # Only windows starting in the held chunk are final; skip what earlier calls already covered.
+        final = window_start < num_held
+        done = self.applied_until[channel] - self.position
+        self.windows_removed += int(np.count_nonzero(final & (window_start >= done)))
+        window_start = np.maximum(window_start, done)
+        keep = final & (window_start < window_end)
+        channel, window_start, window_end = channel[keep], window_start[keep], window_end[keep]
+        if len(channel) == 0:
+            return
+        np.maximum.at(self.applied_until, channel, self.position + window_end)
+
+        position, window, offset = window_positions(window_start, window_end)
+        rows = channel[window]
+        fill = self.fill
+        if fill is None:
+            fill = 32768 if work.dtype == np.uint16 else 0
+        if self.mode == 'blank':
+            work[rows, position] = fill
+            return
+
+        has_left = window_start > 0
+        has_right = window_end < num_samples
+        left = work[channel, np.maximum(window_start - 1, 0)].astype(np.float64)
+        right = work[channel, np.minimum(window_end, num_samples - 1)].astype(np.float64)
+        left = np.where(has_left, left, np.where(has_right, right, fill))
+        right = np.where(has_right, right, left)
+        fraction = (offset + 1) / (window_end - window_start + 1)[window]
+        values = left[window] + (right - left)[window] * fraction
+        if not np.issubdtype(work.dtype, np.floating):
+            values = np.rint(values)
+        work[rows, position] = values
+
+    def subtract_templates(self, work, num_held, channel, start):
+        num_samples = work.shape[1]
+        length = self.pre + self.post
+        window_start = start - self.pre
+        keep = (window_start < num_held) & (self.position + start > self.last_onset[channel])
+        channel, start, window_start = channel[keep], start[keep], window_start[keep]
+        if len(channel) == 0:
+            return
+        np.maximum.at(self.last_onset, channel, self.position + start)
+        self.windows_removed += len(channel)
+
+        # Each window gets the channel's average over every whole window up
+        # to and including itself, which does not depend on the chunk size.
+        whole = (window_start >= 0) & (window_start + length <= num_samples)
+        windows = np.zeros((len(channel), length))
+        if np.any(whole) and length > 0:
+            windows[whole] = sliding_window_view(work, length, axis=1)[channel[whole], window_start[whole]]
+        first = np.ones(len(channel), dtype=bool)
+        first[1:] = channel[1:] != channel[:-1]
+        group = np.cumsum(first) - 1
+        group_start = np.flatnonzero(first)
+        sums = np.cumsum(windows, axis=0)
+        sums -= (sums[group_start] - windows[group_start])[group]
+        counts = np.cumsum(whole)
+        counts -= (counts[group_start] - whole[group_start])[group]
+        template = ((self.template_sum[channel] + sums)
+                    / np.maximum(self.template_count[channel] + counts, 1)[:, np.newaxis])
+        np.add.at(self.template_sum, channel, windows)
+        self.template_count += np.bincount(channel[whole], minlength=len(self.template_count))
+
+        # Overlapping windows add up.
+        position, window, offset = window_positions(window_start, window_start + length)
+        inside = (position >= 0) & (position < num_samples)
+        flat = channel[window[inside]] * num_samples + position[inside]
+        flat, index = np.unique(flat, return_inverse=True)
+        total = np.bincount(index, weights=template[window[inside], offset[inside]], minlength=len(flat))
+        rows, position = np.divmod(flat, num_samples)
+        values = work[rows, position] - total
+        if not np.issubdtype(work.dtype, np.floating):
+            limits = np.iinfo(work.dtype)
+            values = np.clip(np.rint(values), limits.min, limits.max)
+        work[rows, position] = values
+
+
+def iter_artifact_free_chunks(chunks, pre=3, post=30, mode='interpolate', fill=None, flags=STIM_FLAGS):
+    """Wraps iter_chunks() (or any iterator of such chunks), removing stimulation artifacts from 'amplifier_data'.
+
+    See StimArtifactRemover; chunks come out one chunk late, as copies,
+    since windows can reach into the next chunk.  Only one extra chunk is
+    held in memory, so this works on files of any size.
+    """
+    remover = StimArtifactRemover(pre, post, mode, fill)
+    held = None
+    for chunk in chunks:
+        chunk = {key: value.copy() if isinstance(value, np.ndarray) else value for key, value in chunk.items()}
+        cleaned = remover.process(chunk['amplifier_data'], stim_active(chunk, flags), copy=False)
+        if held is not None:
+            held['amplifier_data'] = cleaned
+            yield held
+        held = chunk
+    if held is not None:
+        held['amplifier_data'] = remover.flush()
+        yield held
+
+
+def remove_stim_artifacts(result, pre=3, post=30, mode='interpolate', fill=None, flags=STIM_FLAGS,
+                          chunk_samples=128000):
+    """Removes stimulation artifacts from a read_data() result's 'amplifier_data', in place.
+
+    The data are processed chunk_samples samples at a time (see
+    StimArtifactRemover), so the active-sample flags are never built for
+    the whole recording at once.  Returns the number of windows removed.
+    """
+    amplifier_data = result['amplifier_data']
+    num_samples = amplifier_data.shape[1]
+    remover = StimArtifactRemover(pre, post, mode, fill)
+    previous = None
+    for first in range(0, num_samples, chunk_samples):
+        part = slice(first, min(first + chunk_samples, num_samples))
+        signals = {key: value[:, part] for key, value in result.items()
+                   if key in ('stim_data', 'amp_settle_data', 'charge_recovery_data')}
+        cleaned = remover.process(amplifier_data[:, part], stim_active(signals, flags))
+        if previous is not None:
+            amplifier_data[:, previous] = cleaned
+        previous = part
+    if previous is not None:
+        amplifier_data[:, previous] = remover.flush()
+    return remover.windows_removed
+
+
+if __name__ == '__main__':
+    # Chunk-size check: 20-sample stimulation epochs every 10 ms on 4 channels,
+    # cleaned in one pass and in uneven chunks.
+    rng = np.random.default_rng(0)
+    num_samples = 30000
+    data = {'amplifier_data': rng.normal(0, 5, (4, num_samples)),
+            'stim_data': np.zeros((4, num_samples)),
+            'amp_settle_data': np.zeros((4, num_samples), dtype=bool),
+            'charge_recovery_data': np.zeros((4, num_samples), dtype=bool)}
+    for first in range(100, num_samples - 100, 300):
+        data['stim_data'][:, first:first + 6] = 10
+        data['amp_settle_data'][:, first:first + 20] = True
+        data['amplifier_data'][:, first:first + 60] += 300 * np.exp(-np.arange(60) / 10)
+
+    for mode in ARTIFACT_MODES:
+        whole = {key: value.copy() for key, value in data.items()}
+        num_windows = remove_stim_artifacts(whole, mode=mode, chunk_samples=num_samples)
+        for chunk_samples in (10000, 1000, 333):
+            chunked = {key: value.copy() for key, value in data.items()}
+            remove_stim_artifacts(chunked, mode=mode, chunk_samples=chunk_samples)
+            difference = np.max(np.abs(chunked['amplifier_data'] - whole['amplifier_data']))
+            print('{:12} {} windows, chunks of {:5}: max abs difference {:.3g}'.format(mode, num_windows, chunk_samples,
+                                                                                     difference))
+            assert difference < 1e-9
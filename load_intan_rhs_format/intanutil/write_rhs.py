@@ -0,0 +1,140 @@
+#! /bin/env python
+#
+# Writes synthetic RHS files, in the header layout read_header() parses,
+# for benchmarks and for checking the readers.
+
+import sys, struct
+import numpy as np
+
+from intanutil.get_data_block_dtype import get_data_block_dtype
+
+
+def write_qstring(fid, string):
+    """Writes a Qt style QString: a uint32 byte count, then UTF-16 little-endian text."""
+    data = string.encode('utf-16-le')
+    fid.write(struct.pack('<I', len(data)))
+    fid.write(data)
+
+
+def write_channel(fid, native_name, custom_name, native_order, signal_type, chip_channel, board_stream):
+    write_qstring(fid, native_name)
+    write_qstring(fid, custom_name)
+    # native order, custom order, signal type, enabled, chip channel, command stream, board stream
+    fid.write(struct.pack('<hhhhhhh', native_order, native_order, signal_type, 1, chip_channel, 0, board_stream))
+    # voltage trigger mode, threshold, digital trigger channel, edge polarity
+    fid.write(struct.pack('<hhhh', 0, -70, 0, 0))
+    # electrode impedance magnitude and phase
+    fid.write(struct.pack('<ff', 0., 0.))
+
+
+def write_header(fid, num_amplifier_channels=32, num_board_adc_channels=0, num_board_dac_channels=0,
+                 num_board_dig_in_channels=0, num_board_dig_out_channels=0, dc_amplifier_data_saved=True,
+                 sample_rate=30000.0, notch_filter_frequency=0, stim_step_size=1e-6, notes=('', '', ''),
+                 version=(3, 0)):
+    """Writes an RHS header of the given (major, minor) version describing the given channels.
+
+    The RHS header has the same fields in every version, so only the
+    version number changes; read_data() applies the software notch filter
+    (notch_filter_frequency 50 or 60) to files older than version 3.
+
+    Amplifier channels are numbered A-000, A-001, ... and spill over to
+    ports B, C, ... every 32 channels (one signal group per port); board
+    channels get the ANALOG-IN, ANALOG-OUT, DIGITAL-IN and DIGITAL-OUT
+    groups.  Returns the summary counts get_data_block_dtype() needs.
+    """
+    fid.write(struct.pack('<I', 0xD69127AC))
+    fid.write(struct.pack('<hh', *version))
+    fid.write(struct.pack('<f', sample_rate))
+    # dsp enabled, then actual and desired dsp cutoff / lower / lower settle / upper bandwidths
+    fid.write(struct.pack('<hffffffff', 1, 1.0, 0.1, 1000.0, 7500.0, 1.0, 0.1, 1000.0, 7500.0))
+    fid.write(struct.pack('<h', {0: 0, 50: 1, 60: 2}[notch_filter_frequency]))
+    fid.write(struct.pack('<ff', 1000.0, 1000.0))           # impedance test frequencies
+    fid.write(struct.pack('<hh', 0, 0))                     # amp settle mode, charge recovery mode
+    fid.write(struct.pack('fff', stim_step_size, 1e-6, 0.0))
+    for note in notes:
+        write_qstring(fid, note)
+    fid.write(struct.pack('<hh', 1 if dc_amplifier_data_saved else 0, 0))
+    write_qstring(fid, 'Hardware')
+
+    groups = []
+    for port in range(0, num_amplifier_channels, 32):
+        prefix = chr(ord('A') + port // 32)
+        channels = [(prefix, channel, 0) for channel in range(min(32, num_amplifier_channels - port))]
+        groups.append(('Port ' + prefix, prefix, channels, len(channels)))
+    for name, prefix, count, signal_type in (('Analog In Ports', 'ANALOG-IN', num_board_adc_channels, 3),
+                                             ('Analog Out Ports', 'ANALOG-OUT', num_board_dac_channels, 4),
+                                             ('Digital In Ports', 'DIGITAL-IN', num_board_dig_in_channels, 5),
+                                             ('Digital Out Ports', 'DIGITAL-OUT', num_board_dig_out_channels, 6)):
+        groups.append((name, prefix, [(prefix, channel, signal_type) for channel in range(count)], 0))
+
+    fid.write(struct.pack('<h', len(groups)))
+    for group_name, group_prefix, channels, num_amp_channels in groups:
+        write_qstring(fid, group_name)
+        write_qstring(fid, group_prefix)
+        fid.write(struct.pack('<hhh', 1, len(channels), num_amp_channels))
+        for stream, (prefix, channel, signal_type) in enumerate(channels):
+            name = '{}-{:02d}'.format(prefix, channel + 1) if signal_type >= 3 else '{}-{:03d}'.format(prefix, channel)
+            write_channel(fid, name, name, channel, signal_type, channel, 0 if signal_type >= 3 else channel // 16)
+
+    return {'num_amplifier_channels': num_amplifier_channels,
+            'num_board_adc_channels': num_board_adc_channels,
+            'num_board_dac_channels': num_board_dac_channels,
+            'num_board_dig_in_channels': num_board_dig_in_channels,
+            'num_board_dig_out_channels': num_board_dig_out_channels,
+            'dc_amplifier_data_saved': 1 if dc_amplifier_data_saved else 0}
+
+
+def write_synthetic_rhs(filename, num_amplifier_channels=32, num_data_blocks=2344, num_board_adc_channels=0,
+                        num_board_dac_channels=0, num_board_dig_in_channels=0, num_board_dig_out_channels=0,
+                        dc_amplifier_data_saved=True, sample_rate=30000.0, notch_filter_frequency=0, first_timestamp=0,
+                        seed=0, blocks_per_write=256, version=(3, 0)):
+    """Writes an RHS file of num_data_blocks datablocks (128 samples each) of synthetic data.
+
+    The default is 10 s of 32 channels at 30 kHz.  Amplifier channels hold
+    Gaussian noise (about 10 uV rms) around mid-scale, DC amplifier
+    channels a small offset, stim channels occasional current steps, ADC
+    and DAC channels noise, and the digital words random levels that change
+    every few hundred samples; timestamps count up from first_timestamp.
+    Data are generated and written blocks_per_write blocks at a time, so
+    files larger than memory can be written.  The header gets the given
+    version (see write_header()).  Returns the number of bytes written.
+    """
+    rng = np.random.default_rng(seed)
+    with open(filename, 'wb') as fid:
+        counts = write_header(fid, num_amplifier_channels, num_board_adc_channels, num_board_dac_channels,
+                              num_board_dig_in_channels, num_board_dig_out_channels, dc_amplifier_data_saved,
+                              sample_rate, notch_filter_frequency, version=version)
+        block_dtype = get_data_block_dtype(counts)
+        fields = block_dtype.names
+
+        for first_block in range(0, num_data_blocks, blocks_per_write):
+            blocks = np.zeros(min(blocks_per_write, num_data_blocks - first_block), dtype=block_dtype)
+            num_samples = 128 * len(blocks)
+            first_sample = first_timestamp + 128 * first_block
+            blocks['timestamps'] = np.arange(first_sample, first_sample + num_samples,
+                                             dtype=np.int32).reshape(len(blocks), 128)
+            if 'amplifier' in fields:
+                noise = rng.standard_normal(blocks['amplifier'].shape, dtype=np.float32)
+                blocks['amplifier'] = 32768 + (noise * (10 / 0.195)).astype(np.int32)
+                if 'dc_amplifier' in fields:
+                    blocks['dc_amplifier'] = 512 + rng.integers(-2, 3, blocks['dc_amplifier'].shape)
+                # 10-step negative pulses (bit 8 set) in about 1% of blocks on each channel.
+                stim = blocks['stim']
+                pulses = rng.random(stim.shape[:2]) < 0.01
+                stim[pulses, :8] = 0x100 | 10
+            for field in ('board_adc', 'board_dac'):
+                if field in fields:
+                    blocks[field] = 32768 + rng.integers(-100, 101, blocks[field].shape)
+            for field in ('board_dig_in', 'board_dig_out'):
+                if field in fields:
+                    levels = rng.integers(0, 65536, len(blocks) // 2 + 1, dtype=np.uint16)
+                    blocks[field] = np.repeat(levels, 256)[:num_samples].reshape(len(blocks), 128)
+            blocks.tofile(fid)
+        return fid.tell()
+
+
+if __name__ == '__main__':
+    # write_rhs.py filename [num_amplifier_channels [seconds]]
+    num_channels = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    write_synthetic_rhs(sys.argv[1], num_channels, int(np.ceil(seconds * 30000 / 128)), 8, 8, 16, 16)
@@ -10,19 +10,51 @@ import matplotlib.pyplot as plt
 
 from intanutil.read_header import read_header
 from intanutil.get_bytes_per_data_block import get_bytes_per_data_block
-from intanutil.read_one_data_block import read_one_data_block
-from intanutil.notch_filter import notch_filter
-from intanutil.data_to_result import data_to_result
-
-
-def read_data():
+from intanutil.get_data_block_dtype import get_data_block_dtype
+from intanutil.read_all_data_blocks import read_all_data_blocks
+from intanutil.notch_filter import notch_filter_channels
+from intanutil.read_all_data_blocks import blocks_to_data
+from intanutil.scale_data import check_dtype_policy, check_digital_policy, convert_signals, empty_signals
+from intanutil.digital_events import signal_edges, edges_to_dense
+from intanutil.parse_data_parallel import parse_data_parallel
+from intanutil.data_to_result import data_to_result, result_data_keys
+from intanutil.rhs_file import RhsFile
+from intanutil.scan_headers import scan_headers, read_header_only
+from intanutil.select_data import SIGNALS, select_header, notch_filter_applies
+from intanutil.session import Session
+from intanutil.cache import open_cache, write_cache, iter_cached_chunks
+
+
+def read_data(filename="qwerty_210205_153318.rhs", workers=None, dtype='float64', channels=None, signals=None,
+              digital='dense'):
     """Reads Intan Technologies RHD2000 data file generated by evaluation board GUI.
 
     Data are returned in a dictionary, for future extensibility.
+
+    If workers is greater than 1, scaling, stimulation and digital decoding
+    and the notch filter run on a pool of that many threads.
+
+    dtype selects how samples are stored: 'float64' (scaled, the default),
+    'float32' (scaled, half the memory) or 'raw' (unscaled 16-bit words with
+    the conversion factors in result['scale_parameters']; timestamps stay
+    integers, stim_data holds signed current steps and no notch filter is
+    applied).
+
+    channels (amplifier channel numbers or names such as 'A-005') and
+    signals (names from SIGNALS, e.g. ['amplifier', 'board_dig_in']) limit
+    what is loaded.  With either one given, the data section is memory
+    mapped and only the selected samples are copied out of it, so memory
+    use and time follow the selection rather than the file size.
+    Timestamps are always loaded.
+
+    digital='edges' returns the digital inputs and outputs and the
+    compliance limit, charge recovery and amp settle flags as sparse tables
+    of rising and falling edges ('board_dig_in_edges', ...) instead of dense
+    boolean arrays ('board_dig_in_data', ...); edges_to_dense() builds a
+    dense array from a table when one is needed.
     """
-    filename = "qwerty_210205_153318.rhs"
-    
-    
+    check_dtype_policy(dtype)
+    check_digital_policy(digital)
     tic = time.time()
     with open(filename, 'rb') as fid:
         filesize = os.path.getsize(filename)
@@ -73,61 +105,25 @@ def read_data():
                 header['sample_rate'] / 1000))
 
         if data_present:
-            # Pre-allocate memory for data.
+            # Read every data block in one pass, using a structured dtype that
+            # mirrors the layout summed up in get_bytes_per_data_block().
             print('')
-            print('Allocating memory for data...')
-
-            data = {}
-            data['t'] = np.zeros(num_amplifier_samples, dtype=np.int)
-
-            data['amplifier_data'] = np.zeros([header['num_amplifier_channels'], num_amplifier_samples], dtype=np.uint)
-
-            if header['dc_amplifier_data_saved']:
-                data['dc_amplifier_data'] = np.zeros([header['num_amplifier_channels'], num_amplifier_samples], dtype=np.uint) * header['dc_amplifier_data_saved']
-
-            data['stim_data_raw'] = np.zeros([header['num_amplifier_channels'], num_amplifier_samples], dtype=np.int)
-            data['stim_data'] = np.zeros([header['num_amplifier_channels'], num_amplifier_samples], dtype=np.int)
-
-            data['board_adc_data'] = np.zeros([header['num_board_adc_channels'], num_board_adc_samples], dtype=np.uint)
-            data['board_dac_data'] = np.zeros([header['num_board_dac_channels'], num_board_dac_samples], dtype=np.uint)
-
-            # by default, this script interprets digital events (digital inputs, outputs, amp settle, compliance limit, and charge recovery) as booleans
-            # if unsigned int values are preferred (0 for False, 1 for True), replace the 'dtype=np.bool' argument with 'dtype=np.uint' as shown
-            # the commented line below illustrates this for digital input data; the same can be done for the other digital data types
-            
-            #data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.uint)
-            data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.bool)
-            data['board_dig_in_raw'] = np.zeros(num_board_dig_in_samples, dtype=np.uint)
-            data['board_dig_out_data'] = np.zeros([header['num_board_dig_out_channels'], num_board_dig_out_samples], dtype=np.bool)
-            data['board_dig_out_raw'] = np.zeros(num_board_dig_out_samples, dtype=np.uint)
-
-            # Read sampled data from file.
             print('Reading data from file...')
-
-            # Initialize indices used in looping
-            indices = {}
-            indices['amplifier'] = 0
-            indices['aux_input'] = 0
-            indices['board_adc'] = 0
-            indices['board_dac'] = 0
-            indices['board_dig_in'] = 0
-            indices['board_dig_out'] = 0
-
-            print_increment = 10
-            percent_done = print_increment
-            for i in (range(num_data_blocks)):
-                read_one_data_block(data, header, indices, fid)
-                # Increment all indices indices in 128
-                indices = {k: v + 128 for k, v in indices.items()}
-
-                fraction_done = 100 * (1.0 * i / num_data_blocks)
-                if fraction_done >= percent_done:
-                    print('{}% done...'.format(percent_done))
-                    percent_done = percent_done + print_increment
-
-            # Make sure we have read exactly the right amount of data.
-            bytes_remaining = filesize - fid.tell()
-            if bytes_remaining != 0: raise Exception('Error: End of file not reached.')
+            if channels is None and signals is None:
+                data = read_all_data_blocks(header, fid, num_data_blocks)
+
+                # Make sure we have read exactly the right amount of data.
+                bytes_remaining = filesize - fid.tell()
+                if bytes_remaining != 0: raise Exception('Error: End of file not reached.')
+            else:
+                # The block layout comes from the full header, before selection.
+                blocks = np.memmap(filename, dtype=get_data_block_dtype(header), mode='r', offset=fid.tell(),
+                                   shape=(num_data_blocks,))
+                header = select_header(header, channels, signals)
+                data = blocks_to_data(header, blocks)
+                del blocks
+        elif channels is not None or signals is not None:
+            header = select_header(header, channels, signals)
 
     # end of reading data file.
     # return data
@@ -135,40 +131,25 @@ def read_data():
     if (data_present):
         print('Parsing data...')
 
-        # Extract digital input channels to separate variables.
-        for i in range(header['num_board_dig_in_channels']):
-            data['board_dig_in_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_in_raw'],
-                                                                          (1 << header['board_dig_in_channels'][i][
-                                                                              'native_order'])), 0)
-
-        # Extract digital output channels to separate variables.
-        for i in range(header['num_board_dig_out_channels']):
-            data['board_dig_out_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_out_raw'],
-                                                                           (1 << header['board_dig_out_channels'][i][
-                                                                               'native_order'])), 0)
-
-        # Extract stimulation data
-        data['compliance_limit_data'] = np.bitwise_and(data['stim_data_raw'], 32768) >= 1 # get 2^15 bit, interpret as True or False
-        data['charge_recovery_data'] = np.bitwise_and(data['stim_data_raw'], 16384) >= 1 # get 2^14 bit, interpret as True or False
-        data['amp_settle_data'] = np.bitwise_and(data['stim_data_raw'], 8192) >= 1 # get 2^13 bit, interpret as True or False
-        data['stim_polarity'] = 1 - (2*(np.bitwise_and(data['stim_data_raw'], 256) >> 8)) # get 2^8 bit, interpret as +1 for 0_bit or -1 for 1_bit
-        
-        curr_amp = np.bitwise_and(data['stim_data_raw'], 255) # get least-significant 8 bits corresponding to the current amplitude
-        data['stim_data'] = curr_amp * data['stim_polarity'] # multiply current amplitude by the correct sign
-
-        # # Scale voltage levels appropriately.
-        data['amplifier_data'] = np.multiply(0.195,
-                                             (
-                                             data['amplifier_data'].astype(np.int32) - 32768))  # units = microvolts
-        data['stim_data'] = np.multiply(header['stim_step_size'], data['stim_data'] / 1.0e-6)
-
-        if header['dc_amplifier_data_saved']:
-            data['dc_amplifier_data'] = np.multiply(-0.01923,
-                                                    (data['dc_amplifier_data'].astype(
-                                                        np.int32) - 512))  # units = volts
-
-        data['board_adc_data'] = np.multiply(0.0003125, (data['board_adc_data'].astype(np.int32) - 32768)) # units = volts
-        data['board_dac_data'] = np.multiply(0.0003125, (data['board_dac_data'].astype(np.int32) - 32768)) # units = volts
+        if workers is not None and workers > 1:
+            # Same steps as below, split across a pool of threads.
+            parse_data_parallel(data, header, workers, dtype, digital)
+        else:
+            # Extract digital and stimulation data, and scale voltage levels appropriately.
+            data.update(convert_signals(data, header, dtype, digital=digital))
+
+            # If the software notch filter was selected during the recording, apply the
+            # same notch filter to amplifier data here.
+            if notch_filter_applies(header, dtype):
+                print('Applying notch filter...')
+                data['amplifier_data'][...], _ = notch_filter_channels(data['amplifier_data'], header['sample_rate'],
+                                                                       header['notch_filter_frequency'], 10)
+
+        if digital == 'edges':
+            data.update(signal_edges(data, header)[0])
+
+        if dtype == 'raw' and notch_filter_applies(header):
+            print('Note: notch filter was enabled during recording but is not applied to raw data.')
 
         # Check for gaps in timestamps.
         num_gaps = np.sum(np.not_equal(data['t'][1:] - data['t'][:-1], 1))
@@ -178,30 +159,131 @@ def read_data():
             print('Warning: {0} gaps in timestamp data found.  Time scale will not be uniform!'.format(num_gaps))
 
         # Scale time steps (units = seconds).
-        data['t'] = data['t'] / header['sample_rate']
-
-        # If the software notch filter was selected during the recording, apply the
-        # same notch filter to amplifier data here.
-        if header['notch_filter_frequency'] > 0 and header['version']['major'] < 3:
-            print_increment = 10
-            percent_done = print_increment
-            for i in range(header['num_amplifier_channels']):
-                data['amplifier_data'][i, :] = notch_filter(data['amplifier_data'][i, :], header['sample_rate'],
-                                                            header['notch_filter_frequency'], 10)
-                if fraction_done >= percent_done:
-                    print('{}% done...'.format(percent_done))
-                    percent_done = percent_done + print_increment
+        if dtype != 'raw':
+            data['t'] = data['t'] / header['sample_rate']
     else:
         data = []
 
     # Move variables to result struct.
-    result = data_to_result(header, data, data_present)
+    result = data_to_result(header, data, data_present, dtype, digital)
 
     print('Done!  Elapsed time: {0:0.1f} seconds'.format(time.time() - tic))
     
     return result
 
 
+def iter_chunks(filename="qwerty_210205_153318.rhs", blocks_per_chunk=1000, dtype='float64', channels=None, signals=None,
+                digital='dense'):
+    """Iterates over an Intan RHS2000 data file, blocks_per_chunk datablocks at a time.
+
+    Each iteration yields a dictionary with the same signals as read_data()
+    ('t', 'amplifier_data', 'stim_data', 'board_adc_data',
+    'board_dig_in_data', ...) covering 128 * blocks_per_chunk samples (the last
+    chunk may be shorter), stored according to the dtype policy.  All arrays
+    are views into buffers that are allocated once and overwritten by the
+    next chunk, so memory use does not depend on the file size; copy anything
+    that must outlive the iteration.  If the software notch filter applies
+    (as in read_data()), its state is carried from chunk to chunk so the
+    output matches a whole-file pass.  channels, signals and digital select
+    data as in read_data(); with digital='edges', each chunk's edge tables
+    cover its own samples but count them from the start of the file, and
+    edges between chunks are found too.
+    """
+    check_dtype_policy(dtype)
+    check_digital_policy(digital)
+    with open(filename, 'rb') as fid:
+        filesize = os.path.getsize(filename)
+        header = read_header(fid)
+
+        bytes_per_block = get_bytes_per_data_block(header)
+        bytes_remaining = filesize - fid.tell()
+        if bytes_remaining % bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        num_data_blocks = bytes_remaining // bytes_per_block
+        blocks_per_chunk = max(1, min(blocks_per_chunk, num_data_blocks))
+        block_dtype = get_data_block_dtype(header)
+        if channels is not None or signals is not None:
+            header = select_header(header, channels, signals)
+
+        # Pre-allocate the block buffer and every output buffer once, as
+        # (channels x blocks x 128) arrays whose leading blocks are viewed as
+        # (channels x samples) for each chunk.
+        blocks = np.empty(blocks_per_chunk, dtype=block_dtype)
+        raw_buffers = {key: np.empty(value.shape[:-1] + (blocks_per_chunk, 128), dtype=value.dtype)
+                       for key, value in blocks_to_data(header, blocks[:0]).items()}
+        for key in ('board_dig_in_raw', 'board_dig_out_raw'):
+            if key in raw_buffers:
+                raw_buffers[key][...] = 0
+        buffers = empty_signals(header, (blocks_per_chunk, 128), dtype, digital)
+        if dtype == 'raw':
+            # Unscaled signals are handed out as views of the raw buffers.
+            for key in ('t', 'amplifier_data', 'dc_amplifier_data', 'board_adc_data', 'board_dac_data'):
+                buffers.pop(key, None)
+        else:
+            buffers['t'] = np.empty((blocks_per_chunk, 128))
+
+        # Hand out the signals read_data() returns, not those of boards with no channels.
+        chunk_keys = ['t'] + result_data_keys(header, digital)
+
+        apply_notch = notch_filter_applies(header, dtype)
+        notch_state = None
+        edge_state = None
+
+        blocks_read = 0
+        while blocks_read < num_data_blocks:
+            n = min(blocks_per_chunk, num_data_blocks - blocks_read)
+            if fid.readinto(blocks[:n]) != n * bytes_per_block:
+                raise Exception('Error: File ended in the middle of the data section.')
+            blocks_read += n
+
+            def first_blocks(buf):
+                return buf[..., :n, :].reshape(buf.shape[:-2] + (128 * n,))
+
+            chunk_raw = blocks_to_data(header, blocks[:n], out={key: first_blocks(buf) for key, buf in raw_buffers.items()})
+            chunk = {key: first_blocks(buf) for key, buf in buffers.items()}
+            convert_signals(chunk_raw, header, dtype, out=chunk, digital=digital)
+            if digital == 'edges':
+                edges, edge_state = signal_edges(chunk_raw, header, edge_state)
+                chunk.update(edges)
+
+            if dtype == 'raw':
+                chunk['t'] = chunk_raw['t']
+            else:
+                np.divide(chunk_raw['t'], header['sample_rate'], out=chunk['t'])
+            if apply_notch:
+                chunk['amplifier_data'][...], notch_state = notch_filter_channels(
+                    chunk['amplifier_data'], header['sample_rate'], header['notch_filter_frequency'], 10, notch_state)
+
+            yield {key: chunk[key] for key in chunk_keys}
+
+
+def load_cached(filename="qwerty_210205_153318.rhs", cache_dir=None, dtype='float64', channels=None, signals=None,
+                blocks_per_chunk=1000):
+    """Like read_data(), but reads through a columnar cache directory.
+
+    The first call decodes the file with iter_chunks(), blocks_per_chunk
+    datablocks at a time, and writes each signal array to a .npy file in
+    cache_dir (by default 'recording.rhs.cache'), so building the cache
+    takes about one chunk of memory; iter_cached_chunks() reads the cache
+    back in the same chunks.  Later calls only memory-map the cached
+    arrays, until the source file's size or mtime changes or different
+    dtype / channels / signals are asked for.  Cached arrays are read-only.
+    """
+    options = {'dtype': dtype, 'channels': channels, 'signals': signals}
+    result = open_cache(filename, cache_dir, options)
+    if result is None:
+        header, _, num_data_blocks = read_header_only(filename)
+        if channels is not None or signals is not None:
+            header = select_header(header, channels, signals)
+        # Everything but the signal arrays, as read_data() returns it.
+        metadata = data_to_result(header, {'t': None}, False, dtype)
+        del metadata['t']
+        chunks = iter_chunks(filename, blocks_per_chunk, dtype=dtype, channels=channels, signals=signals)
+        cache_dir = write_cache(filename, metadata, chunks, 128 * num_data_blocks, cache_dir, options)
+        result = open_cache(filename, cache_dir, options)
+    return result
+
+
 def plural(n):
     """Utility function to optionally pluralize words based on the value of n.
     """
@@ -213,7 +295,7 @@ def plural(n):
 
 
 if __name__ == '__main__':
-    a = read_data()
-    print(a)
-    with open("result.txt", "w") as file:
-        file.write(str(a))
\ No newline at end of file
+    a = load_cached()
+    for key, value in a.items():
+        if isinstance(value, np.ndarray):
+            print('{}: {} {}'.format(key, value.dtype, value.shape))
\ No newline at end of file
@@ -5,6 +5,9 @@ import time, socket
 import matplotlib.pyplot as plt
 import numpy as np
 
+from tcputil.spike_chunk import parse_spike_events
+from tcputil.snippets import extract_snippets
+
 
 
 def readUint32(array, arrayIndex):
@@ -194,41 +197,22 @@ def ReadWaveformDataDemo():
     print("whole Timestamps len : " + str(len(amplifierTimestamps)))
     # % Each spike chunk contains 4 bytes for magic number, 5 bytes for native
     # % channel name, 4 bytes for timestamp, and 1 byte for id. Total: 14 bytes
-    bytesPerSpikeChunk = 14;
-    spikeTimestamps = []
-    rtimestamps = []
-    spikedata = []
-    spikeBytesToRead = len(spikeArray)
-    print("spikeBytesToRead : " + str(spikeBytesToRead))
-    chunksToRead = int(spikeBytesToRead / bytesPerSpikeChunk);
-    print("chunksToRead : " + str(chunksToRead))
+    spikeEvents, spikeBytesUsed = parse_spike_events(spikeArray, sampleRate)
+    print("spike events : " + str(len(spikeEvents['timestamp'])))
+    chunksToRead = len(spikeEvents['timestamp'])
     if chunksToRead > 0 :
-        for chunk in range(chunksToRead) :
-            magicNumber, spikeIndex = readUint32(spikeArray, spikeIndex)
-            print("spikeIndex : " + str(spikeIndex))
-            if magicNumber != 0x3ae2710f:
-                raise Exception('Error... magic number incorrect')
-                print(chunk)
-                
-            nativeChannelName, spikeIndex = read5char(spikeArray, spikeIndex)
-            singleTimestamp, spikeIndex = readUint32(spikeArray, spikeIndex)
-            singleID, spikeIndex = readUint8(spikeArray, spikeIndex)
-            
-            timestamp = float(singleTimestamp) * timestep
-            print("nativeChannelName : " + str(nativeChannelName))
-            print("singleTimestamp : " + str(singleTimestamp))
-            # print(amplifierData[singleTimestamp])
-            # print(singleID)
-            if singleTimestamp < len(amplifierTimestamps) :
-                spikeTimestamps.append(singleTimestamp)
-                rtimestamps.append(float(singleTimestamp) * timestep)
-                spikedata.append(amplifierData[singleTimestamp])
-    
+        # Find every spike's sample and its +-50 sample window with a binary
+        # search on the sample timestamps
+        rawTimestamps = np.rint(np.array(amplifierTimestamps) / timestep).astype(np.int64)
+        snippets = extract_snippets(np.array(amplifierData), rawTimestamps, spikeEvents['timestamp'], 50, 50)
+        mark = snippets['indices'][snippets['found']]
+        spikeWindows = snippets['snippets'][snippets['found'], 0]
+
     # If using matplotlib to plot is not desired, the following plot lines can be removed.
     # Data is still accessible at this point in the amplifierTimestamps and amplifierData
-        mark = [amplifierTimestamps.index(i) for i in rtimestamps]
-        plt.plot(rtimestamps,[amplifierData[i] for i in mark], ls="", marker="o", label="points",zorder=1)
+        plt.plot(np.array(amplifierTimestamps)[mark], np.array(amplifierData)[mark], ls="", marker="o", label="points",zorder=1)
     else :
+        mark = []
         print("no spike on this period")
     
     plt.title('A-010 Amplifier Data')
@@ -239,14 +223,10 @@ def ReadWaveformDataDemo():
         
     
     for i in range(len(mark)) :
-        # spike_arr = []
-        spike_arr_val = []
         plt.title('spike plot_' + str(i) )
         plt.xlabel('Time (s)')
         plt.ylabel('Voltage (uV)')
-        spike_arr=amplifierTimestamps[spikeTimestamps[i]-50:spikeTimestamps[i]+50]
-        spike_mark = [amplifierTimestamps.index(i) for i in spike_arr]
-        plt.plot(spike_arr, [amplifierData[i] for i in spike_mark])
+        plt.plot((rawTimestamps[mark[i]] + np.arange(-50, 50)) * timestep, spikeWindows[i])
         plt.show()
         
 
@@ -23,6 +23,10 @@ import time, socket
 import matplotlib.pyplot as plt
 import numpy as np
 
+from tcputil.command_client import CommandClient
+from tcputil.spike_chunk import parse_spike_events
+from tcputil.stim_sweep import wait_for_upload
+
 def readUint32(array, arrayIndex):
     variableBytes = array[arrayIndex : arrayIndex + 4]
     variable = int.from_bytes(variableBytes, byteorder='little', signed=False)
@@ -209,13 +213,9 @@ def ReadWaveformDataDemo():
 
 
     
-    # uploadInProgress_ = "True";
-    # while ~eq(uploadInProgress, "False") :
-    #     uploadInProgress = uploadInProgress
-    #     print(uploadInProgress)
-    #     time.sleep(0.5)
-    
-    # print("uploadin progress finish")
+    # Wait for uploadstimparameters to complete, polling uploadinprogress with a short backoff
+    uploadSeconds, uploadPolls = wait_for_upload(CommandClient(scommand))
+    print("upload finished after " + str(uploadSeconds) + " s")
     
     # Send command to set board running
     scommand.sendall(b'set runmode run')
@@ -288,45 +288,18 @@ def ReadWaveformDataDemo():
     spikedata = sspikeform.recv(1024)
     print("read spike data")
     
-    spikeBytesToRead = len(spikedata)
-    chunksToRead = spikeBytesToRead / bytesPerSpikeChunk
-    
-    ThisSpikeStruct = SpikesToPlot1
-    spikeIndex = 0;
-
-    # % Process all spike chunks
-    for chunk in range(int(chunksToRead)) :
+    # % Process all spike chunks; each is 4 bytes of magic number, 5 bytes of
+    # % native channel name, 4 bytes of uint32 timestamp and 1 byte of uint8 id
+    spikeEvents, spikeBytesUsed = parse_spike_events(spikedata, sampleRate)
 
-        # % Make sure we get the correct magic number for this chunk
-        magicNumber, spikeIndex = readUint32(spikedata, spikeIndex);
-        if magicNumber != 0x3ae2710f :
-            raise Exception('Error... magic number incorrect')
-
-        # % Next 5 bytes are chars of native channel name
-        # nativeChannelName, spikeIndex = read_stringnl_noescape(spikedata, spikeIndex)
+    # % For every spike event (id != 0), add its Name, Timestamp and ID to SpikesToPlot1
+    isSpike = spikeEvents['id'] != 0
+    names = spikeEvents['channels'][spikeEvents['channel'][isSpike]]
+    for name, timestamp, singleID in zip(names, spikeEvents['t'][isSpike], spikeEvents['id'][isSpike]) :
+        SpikesToPlot1.append({'Name': str(name), 'Timestamp': float(timestamp), 'ID': int(singleID)})
 
-        # % Next 4 bytes are uint32 timestamp
-        singleTimestamp, spikeIndex = readUint32(spikedata, spikeIndex)
-
-        # % Next 1 byte is uint8 id
-        singleID, spikeIndex = read_uint8(spikedata, spikeIndex)
-        
-        # % For every spike event, add it to ThisSpikeStruct struct
-        if singleID != 0 :
-            nextSpikeIndex = np.size(ThisSpikeStruct, 2) + 1
-
-            # % If this is the first spike in this struct, start with an
-            # % index of 1
-            if numSpikes == 0 :
-                nextSpikeIndex = 1
-
-            # % Add Name, Timestamp, and ID to SpikesToPlot
-            # ThisSpikeStruct(nextSpikeIndex).Name = nativeChannelName
-            ThisSpikeStruct(nextSpikeIndex).Timestamp = float(singleTimestamp) * timestep
-            ThisSpikeStruct(nextSpikeIndex).ID = singleID
-
-            # % Increment numSpikes for this section of 100 datablocks
-            numSpikes = numSpikes + 1
+    # % Number of spikes for this section of 100 datablocks
+    numSpikes = len(SpikesToPlot1)
     
     
     
@@ -0,0 +1,231 @@
+#! /bin/env python
+#
+# Background draining of the RHX waveform and spike ports.
+
+import sys, select, threading, queue
+import numpy as np
+
+from tcputil.block_receiver import BlockReceiver
+from tcputil.waveform_block import decode_waveform_blocks
+from tcputil.waveform_receiver import WaveformReceiver
+from tcputil.spike_chunk import SPIKE_CHUNK_DTYPE, parse_spike_events
+from tcputil.tee import TeeWriter
+
+try:
+    import fcntl, termios
+except ImportError:
+    fcntl = None
+
+
+class AcquisitionThread(object):
+    """Drains the waveform (and optionally spike) port on a background thread.
+
+    A reader thread receives whole blocks as they arrive and decodes them into
+    one of queue_slots preallocated buffers of blocks_per_slot blocks each.
+    A dispatcher thread hands every filled buffer to the registered consumer
+    callbacks and then recycles it.  If the consumers fall behind and no
+    buffer is free, the reader drops the new blocks (and counts them) rather
+    than stop reading, unless block_when_full is set, in which case it waits
+    and lets TCP flow control push back on RHX instead:
+
+        acquisition = AcquisitionThread(swaveform, num_streams=64, sample_rate=30000)
+        acquisition.add_consumer(lambda data: process(data['t'], data['amplifier_data']))
+        acquisition.start()
+        ...
+        print(acquisition.counters())
+        acquisition.stop()
+
+    Consumers receive decode_waveform_blocks() dictionaries whose arrays are
+    only valid during the call.  Spike consumers receive parse_spike_events()
+    tables; bytes of the spike stream that are not part of a chunk are
+    skipped (and counted) by searching for the next magic number.  The
+    reader keeps going until both ports are closed or stop() is called.
+
+    With tee_directory set, the raw waveform and spike streams are also
+    recorded there (as 'waveform' and 'spikes', see tcputil.tee) as they are
+    received, including blocks the consumers had no room for.
+    """
+
+    def __init__(self, waveform_socket, num_streams, sample_rate=None, spike_socket=None, queue_slots=32,
+                 blocks_per_slot=16, scale=True, block_when_full=False, tee_directory=None):
+        self.sample_rate = sample_rate
+        self.scale = scale
+        self.blocks_per_slot = blocks_per_slot
+        self.block_when_full = block_when_full
+
+        self.waveform_receiver = WaveformReceiver(waveform_socket, num_streams, sample_rate,
+                                                  buffer_blocks=2 * blocks_per_slot)
+        self.spike_receiver = None
+        if spike_socket is not None:
+            self.spike_receiver = BlockReceiver(spike_socket, SPIKE_CHUNK_DTYPE, buffer_records=1024)
+
+        self.tees = []
+        if tee_directory is not None:
+            metadata = {'num_streams': num_streams, 'sample_rate': sample_rate}
+            self.waveform_receiver.tee = TeeWriter(tee_directory, 'waveform', self.waveform_receiver.record_dtype,
+                                                   metadata)
+            self.tees.append(self.waveform_receiver.tee)
+            if self.spike_receiver is not None:
+                self.spike_receiver.tee = TeeWriter(tee_directory, 'spikes', SPIKE_CHUNK_DTYPE,
+                                                    {'sample_rate': sample_rate})
+                self.tees.append(self.spike_receiver.tee)
+
+        # Preallocated output buffers; free ones are listed in free_slots, and
+        # filled ones pass through filled on their way to the consumers.
+        self.queue_slots = queue_slots
+        self.slots = [self.waveform_receiver.decoded_buffers(scale, blocks_per_slot) for _ in range(queue_slots)]
+        self.free_slots = queue.Queue()
+        for slot in range(queue_slots):
+            self.free_slots.put(slot)
+        self.filled = queue.Queue()
+
+        self.consumers = []
+        self.spike_consumers = []
+        self.stopping = threading.Event()
+        self.error = None
+
+        self.blocks_dropped = 0
+        self.blocks_delivered = 0
+        self.spikes_received = 0
+        self.spikes_dropped = 0
+        self.spikes_pending = 0
+        self.spikes_lock = threading.Lock()
+        self.spike_bytes_skipped = 0
+        # Start of a spike chunk that straddles two receives.
+        self.spike_carry = b''
+
+        self.reader = threading.Thread(target=self.read, name='rhx-reader', daemon=True)
+        self.dispatcher = threading.Thread(target=self.dispatch, name='rhx-dispatcher', daemon=True)
+
+    def add_consumer(self, callback):
+        """Registers callback(data) for every buffer of decoded waveform blocks."""
+        self.consumers.append(callback)
+
+    def add_spike_consumer(self, callback):
+        """Registers callback(events) for every batch of decoded spike events."""
+        self.spike_consumers.append(callback)
+
+    def start(self):
+        self.reader.start()
+        self.dispatcher.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stops reading, delivers what is already queued and waits for both threads (and the tee writers)."""
+        self.stopping.set()
+        self.reader.join(timeout)
+        self.dispatcher.join(timeout)
+        for tee in self.tees:
+            tee.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def read(self):
+        sockets = [self.waveform_receiver.sock]
+        if self.spike_receiver is not None:
+            sockets.append(self.spike_receiver.sock)
+        try:
+            while sockets and not self.stopping.is_set():
+                readable, _, _ = select.select(sockets, [], [], 0.1)
+                if self.waveform_receiver.sock in readable:
+                    blocks = self.waveform_receiver.receive()
+                    if blocks is None:
+                        sockets.remove(self.waveform_receiver.sock)
+                    else:
+                        for start in range(0, len(blocks), self.blocks_per_slot):
+                            self.enqueue_blocks(blocks[start:start + self.blocks_per_slot])
+                if self.spike_receiver is not None and self.spike_receiver.sock in readable:
+                    chunks = self.spike_receiver.receive()
+                    if chunks is None:
+                        sockets.remove(self.spike_receiver.sock)
+                        # On a misaligned stream the last chunk ends in an incomplete record.
+                        self.enqueue_spikes(self.spike_receiver.partial())
+                    elif len(chunks) > 0:
+                        self.enqueue_spikes(chunks.view(np.uint8))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.filled.put(None)
+
+    def enqueue_blocks(self, blocks):
+        while True:
+            try:
+                slot = self.free_slots.get(block=self.block_when_full, timeout=0.1 if self.block_when_full else None)
+                break
+            except queue.Empty:
+                if not self.block_when_full or self.stopping.is_set():
+                    self.blocks_dropped += len(blocks)
+                    return
+        data = decode_waveform_blocks(blocks, self.sample_rate, self.scale, self.slots[slot])
+        self.filled.put(('waveform', slot, data))
+
+    def enqueue_spikes(self, data):
+        # The receiver frames the stream in chunk-sized records whether or not
+        # they are aligned on chunks, so parse the bytes and resync on the magic number.
+        buffer = self.spike_carry + bytes(data) if self.spike_carry else data
+        events, consumed = parse_spike_events(buffer, self.sample_rate)
+        self.spike_carry = bytes(buffer[consumed:])
+        self.spike_bytes_skipped += events['skipped_bytes']
+
+        num_events = len(events['timestamp'])
+        if num_events == 0:
+            return
+        self.spikes_received += num_events
+        with self.spikes_lock:
+            if self.spikes_pending >= self.queue_slots:
+                self.spikes_dropped += num_events
+                return
+            self.spikes_pending += 1
+        self.filled.put(('spikes', None, events))
+
+    def dispatch(self):
+        while True:
+            item = self.filled.get()
+            if item is None:
+                return
+            kind, slot, data = item
+            try:
+                if self.error is None:
+                    for callback in (self.consumers if kind == 'waveform' else self.spike_consumers):
+                        callback(data)
+            except Exception as e:
+                self.error = e
+                self.stopping.set()
+            finally:
+                if kind == 'waveform':
+                    self.blocks_delivered += len(data['timestamps']) // 128
+                    self.free_slots.put(slot)
+                else:
+                    with self.spikes_lock:
+                        self.spikes_pending -= 1
+
+    def socket_bytes_pending(self):
+        """Bytes waiting unread in the waveform socket's receive buffer (None where FIONREAD is unavailable)."""
+        if fcntl is None:
+            return None
+        try:
+            return int.from_bytes(fcntl.ioctl(self.waveform_receiver.sock.fileno(), termios.FIONREAD, b'\0\0\0\0'),
+                                  sys.byteorder, signed=True)
+        except OSError:
+            return None
+
+    def counters(self):
+        """Snapshot of the acquisition counters, for sizing pipelines."""
+        return {'bytes_received': self.waveform_receiver.bytes_received,
+                'blocks_received': self.waveform_receiver.blocks_received,
+                'blocks_delivered': self.blocks_delivered,
+                'blocks_dropped': self.blocks_dropped,
+                'timestamp_gaps': self.waveform_receiver.num_gaps,
+                'spikes_received': self.spikes_received,
+                'spikes_dropped': self.spikes_dropped,
+                'spike_bytes_skipped': self.spike_bytes_skipped,
+                'queue_depth': self.queue_slots - self.free_slots.qsize(),
+                'tee_bytes_written': sum(tee.bytes_written for tee in self.tees),
+                'tee_bytes_dropped': sum(tee.bytes_dropped for tee in self.tees),
+                'socket_bytes_pending': self.socket_bytes_pending()}
@@ -0,0 +1,441 @@
+#! /bin/env python
+#
+# Benchmarks for the TCP stream parsers.
+#
+#   python -m tcputil.benchmark waveform --streams 1,4,16,64 --blocks 235
+#   python -m tcputil.benchmark receiver --streams 64 --seconds 60
+#   python -m tcputil.benchmark spikes --chunks 100000
+#   python -m tcputil.benchmark snippets --spikes 100000
+#   python -m tcputil.benchmark detector --channels 32,128 --seconds 10
+#   python -m tcputil.benchmark simulator --channels 64,256 --seconds 10
+
+import argparse, socket, threading, time
+import numpy as np
+
+from tcputil.waveform_block import WAVEFORM_MAGIC, FRAMES_PER_BLOCK, parse_waveform_blocks, pack_waveform_blocks
+from tcputil.waveform_receiver import WaveformReceiver
+from tcputil.acquisition_thread import AcquisitionThread
+from tcputil.command_client import connect_command_client
+from tcputil.simulator import RhxSimulator
+from tcputil.spike_chunk import SPIKE_MAGIC, SPIKE_CHUNK_DTYPE, parse_spike_events, index_spike_events
+from tcputil.snippets import extract_snippets
+from tcputil.spike_detector import SpikeDetector
+
+
+def readUint32(array, arrayIndex):
+    variableBytes = array[arrayIndex : arrayIndex + 4]
+    variable = int.from_bytes(variableBytes, byteorder='little', signed=False)
+    arrayIndex = arrayIndex + 4
+    return variable, arrayIndex
+
+def readInt32(array, arrayIndex):
+    variableBytes = array[arrayIndex : arrayIndex + 4]
+    variable = int.from_bytes(variableBytes, byteorder='little', signed=True)
+    arrayIndex = arrayIndex + 4
+    return variable, arrayIndex
+
+def readUint16(array, arrayIndex):
+    variableBytes = array[arrayIndex : arrayIndex + 2]
+    variable = int.from_bytes(variableBytes, byteorder='little', signed=False)
+    arrayIndex = arrayIndex + 2
+    return variable, arrayIndex
+
+def readUint8(array, arrayIndex):
+    variableBytes = array[arrayIndex : arrayIndex + 1]
+    variable = int.from_bytes(variableBytes, byteorder='little', signed=False)
+    arrayIndex = arrayIndex + 1
+    return variable, arrayIndex
+
+def read5char(array, arrayIndex):
+    variableBytes = array[arrayIndex : arrayIndex + 5]
+    variable = variableBytes.decode('utf-8')
+    arrayIndex = arrayIndex + 5
+    return variable, arrayIndex
+
+
+def parse_waveform_blocks_loop(rawData, numStreams, timestep):
+    """The per-sample loop of RHXReadWaveformData.py, extended to numStreams words per frame."""
+    waveformBytesPerBlock = 4 + FRAMES_PER_BLOCK * (4 + 2 * numStreams)
+    numBlocks = int(len(rawData) / waveformBytesPerBlock)
+
+    rawIndex = 0
+    amplifierTimestamps = []
+    amplifierData = [[] for stream in range(numStreams)]
+    for block in range(numBlocks):
+        magicNumber, rawIndex = readUint32(rawData, rawIndex)
+        if magicNumber != WAVEFORM_MAGIC:
+            raise Exception('Error... magic number incorrect')
+        for frame in range(FRAMES_PER_BLOCK):
+            rawTimestamp, rawIndex = readInt32(rawData, rawIndex)
+            amplifierTimestamps.append(rawTimestamp * timestep)
+            for stream in range(numStreams):
+                rawSample, rawIndex = readUint16(rawData, rawIndex)
+                amplifierData[stream].append(0.195 * (rawSample - 32768))
+    return amplifierTimestamps, amplifierData
+
+
+def parse_spike_chunks_loop(spikeArray, timestep):
+    """The per-chunk loop of newprc.py."""
+    bytesPerSpikeChunk = 14
+    chunksToRead = int(len(spikeArray) / bytesPerSpikeChunk)
+
+    spikeIndex = 0
+    names = []
+    timestamps = []
+    ids = []
+    for chunk in range(chunksToRead):
+        magicNumber, spikeIndex = readUint32(spikeArray, spikeIndex)
+        if magicNumber != SPIKE_MAGIC:
+            raise Exception('Error... magic number incorrect')
+        nativeChannelName, spikeIndex = read5char(spikeArray, spikeIndex)
+        singleTimestamp, spikeIndex = readUint32(spikeArray, spikeIndex)
+        singleID, spikeIndex = readUint8(spikeArray, spikeIndex)
+        names.append(nativeChannelName)
+        timestamps.append(float(singleTimestamp) * timestep)
+        ids.append(singleID)
+    return names, timestamps, ids
+
+
+def extract_snippets_loop(amplifierTimestamps, amplifierData, spikeTimestamps, timestep):
+    """The list.index() lookups of newprc.py, for one stream of data."""
+    rtimestamps = [float(i) * timestep for i in spikeTimestamps]
+    mark = [amplifierTimestamps.index(i) for i in rtimestamps]
+    snippets = []
+    for i in range(len(mark)):
+        spike_arr = amplifierTimestamps[mark[i] - 50:mark[i] + 50]
+        spike_mark = [amplifierTimestamps.index(i) for i in spike_arr]
+        snippets.append([amplifierData[i] for i in spike_mark])
+    return snippets
+
+
+def make_waveform_buffer(num_streams, num_blocks, seed=0):
+    """Random waveform-port bytes for num_blocks blocks of num_streams streams."""
+    rng = np.random.default_rng(seed)
+    num_samples = FRAMES_PER_BLOCK * num_blocks
+    return pack_waveform_blocks(np.arange(num_samples, dtype=np.int32),
+                                rng.integers(0, 65536, (num_streams, num_samples), dtype=np.uint16))
+
+
+def bench_waveform(stream_counts, num_blocks=235, sample_rate=30000.0, repeats=3):
+    """Times parse_waveform_blocks() against the per-sample loop for each stream count.
+
+    Returns a list of {'streams', 'loop_seconds', 'vectorized_seconds',
+    'speedup', 'realtime_streams'} dictionaries (best of repeats runs), where
+    realtime_streams estimates how many streams the vectorized parser could
+    keep up with at sample_rate.  The two parsers' outputs are also checked
+    against each other.
+    """
+    results = []
+    for num_streams in stream_counts:
+        buffer = make_waveform_buffer(num_streams, num_blocks)
+
+        loop_seconds = float('inf')
+        for _ in range(repeats):
+            tic = time.perf_counter()
+            t_loop, data_loop = parse_waveform_blocks_loop(buffer, num_streams, 1 / sample_rate)
+            loop_seconds = min(loop_seconds, time.perf_counter() - tic)
+
+        vectorized_seconds = float('inf')
+        for _ in range(repeats):
+            tic = time.perf_counter()
+            parsed = parse_waveform_blocks(buffer, num_streams, sample_rate)
+            vectorized_seconds = min(vectorized_seconds, time.perf_counter() - tic)
+
+        if not (np.allclose(parsed['t'], t_loop) and np.array_equal(parsed['amplifier_data'], np.array(data_loop))):
+            raise Exception('Vectorized and per-sample parsers disagree for {} streams.'.format(num_streams))
+
+        seconds_of_data = FRAMES_PER_BLOCK * num_blocks / sample_rate
+        results.append({'streams': num_streams, 'loop_seconds': loop_seconds, 'vectorized_seconds': vectorized_seconds,
+                        'speedup': loop_seconds / vectorized_seconds,
+                        'realtime_streams': num_streams * seconds_of_data / vectorized_seconds})
+    return results
+
+
+def make_spike_buffer(num_chunks, num_channels=64, seed=0):
+    """Random spike-port bytes for num_chunks events on num_channels channels, in timestamp order."""
+    rng = np.random.default_rng(seed)
+    chunks = np.empty(num_chunks, dtype=SPIKE_CHUNK_DTYPE)
+    chunks['magic'] = SPIKE_MAGIC
+    names = np.array(['A-{:03d}'.format(channel) for channel in range(num_channels)], dtype='S5')
+    chunks['name'] = names[rng.integers(0, num_channels, num_chunks)]
+    chunks['timestamp'] = np.sort(rng.integers(0, 2**31, num_chunks))
+    chunks['id'] = rng.integers(1, 4, num_chunks)
+    return chunks.tobytes()
+
+
+def bench_spikes(num_chunks=100000, sample_rate=30000.0, repeats=3):
+    """Times parse_spike_events() (and index_spike_events()) against the per-chunk loop.
+
+    Returns {'chunks', 'loop_seconds', 'vectorized_seconds', 'index_seconds',
+    'speedup'} (best of repeats runs), after checking that both parsers agree.
+    """
+    buffer = make_spike_buffer(num_chunks)
+
+    loop_seconds = float('inf')
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        names, t_loop, ids = parse_spike_chunks_loop(buffer, 1 / sample_rate)
+        loop_seconds = min(loop_seconds, time.perf_counter() - tic)
+
+    vectorized_seconds = index_seconds = float('inf')
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        events, consumed = parse_spike_events(buffer, sample_rate)
+        toc = time.perf_counter()
+        index_spike_events(events)
+        vectorized_seconds = min(vectorized_seconds, toc - tic)
+        index_seconds = min(index_seconds, time.perf_counter() - toc)
+
+    if not (np.array_equal(events['channels'][events['channel']], names) and np.allclose(events['t'], t_loop)
+            and np.array_equal(events['id'], ids)):
+        raise Exception('Vectorized and per-chunk spike parsers disagree.')
+
+    return {'chunks': num_chunks, 'loop_seconds': loop_seconds, 'vectorized_seconds': vectorized_seconds,
+            'index_seconds': index_seconds, 'speedup': loop_seconds / vectorized_seconds}
+
+
+def bench_snippets(num_spikes=100000, num_streams=4, seconds_of_data=60, sample_rate=30000.0, loop_spikes=100,
+                   repeats=3):
+    """Times extract_snippets() on num_spikes spikes in seconds_of_data of num_streams streams.
+
+    The list.index() loop is only timed on the first loop_spikes spikes
+    (its cost grows with both the number of spikes and the length of the
+    data) and extrapolated.  Returns {'spikes', 'snippets_per_second',
+    'vectorized_seconds', 'loop_seconds_per_spike', 'speedup'}, after
+    checking that both agree on those spikes.
+    """
+    rng = np.random.default_rng(0)
+    num_samples = int(seconds_of_data * sample_rate)
+    timestep = 1 / sample_rate
+    timestamps = np.arange(num_samples, dtype=np.int32)
+    data = 0.195 * (rng.integers(0, 65536, (num_streams, num_samples)) - 32768)
+    spike_timestamps = np.sort(rng.integers(50, num_samples - 50, num_spikes))
+
+    vectorized_seconds = float('inf')
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        snippets = extract_snippets(data, timestamps, spike_timestamps)
+        vectorized_seconds = min(vectorized_seconds, time.perf_counter() - tic)
+
+    amplifierTimestamps = (timestamps * timestep).tolist()
+    tic = time.perf_counter()
+    snippets_loop = extract_snippets_loop(amplifierTimestamps, data[0].tolist(), spike_timestamps[:loop_spikes].tolist(),
+                                          timestep)
+    loop_seconds_per_spike = (time.perf_counter() - tic) / loop_spikes
+    if not np.array_equal(snippets['snippets'][:loop_spikes, 0], np.array(snippets_loop)):
+        raise Exception('Vectorized and list.index() snippet extraction disagree.')
+
+    return {'spikes': num_spikes, 'vectorized_seconds': vectorized_seconds,
+            'snippets_per_second': num_spikes / vectorized_seconds, 'loop_seconds_per_spike': loop_seconds_per_spike,
+            'speedup': loop_seconds_per_spike * num_spikes / vectorized_seconds}
+
+
+def bench_detector(num_channels, seconds_of_data=10, sample_rate=30000.0, blocks_per_call=1, spike_rate=10.0):
+    """Feeds SpikeDetector synthetic wideband data, blocks_per_call waveform blocks at a time.
+
+    The data are 10 uV rms noise plus -100 uV spikes at spike_rate Hz on
+    every channel.  Returns the detector's latency() plus 'channels',
+    'block_seconds' (the real time one block takes to acquire) and
+    'recall', the fraction of injected spikes detected within 3 samples.
+    """
+    rng = np.random.default_rng(0)
+    samples_per_call = FRAMES_PER_BLOCK * blocks_per_call
+    num_calls = int(seconds_of_data * sample_rate) // samples_per_call
+    num_samples = num_calls * samples_per_call
+    data = rng.normal(0, 10, (num_channels, num_samples))
+
+    # Spikes at least 2 ms apart: a 0.3 ms trough then a slower recovery.
+    shape = -100 * np.exp(-0.5 * ((np.arange(30) - 6) / 3.0) ** 2)
+    spike_channels, spike_samples = [], []
+    for channel in range(num_channels):
+        gaps = rng.exponential(sample_rate / spike_rate, int(2 * spike_rate * seconds_of_data)) + 60
+        samples = np.cumsum(gaps).astype(np.int64)
+        samples = samples[samples < num_samples - len(shape)]
+        data[channel, samples[:, np.newaxis] + np.arange(len(shape))] += shape
+        spike_channels.append(np.full(len(samples), channel))
+        spike_samples.append(samples)
+    spike_channels = np.concatenate(spike_channels)
+    spike_samples = np.concatenate(spike_samples)
+
+    detector = SpikeDetector(num_channels, sample_rate)
+    found_channels, found_samples = [], []
+    timestamps = np.arange(num_samples, dtype=np.int32)
+    for start in range(0, num_samples, samples_per_call):
+        events = detector.process(data[:, start:start + samples_per_call], timestamps[start:start + samples_per_call])
+        found_channels.append(events['channel'])
+        found_samples.append(events['timestamp'])
+
+    # An injected spike counts as found if its channel has an event 0-6 samples after its onset.
+    found = np.concatenate(found_channels).astype(np.int64) * num_samples + np.concatenate(found_samples)
+    found.sort()
+    wanted = spike_channels * num_samples + spike_samples
+    after = np.searchsorted(found, wanted)
+    hit = (after < len(found)) & (found[np.minimum(after, len(found) - 1)] - wanted <= 6)
+
+    result = detector.latency()
+    result.update({'channels': num_channels, 'block_seconds': FRAMES_PER_BLOCK / sample_rate,
+                   'recall': float(np.mean(hit)), 'detected': detector.spikes_detected, 'injected': len(wanted)})
+    return result
+
+
+def bench_receiver(num_streams, seconds_of_data=60, sample_rate=30000.0, write_size=65536):
+    """Pushes seconds_of_data of waveform data through a local socket pair into a WaveformReceiver.
+
+    The sender writes in write_size pieces that ignore block boundaries.
+    Returns {'streams', 'seconds', 'realtime_factor', 'blocks', 'gaps'},
+    where realtime_factor is how many times faster than acquisition the data
+    was received and decoded.
+    """
+    one_second = make_waveform_buffer(num_streams, int(np.ceil(sample_rate / FRAMES_PER_BLOCK)))
+    receive_socket, send_socket = socket.socketpair()
+
+    def send():
+        # Timestamps repeat every second of data; only throughput matters here.
+        view = memoryview(one_second)
+        for _ in range(seconds_of_data):
+            for start in range(0, len(view), write_size):
+                send_socket.sendall(view[start:start + write_size])
+        send_socket.close()
+
+    receiver = WaveformReceiver(receive_socket, num_streams, sample_rate)
+    sender = threading.Thread(target=send)
+    tic = time.perf_counter()
+    sender.start()
+    for data in receiver.iter_decoded():
+        pass
+    seconds = time.perf_counter() - tic
+    sender.join()
+    receive_socket.close()
+
+    return {'streams': num_streams, 'seconds': seconds, 'realtime_factor': seconds_of_data / seconds,
+            'blocks': receiver.blocks_received, 'gaps': receiver.num_gaps}
+
+
+def bench_simulator(num_channels, seconds_of_data=10, sample_rate=30000, speed=None):
+    """Streams from a local RhxSimulator through the command client and an AcquisitionThread.
+
+    Wide and spike bands are enabled on num_channels channels, the
+    simulator runs at speed times real time (as fast as possible with
+    None) and the run is stopped once seconds_of_data have been delivered.
+    Returns {'channels', 'seconds', 'realtime_factor', 'configure_seconds'}
+    plus the acquisition counters.
+    """
+    with RhxSimulator(command_port=0, waveform_port=0, spike_port=0, num_channels=num_channels,
+                      sample_rate=sample_rate, speed=speed) as simulator:
+        client = connect_command_client('127.0.0.1', simulator.command_port)
+        waveform_socket = socket.create_connection(('127.0.0.1', simulator.waveform_port))
+        spike_socket = socket.create_connection(('127.0.0.1', simulator.spike_port))
+
+        commands = ['execute clearalldataoutputs']
+        for name in simulator.channels:
+            commands += ['set {}.tcpdataoutputenabled true'.format(name),
+                         'set {}.tcpdataoutputenabledspike true'.format(name)]
+        configure_seconds = client.configure(commands)
+
+        done = threading.Event()
+        wanted = int(seconds_of_data * sample_rate) // FRAMES_PER_BLOCK
+
+        def consume(data):
+            if acquisition.blocks_delivered >= wanted:
+                done.set()
+
+        acquisition = AcquisitionThread(waveform_socket, 2 * num_channels, sample_rate, spike_socket)
+        acquisition.add_consumer(consume)
+        acquisition.start()
+        tic = time.perf_counter()
+        client.set('runmode', 'run')
+        client.flush()
+        done.wait()
+        seconds = time.perf_counter() - tic
+        client.set('runmode', 'stop')
+        client.flush()
+        acquisition.stop()
+        counters = acquisition.counters()
+        for sock in (client.sock, waveform_socket, spike_socket):
+            sock.close()
+
+    result = {'channels': num_channels, 'seconds': seconds, 'configure_seconds': configure_seconds,
+              'realtime_factor': counters['blocks_delivered'] * FRAMES_PER_BLOCK / sample_rate / seconds}
+    result.update(counters)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the TCP stream parsers.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    waveform_parser = subparsers.add_parser('waveform', help='vectorized vs per-sample waveform port parsing')
+    waveform_parser.add_argument('--streams', default='1,4,16,64',
+                                 help='comma-separated numbers of streams per frame (default: %(default)s)')
+    waveform_parser.add_argument('--blocks', type=int, default=235,
+                                 help='blocks per buffer (default: %(default)s, about 1 s at 30 kHz)')
+    waveform_parser.add_argument('--repeats', type=int, default=3)
+
+    receiver_parser = subparsers.add_parser('receiver', help='sustained WaveformReceiver throughput over a local socket')
+    receiver_parser.add_argument('--streams', default='64,128,256',
+                                 help='comma-separated numbers of streams per frame (default: %(default)s)')
+    receiver_parser.add_argument('--seconds', type=int, default=60, help='seconds of 30 kHz data to send')
+
+    spikes_parser = subparsers.add_parser('spikes', help='vectorized vs per-chunk spike port parsing')
+    spikes_parser.add_argument('--chunks', type=int, default=100000, help='spike events per buffer (default: %(default)s)')
+    spikes_parser.add_argument('--repeats', type=int, default=3)
+
+    snippets_parser = subparsers.add_parser('snippets', help='searchsorted vs list.index() spike snippet extraction')
+    snippets_parser.add_argument('--spikes', type=int, default=100000, help='spikes to extract (default: %(default)s)')
+    snippets_parser.add_argument('--streams', type=int, default=4, help='streams per snippet (default: %(default)s)')
+    snippets_parser.add_argument('--seconds', type=float, default=60, help='seconds of 30 kHz data (default: %(default)s)')
+    snippets_parser.add_argument('--repeats', type=int, default=3)
+
+    detector_parser = subparsers.add_parser('detector', help='per-block latency of the online threshold spike detector')
+    detector_parser.add_argument('--channels', default='32,128,256',
+                                 help='comma-separated numbers of channels (default: %(default)s)')
+    detector_parser.add_argument('--seconds', type=float, default=10, help='seconds of 30 kHz data (default: %(default)s)')
+    detector_parser.add_argument('--blocks', type=int, default=1, help='blocks per process() call (default: %(default)s)')
+
+    simulator_parser = subparsers.add_parser('simulator', help='end-to-end streaming from the local RHX simulator')
+    simulator_parser.add_argument('--channels', default='32,128,256',
+                                  help='comma-separated numbers of channels, wide and spike bands (default: %(default)s)')
+    simulator_parser.add_argument('--seconds', type=float, default=10, help='seconds of 30 kHz data to stream')
+
+    args = parser.parse_args()
+    if args.command == 'waveform':
+        stream_counts = [int(s) for s in args.streams.split(',')]
+        print('{:>8} {:>10} {:>12} {:>9} {:>17}'.format('streams', 'loop s', 'vectorized s', 'speedup', 'realtime streams'))
+        for r in bench_waveform(stream_counts, args.blocks, repeats=args.repeats):
+            print('{:>8} {:>10.3f} {:>12.5f} {:>9.0f} {:>17.0f}'.format(r['streams'], r['loop_seconds'],
+                                                                       r['vectorized_seconds'], r['speedup'],
+                                                                       r['realtime_streams']))
+    elif args.command == 'receiver':
+        print('{:>8} {:>10} {:>15} {:>8}'.format('streams', 'seconds', 'x real time', 'blocks'))
+        for num_streams in [int(s) for s in args.streams.split(',')]:
+            r = bench_receiver(num_streams, args.seconds)
+            print('{:>8} {:>10.2f} {:>15.1f} {:>8}'.format(r['streams'], r['seconds'], r['realtime_factor'], r['blocks']))
+    elif args.command == 'spikes':
+        r = bench_spikes(args.chunks, repeats=args.repeats)
+        print('{:>8} {:>10} {:>12} {:>9} {:>9}'.format('chunks', 'loop s', 'vectorized s', 'index s', 'speedup'))
+        print('{:>8} {:>10.3f} {:>12.5f} {:>9.5f} {:>9.0f}'.format(r['chunks'], r['loop_seconds'], r['vectorized_seconds'],
+                                                                  r['index_seconds'], r['speedup']))
+    elif args.command == 'snippets':
+        r = bench_snippets(args.spikes, args.streams, args.seconds, repeats=args.repeats)
+        print('{:>8} {:>12} {:>14} {:>15} {:>9}'.format('spikes', 'vectorized s', 'snippets / s', 'loop s / spike',
+                                                       'speedup'))
+        print('{:>8} {:>12.4f} {:>14.0f} {:>15.5f} {:>9.0f}'.format(r['spikes'], r['vectorized_seconds'],
+                                                                   r['snippets_per_second'],
+                                                                   r['loop_seconds_per_spike'], r['speedup']))
+    elif args.command == 'detector':
+        print('{:>8} {:>14} {:>14} {:>12} {:>7} {:>9}'.format('channels', 'ms per block', 'worst call ms', 'x real time',
+                                                          'recall', 'detected'))
+        for num_channels in [int(c) for c in args.channels.split(',')]:
+            r = bench_detector(num_channels, args.seconds, blocks_per_call=args.blocks)
+            print('{:>8} {:>14.3f} {:>14.3f} {:>12.1f} {:>7.3f} {:>9}'.format(r['channels'], 1e3 * r['seconds_per_block'],
+                                                                           1e3 * r['max_call_seconds'],
+                                                                           r['realtime_factor'], r['recall'],
+                                                                           r['detected']))
+    elif args.command == 'simulator':
+        print('{:>8} {:>10} {:>15} {:>12} {:>8} {:>8}'.format('channels', 'seconds', 'x real time', 'configure s',
+                                                             'dropped', 'spikes'))
+        for num_channels in [int(c) for c in args.channels.split(',')]:
+            r = bench_simulator(num_channels, args.seconds)
+            print('{:>8} {:>10.2f} {:>15.1f} {:>12.3f} {:>8} {:>8}'.format(r['channels'], r['seconds'], r['realtime_factor'],
+                                                                         r['configure_seconds'], r['blocks_dropped'],
+                                                                         r['spikes_received']))
@@ -0,0 +1,106 @@
+#! /bin/env python
+#
+# Reframing of fixed-size records (waveform blocks, spike chunks) received
+# from a TCP stream, without allocating per read.
+
+import numpy as np
+
+
+class BlockReceiver(object):
+    """Collects fixed-size records of record_dtype from a stream socket.
+
+    Bytes are received with socket.recv_into() into one preallocated buffer
+    of buffer_records records.  Each receive() hands back the complete
+    records that have arrived as a structured array viewing the buffer; a
+    record split across reads is kept and completed by the next read.
+    Arrays handed out are only valid until the next call.
+
+    For event loops or other socket APIs, write_view() and commit() split
+    receive() in two: fill (part of) write_view() yourself, then pass the
+    number of bytes written to commit().
+
+    If tee is set (a tcputil.tee.TeeWriter), every batch of complete
+    records is also queued there, to record the raw stream to disk.
+    """
+
+    def __init__(self, sock, record_dtype, buffer_records=256, tee=None):
+        self.sock = sock
+        self.record_dtype = np.dtype(record_dtype)
+        self.bytes_per_record = self.record_dtype.itemsize
+
+        # At least 4 records, so that moving the partial record left at the
+        # end of the buffer back to its start never overlaps itself.
+        self.buffer = bytearray(max(4, buffer_records) * self.bytes_per_record)
+        self.view = memoryview(self.buffer)
+        self.read_pos = 0
+        self.write_pos = 0
+
+        self.bytes_received = 0
+        self.records_received = 0
+        self.closed = False
+        self.tee = tee
+
+    def write_view(self):
+        """Free space to receive into; always room for at least one whole record."""
+        if len(self.buffer) - self.write_pos < self.bytes_per_record:
+            partial = self.write_pos - self.read_pos
+            self.view[:partial] = self.view[self.read_pos:self.write_pos]
+            self.read_pos, self.write_pos = 0, partial
+        return self.view[self.write_pos:]
+
+    def commit(self, n):
+        """Accounts for n bytes written into write_view() and returns the completed records.
+
+        n == 0 means the connection was closed, and None is returned.
+        """
+        if n == 0:
+            self.closed = True
+            return None
+        self.write_pos += n
+        self.bytes_received += n
+
+        num_records = (self.write_pos - self.read_pos) // self.bytes_per_record
+        records = np.frombuffer(self.buffer, dtype=self.record_dtype, count=num_records, offset=self.read_pos)
+        self.read_pos += num_records * self.bytes_per_record
+        if self.read_pos == self.write_pos:
+            self.read_pos = self.write_pos = 0
+
+        self.records_received += num_records
+        if num_records > 0:
+            self.check(records)
+            if self.tee is not None:
+                self.tee.write(records, self.first_timestamp(records))
+        return records
+
+    def partial(self):
+        """The bytes of the incomplete record received so far (a copy)."""
+        return bytes(self.view[self.read_pos:self.write_pos])
+
+    def check(self, records):
+        """Hook for subclasses to validate or count each batch of complete records."""
+        pass
+
+    def first_timestamp(self, records):
+        """Timestamp of the first record, for the tee index (-1 if records have no 'timestamp' field)."""
+        if 'timestamp' in self.record_dtype.names:
+            return int(records['timestamp'][0])
+        return -1
+
+    def receive(self):
+        """Waits for data and returns the complete records received so far.
+
+        Returns an empty array if no record was completed by this read, and
+        None once the connection has been closed by the other side.
+        """
+        if self.closed:
+            return None
+        return self.commit(self.sock.recv_into(self.write_view()))
+
+    def __iter__(self):
+        """Yields the records from each non-empty receive() until the connection closes."""
+        while True:
+            records = self.receive()
+            if records is None:
+                return
+            if len(records) > 0:
+                yield records
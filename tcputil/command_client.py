@@ -0,0 +1,228 @@
+#! /bin/env python
+#
+# Batched client for the RHX Remote TCP Control command port.
+#
+# RHX accepts several commands in one write, separated by ';', and only
+# answers 'get' commands (with 'Return: Name value') and failed commands
+# (with 'Error - ...').  Replies are not terminated, so one recv() can hold
+# several of them, or part of one.
+
+import codecs, re, select, socket, time
+
+COMMAND_BUFFER_SIZE = 1024
+
+# Every write ends with 'get runmode'.  Its reply comes after RHX has
+# processed the rest of the write, so it acknowledges the whole write; its
+# start is what completes the reply before it, and its value is one of a
+# few known run modes, so it can be told complete without a reply after it.
+ACKNOWLEDGE_PARAMETER = 'runmode'
+
+
+class CommandReplyFramer(object):
+    """Splits the text arriving on the command port into whole replies.
+
+    feed() returns the replies completed by a chunk of received bytes.  The
+    last reply seen so far is held back in pending, because the next chunk
+    may still extend it; a new reply starting completes it, as does the
+    whole of a 'get runmode' reply arriving (no run mode is the start of
+    another).
+    """
+
+    # A reply starts with one of RHX's two prefixes; 'Error' alone also
+    # turns up inside values (e.g. a file name), so the split needs 'Error - '.
+    REPLY_START = re.compile(r'(?=Return: |Error - )')
+    WHOLE_REPLY = re.compile(r'Return: RunMode (Run|Stop|Record|Trigger)', re.IGNORECASE)
+
+    def __init__(self):
+        self.pending = ''
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def feed(self, data):
+        messages = self.REPLY_START.split(self.pending + self.decoder.decode(data))
+        self.pending = messages.pop()
+        if self.WHOLE_REPLY.fullmatch(self.pending.strip()):
+            messages.append(self.pending)
+            self.pending = ''
+        return [message.strip() for message in messages if message.strip()]
+
+
+class CommandClient(object):
+    """Sends RHX commands in ';'-separated batches and waits for RHX to acknowledge them.
+
+    set() and execute() only queue commands; flush() (or get(), or leaving
+    a batch() block) sends them in as few writes as max_batch_bytes allows,
+    each followed by 'get runmode', and waits for every acknowledgement
+    instead of sleeping a fixed time per command:
+
+        rhx = CommandClient(scommand)
+        with rhx.batch():
+            for channel in channels:
+                rhx.set(channel + '.tcpdataoutputenabled', 'true')
+        print(rhx.latency())
+
+    get() sends 'get parameter;get runmode' the same way, so that the
+    value is complete once the acknowledgement starts to arrive; no reply
+    is ever taken as complete because the connection went quiet.  Both
+    return once the acknowledgement itself is complete, so nothing is left
+    unread on the socket.  Error replies are collected in errors, and
+    flush() raises an exception if a batch produced any.
+    """
+
+    def __init__(self, sock, timeout=5.0, max_batch_bytes=COMMAND_BUFFER_SIZE):
+        self.sock = sock
+        self.timeout = timeout
+        self.max_batch_bytes = max_batch_bytes
+
+        self.framer = CommandReplyFramer()
+        self.replies = []
+        self.expected = []      # parameters of the 'Return: ' replies to come, None for acknowledgements
+        self.queued = []
+        self.errors = []
+
+        self.commands_sent = 0
+        self.batches_sent = 0
+        self.seconds_waiting = 0.0
+
+    def set(self, parameter, value):
+        """Queues 'set parameter value'."""
+        self.queued.append('set {} {}'.format(parameter, value))
+
+    def execute(self, action, *arguments):
+        """Queues 'execute action arguments...'."""
+        self.queued.append(' '.join(['execute', action] + [str(a) for a in arguments]))
+
+    def get(self, parameter):
+        """Sends any queued commands, then 'get parameter', and returns the value from RHX's reply."""
+        self.flush()
+        tic = time.perf_counter()
+        self.sock.sendall('get {};get {}'.format(parameter, ACKNOWLEDGE_PARAMETER).encode('utf-8'))
+        self.expected += [parameter, None]
+        self.commands_sent += 1
+        value = self.wait_for_return(parameter)
+        self.seconds_waiting += time.perf_counter() - tic
+        return value
+
+    def batch(self):
+        """Context manager that flushes the commands queued inside it on exit."""
+        return CommandBatch(self)
+
+    def batches(self):
+        """Groups the queued commands (each with the acknowledging get) into ';'-joined strings of at most max_batch_bytes."""
+        acknowledge = 'get ' + ACKNOWLEDGE_PARAMETER
+        batches = []
+        commands = []
+        size = len(acknowledge)
+        for command in self.queued:
+            if commands and size + len(command) + 1 > self.max_batch_bytes:
+                batches.append(';'.join(commands + [acknowledge]))
+                commands = []
+                size = len(acknowledge)
+            commands.append(command)
+            size += len(command) + 1
+        if commands:
+            batches.append(';'.join(commands + [acknowledge]))
+        return batches
+
+    def flush(self):
+        """Sends the queued commands and waits until RHX has acknowledged all of them.
+
+        Returns the number of seconds this took.
+        """
+        if not self.queued:
+            return 0.0
+        tic = time.perf_counter()
+        num_errors = len(self.errors)
+        for batch in self.batches():
+            self.sock.sendall(batch.encode('utf-8'))
+            self.expected.append(None)
+            self.wait_for_acknowledgement()
+            self.batches_sent += 1
+        self.commands_sent += len(self.queued)
+        self.queued = []
+        seconds = time.perf_counter() - tic
+        self.seconds_waiting += seconds
+
+        if len(self.errors) > num_errors:
+            raise Exception('RHX rejected commands: ' + '; '.join(self.errors[num_errors:]))
+        return seconds
+
+    def configure(self, commands):
+        """Sends a list of command strings ('set ...', 'execute ...') as batches; returns the seconds taken."""
+        self.queued.extend(commands)
+        return self.flush()
+
+    def latency(self):
+        """Totals for sizing configuration steps: commands and batches sent, and seconds spent waiting on RHX."""
+        return {'commands': self.commands_sent, 'batches': self.batches_sent, 'seconds': self.seconds_waiting}
+
+    def file_reply(self, message):
+        """Matches a complete reply to the oldest expected one; returns the value if it answers a get, else None.
+
+        Acknowledgements are dropped, and other replies go to errors.
+        """
+        if message.lower().startswith('return: ') and self.expected:
+            parameter = self.expected.pop(0)
+            if parameter is None:
+                return None
+            prefix = 'return: ' + parameter.lower() + ' '
+            if not (message + ' ').lower().startswith(prefix):
+                raise Exception('RHX replied {!r} to get {}'.format(message, parameter))
+            return message[len(prefix):].strip()
+        if self.expected and self.expected[0] is not None:
+            # The get is the only command in its write that can fail.
+            raise Exception('RHX rejected get {}: {}'.format(self.expected.pop(0), message))
+        self.errors.append(message)
+        return None
+
+    def receive(self, deadline, waiting_for):
+        """Reads one chunk from the command port into replies, or raises an exception at deadline."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([self.sock], [], [], remaining)[0]:
+            raise Exception('Timed out waiting for RHX to {}'.format(waiting_for))
+        data = self.sock.recv(COMMAND_BUFFER_SIZE)
+        if not data:
+            raise Exception('RHX closed the command connection')
+        self.replies.extend(self.framer.feed(data))
+
+    def wait_for_return(self, parameter):
+        """Reads replies until the 'get parameter' sent last and its acknowledgement are complete; returns the value."""
+        deadline = time.monotonic() + self.timeout
+        value = None
+        while True:
+            while self.replies:
+                reply_value = self.file_reply(self.replies.pop(0))
+                if reply_value is not None:
+                    value = reply_value
+            if not self.expected:
+                return value
+            self.receive(deadline, 'return ' + parameter)
+
+    def wait_for_acknowledgement(self):
+        """Reads replies until the acknowledgement sent last is complete, and with it every reply before it."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            while self.replies:
+                self.file_reply(self.replies.pop(0))
+            if not self.expected:
+                return
+            self.receive(deadline, 'acknowledge a batch')
+
+
+class CommandBatch(object):
+
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        return self.client
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.client.flush()
+
+
+def connect_command_client(host='127.0.0.1', port=5000, **kwargs):
+    """Connects to the RHX command port and returns a CommandClient for it."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((host, port))
+    return CommandClient(sock, **kwargs)
@@ -0,0 +1,180 @@
+#! /bin/env python
+#
+# asyncio client for the RHX Remote TCP Control command, waveform and spike
+# ports, all served from one event loop.
+
+import asyncio, socket
+
+from tcputil.block_receiver import BlockReceiver
+from tcputil.command_client import ACKNOWLEDGE_PARAMETER, CommandReplyFramer
+from tcputil.waveform_block import decode_waveform_blocks
+from tcputil.waveform_receiver import WaveformReceiver
+from tcputil.spike_chunk import SPIKE_CHUNK_DTYPE, decode_spike_chunks
+
+COMMAND_BUFFER_SIZE = 1024
+
+
+class RhxClient(object):
+    """Keeps the RHX command, waveform and spike connections on one asyncio event loop.
+
+    Commands are awaitable, and the data ports are read by async iterators
+    while commands are being sent, so acquisition runs alongside control
+    instead of after it:
+
+        async with RhxClient() as rhx:
+            sample_rate = float(await rhx.get('sampleratehertz'))
+            await rhx.execute('clearalldataoutputs')
+            await rhx.set('a-010.tcpdataoutputenabled', 'true')
+            await rhx.set('runmode', 'run')
+            async for data in rhx.waveform_blocks(1, sample_rate):
+                ...                                 # 128-sample blocks as they arrive
+                if data['t'][-1] > 5: break
+            await rhx.set('runmode', 'stop')
+
+    RHX sends nothing back for 'set' and 'execute' commands unless they
+    fail, so every command goes out followed by 'get runmode', as in
+    CommandClient, and is awaited until that acknowledgement returns
+    instead of for a fixed delay.  A command that RHX rejects raises an
+    exception; its error messages are also collected in errors.
+    """
+
+    def __init__(self, host='127.0.0.1', command_port=5000, waveform_port=5001, spike_port=5002, timeout=5.0):
+        self.host = host
+        self.command_port = command_port
+        self.waveform_port = waveform_port
+        self.spike_port = spike_port
+        self.timeout = timeout
+
+        self.command_socket = None
+        self.waveform_socket = None
+        self.spike_socket = None
+        self.waveform_receiver = None
+        self.spike_receiver = None
+        self.errors = []
+
+    async def connect(self, waveform=True, spike=True):
+        """Connects to the command port and, if asked for, the waveform and spike ports."""
+        self.loop = asyncio.get_running_loop()
+        self.responses = asyncio.Queue()
+        self.command_lock = asyncio.Lock()
+
+        self.command_socket = await self.open_socket(self.command_port)
+        if waveform:
+            self.waveform_socket = await self.open_socket(self.waveform_port)
+        if spike:
+            self.spike_socket = await self.open_socket(self.spike_port)
+        self.command_reader = self.loop.create_task(self.read_command_port())
+        return self
+
+    async def open_socket(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        await self.loop.sock_connect(sock, (self.host, port))
+        return sock
+
+    async def close(self):
+        """Stops reading the command port and closes every connection."""
+        if self.command_socket is not None:
+            self.command_reader.cancel()
+            try:
+                await self.command_reader
+            except asyncio.CancelledError:
+                pass
+        for sock in (self.command_socket, self.waveform_socket, self.spike_socket):
+            if sock is not None:
+                sock.close()
+        self.command_socket = self.waveform_socket = self.spike_socket = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def read_command_port(self):
+        """Splits text from the command port into messages ('Return: ...' or errors)."""
+        # Several replies can arrive in one read, or one reply over several;
+        # see CommandReplyFramer for when the last one is complete.
+        framer = CommandReplyFramer()
+        while True:
+            data = await self.loop.sock_recv(self.command_socket, COMMAND_BUFFER_SIZE)
+            if not data:
+                return
+            for message in framer.feed(data):
+                self.responses.put_nowait(message)
+
+    async def send(self, command):
+        """Sends one command string, terminated by ';'.
+
+        Small writes can reach RHX merged into one TCP segment; the ';' keeps
+        the commands apart, as in the batches RHX accepts.
+        """
+        await self.loop.sock_sendall(self.command_socket, (command.rstrip(';') + ';').encode('utf-8'))
+
+    async def command(self, command, parameter=None):
+        """Sends command followed by 'get runmode' and awaits the replies up to that acknowledgement.
+
+        If command is 'get parameter', returns the value from its 'Return:
+        Parameter value' reply.
+        """
+        async with self.command_lock:
+            await self.send('{};get {}'.format(command, ACKNOWLEDGE_PARAMETER))
+            expected = [None] if parameter is None else [parameter, None]
+            value = None
+            errors = []
+            while expected:
+                message = await asyncio.wait_for(self.responses.get(), self.timeout)
+                if not message.startswith('Return: '):
+                    errors.append(message)
+                    if expected[0] is not None:
+                        expected.pop(0)     # the get failed; only the acknowledgement is still to come
+                    continue
+                name, _, reply_value = message[len('Return: '):].partition(' ')
+                expected_parameter = expected.pop(0)
+                if expected_parameter is not None:
+                    if name.lower() != expected_parameter.lower():
+                        raise Exception('RHX replied {!r} to {}'.format(message, command))
+                    value = reply_value
+        if errors:
+            self.errors.extend(errors)
+            raise Exception('RHX rejected {}: {}'.format(command, '; '.join(errors)))
+        return value
+
+    async def get(self, parameter):
+        """Sends 'get parameter' and returns the value from the 'Return: Parameter value' reply."""
+        return await self.command('get ' + parameter, parameter)
+
+    async def set(self, parameter, value):
+        """Sends 'set parameter value' and awaits RHX's acknowledgement."""
+        await self.command('set {} {}'.format(parameter, value))
+
+    async def execute(self, action, *arguments):
+        """Sends 'execute action arguments...' and awaits RHX's acknowledgement."""
+        await self.command(' '.join(['execute', action] + [str(a) for a in arguments]))
+
+    async def waveform_blocks(self, num_streams, sample_rate=None, scale=True, buffer_blocks=256):
+        """Async iterator of decoded waveform data (see decode_waveform_blocks()).
+
+        Each item holds the whole blocks received by one read.  Its arrays are
+        reused for the next item; copy anything that must be kept.  Counters
+        are available from waveform_receiver while iterating.
+        """
+        receiver = self.waveform_receiver = WaveformReceiver(self.waveform_socket, num_streams, sample_rate,
+                                                             buffer_blocks)
+        out = receiver.decoded_buffers(scale)
+        while True:
+            blocks = receiver.commit(await self.loop.sock_recv_into(self.waveform_socket, receiver.write_view()))
+            if blocks is None:
+                return
+            if len(blocks) > 0:
+                yield decode_waveform_blocks(blocks, sample_rate, scale, out)
+
+    async def spike_events(self, sample_rate=None, buffer_chunks=1024):
+        """Async iterator of decoded spike events (see decode_spike_chunks()), one item per read."""
+        receiver = self.spike_receiver = BlockReceiver(self.spike_socket, SPIKE_CHUNK_DTYPE, buffer_chunks)
+        while True:
+            chunks = receiver.commit(await self.loop.sock_recv_into(self.spike_socket, receiver.write_view()))
+            if chunks is None:
+                return
+            if len(chunks) > 0:
+                yield decode_spike_chunks(chunks, sample_rate)
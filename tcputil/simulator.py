@@ -0,0 +1,441 @@
+#! /bin/env python
+#
+# Local stand-in for the RHX Remote TCP Control servers, for running the
+# clients and demo scripts without a controller.
+#
+#   python -m tcputil.simulator --channels 64 --speed 1
+#
+# It implements the part of the command protocol the scripts here use
+# ('get type', 'get sampleratehertz', 'get runmode', 'get
+# stimstepsizemicroamps', 'get uploadinprogress', 'set ...', 'execute ...')
+# and, while running, streams synthetic waveform blocks and spike chunks.
+
+import argparse, select, socket, threading, time
+import numpy as np
+
+from tcputil.waveform_block import WAVEFORM_MAGIC, FRAMES_PER_BLOCK, get_waveform_block_dtype
+from tcputil.spike_chunk import SPIKE_MAGIC, SPIKE_CHUNK_DTYPE
+
+# Bands in the order their streams are sent for each channel, and the
+# tcpdataoutputenabled... parameter suffix that enables each one.
+BANDS = ('wide', 'low', 'high', 'spike', 'stim')
+BAND_PARAMETERS = {'tcpdataoutputenabled': 'wide', 'tcpdataoutputenabledlow': 'low',
+                   'tcpdataoutputenabledhigh': 'high', 'tcpdataoutputenabledspike': 'spike',
+                   'tcpdataoutputenabledstim': 'stim'}
+
+GET_NAMES = {'type': 'Type', 'sampleratehertz': 'SampleRateHertz', 'runmode': 'RunMode',
+             'stimstepsizemicroamps': 'StimStepSizeMicroAmps', 'uploadinprogress': 'UploadInProgress'}
+
+SAMPLE_RATES = (1000, 1250, 1500, 2000, 2500, 3000, 3333, 4000, 5000, 6250, 8000, 10000, 12500, 15000, 20000,
+                25000, 30000)
+
+
+def channel_names(num_channels, channels_per_port=32):
+    """Native channel names, 'A-000', 'A-001', ..., filling ports A, B, ... channels_per_port at a time."""
+    return ['{}-{:03d}'.format(chr(ord('A') + channel // channels_per_port), channel % channels_per_port)
+            for channel in range(num_channels)]
+
+
+class RhxSimulator(object):
+    """Serves the RHX command, waveform and spike ports on the local machine.
+
+    Ports of 0 pick free ports (see the command_port, waveform_port and
+    spike_port attributes after start()), so tests can run side by side:
+
+        with RhxSimulator(command_port=0, waveform_port=0, spike_port=0, speed=None) as rhx:
+            client = connect_command_client('127.0.0.1', rhx.command_port)
+            ...
+
+    Each port serves one connection at a time.  While the run mode is 'run'
+    or 'record', the enabled streams (see BANDS) of every channel are sent
+    in blocks of 128 frames, at speed times real time, or as fast as the
+    client reads them with speed=None.  The synthetic signal is Gaussian
+    noise of noise_microvolts with spikes at spike_rate Hz on every channel;
+    each spike is also sent on the spike port for channels whose spike band
+    is enabled.  'execute manualstimtriggerpulse' adds a biphasic pulse,
+    shaped by the channel's phase amplitude and duration parameters, to the
+    stim band and an artifact to the other bands of stim-enabled channels.
+    'execute uploadstimparameters' leaves 'uploadinprogress' True for
+    upload_seconds.
+
+    Commands may arrive cut across reads: a ';'-terminated command is
+    carried out at once, and the last command of a write once no more
+    bytes have arrived for command_quiet_time.  With reply_split_bytes,
+    replies are sent in pieces of that many bytes, reply_split_delay apart,
+    as a slow link would deliver them.
+    """
+
+    def __init__(self, host='127.0.0.1', command_port=5000, waveform_port=5001, spike_port=5002, num_channels=32,
+                 channels_per_port=32, sample_rate=30000, speed=1.0, controller_type='ControllerStimRecordUSB2',
+                 stim_step_microamps=1.0, upload_seconds=0.05, noise_microvolts=10.0, spike_rate=5.0,
+                 blocks_per_write=8, seed=0, command_quiet_time=0.002, reply_split_bytes=None,
+                 reply_split_delay=0.02):
+        self.host = host
+        self.requested_ports = (command_port, waveform_port, spike_port)
+        self.channels = channel_names(num_channels, channels_per_port)
+        self.sample_rate = sample_rate
+        self.speed = speed
+        self.controller_type = controller_type
+        self.stim_step_microamps = stim_step_microamps
+        self.upload_seconds = upload_seconds
+        self.noise_microvolts = noise_microvolts
+        self.spike_rate = spike_rate
+        self.blocks_per_write = blocks_per_write
+        self.command_quiet_time = command_quiet_time
+        self.reply_split_bytes = reply_split_bytes
+        self.reply_split_delay = reply_split_delay
+        self.rng = np.random.default_rng(seed)
+
+        self.lock = threading.Lock()
+        self.run_mode = 'Stop'
+        self.upload_until = 0.0
+        self.enabled = set()                # (channel index, band)
+        self.parameters = {}                # lower-case parameter name -> value
+        self.pending_triggers = []
+        self.stopping = threading.Event()
+        self.threads = []
+        self.connections = {}
+
+        self.commands_received = 0
+        self.blocks_sent = 0
+        self.spikes_sent = 0
+
+    # Servers
+
+    def start(self):
+        self.listeners = []
+        for port in self.requested_ports:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((self.host, port))
+            listener.listen(1)
+            self.listeners.append(listener)
+        self.command_port, self.waveform_port, self.spike_port = [l.getsockname()[1] for l in self.listeners]
+
+        for name, listener, target in zip(('command', 'waveform', 'spike'), self.listeners,
+                                          (self.serve_commands, self.serve_data, None)):
+            if target is not None:
+                thread = threading.Thread(target=self.serve, args=(name, listener, target), daemon=True,
+                                          name='rhx-simulator-' + name)
+                thread.start()
+                self.threads.append(thread)
+        # The spike port is written by the waveform thread, so its samples line up.
+        thread = threading.Thread(target=self.accept_spike_connections, daemon=True, name='rhx-simulator-spike')
+        thread.start()
+        self.threads.append(thread)
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        # Shutting the connections down releases a thread blocked in sendall().
+        for sock in list(self.connections.values()):
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        for thread in self.threads:
+            thread.join()
+        for sock in list(self.connections.values()) + self.listeners:
+            if sock is not None:
+                sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def accept(self, listener):
+        """Waits for a connection on listener; returns None when stopping."""
+        while not self.stopping.is_set():
+            if select.select([listener], [], [], 0.1)[0]:
+                connection, _ = listener.accept()
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return connection
+        return None
+
+    def serve(self, name, listener, target):
+        while True:
+            connection = self.accept(listener)
+            if connection is None:
+                return
+            self.connections[name] = connection
+            try:
+                target(connection)
+            except OSError:
+                pass
+            finally:
+                self.connections[name] = None
+                connection.close()
+
+    def accept_spike_connections(self):
+        listener = self.listeners[2]
+        while True:
+            connection = self.accept(listener)
+            if connection is None:
+                return
+            old, self.connections['spike'] = self.connections.get('spike'), connection
+            if old is not None:
+                old.close()
+
+    # Command port
+
+    def serve_commands(self, connection):
+        unfinished = b''    # the part of a command after the last ';' received
+        while not self.stopping.is_set():
+            if select.select([connection], [], [], self.command_quiet_time if unfinished.strip() else 0.1)[0]:
+                data = connection.recv(1024)
+                if not data:
+                    return
+                commands = (unfinished + data).split(b';')
+                unfinished = commands.pop()
+            elif unfinished.strip():
+                # Nothing more arrived: the write ended without a ';'.
+                commands, unfinished = [unfinished], b''
+            else:
+                continue
+
+            replies = []
+            for command in commands:
+                if command.strip():
+                    reply = self.handle_command(str(command, 'utf-8').split())
+                    if reply:
+                        replies.append(reply)
+            if replies:
+                self.send_reply(connection, ''.join(replies).encode('utf-8'))
+
+    def send_reply(self, connection, data):
+        if self.reply_split_bytes is None:
+            connection.sendall(data)
+            return
+        for first in range(0, len(data), self.reply_split_bytes):
+            if first > 0:
+                time.sleep(self.reply_split_delay)
+            connection.sendall(data[first:first + self.reply_split_bytes])
+
+    def handle_command(self, words):
+        """Carries out one command; returns the reply text, or None."""
+        self.commands_received += 1
+        with self.lock:
+            if words[0].lower() == 'get' and len(words) == 2:
+                return self.get(words[1])
+            if words[0].lower() == 'set' and len(words) == 3:
+                return self.set(words[1], words[2])
+            if words[0].lower() == 'execute' and len(words) >= 2:
+                return self.execute(words[1].lower(), words[2:])
+        return 'Error - Unrecognized command: {}'.format(' '.join(words))
+
+    def get(self, parameter):
+        name = parameter.lower()
+        if name == 'type':
+            value = self.controller_type
+        elif name == 'sampleratehertz':
+            value = self.sample_rate
+        elif name == 'runmode':
+            value = self.run_mode
+        elif name == 'stimstepsizemicroamps':
+            value = self.stim_step_microamps
+        elif name == 'uploadinprogress':
+            value = 'True' if time.monotonic() < self.upload_until else 'False'
+        elif name in self.parameters:
+            value = self.parameters[name]
+        else:
+            return 'Error - Unrecognized parameter: {}'.format(parameter)
+        return 'Return: {} {}'.format(GET_NAMES.get(name, parameter), value)
+
+    def set(self, parameter, value):
+        name = parameter.lower()
+        if name == 'runmode':
+            if value.lower() not in ('run', 'record', 'stop'):
+                return 'Error - Invalid run mode: {}'.format(value)
+            self.run_mode = value.capitalize()
+            return None
+        if name == 'sampleratehertz':
+            if self.run_mode != 'Stop':
+                return 'Error - Sample rate cannot be changed while running'
+            if int(value) not in SAMPLE_RATES:
+                return 'Error - Invalid sample rate: {}'.format(value)
+            self.sample_rate = int(value)
+            return None
+
+        channel, _, channel_parameter = name.partition('.')
+        if channel_parameter:
+            if channel.upper() not in self.channels:
+                return 'Error - Unrecognized channel: {}'.format(channel)
+            if channel_parameter in BAND_PARAMETERS:
+                key = (self.channels.index(channel.upper()), BAND_PARAMETERS[channel_parameter])
+                if value.lower() == 'true':
+                    self.enabled.add(key)
+                else:
+                    self.enabled.discard(key)
+        self.parameters[name] = value
+        return None
+
+    def execute(self, action, arguments):
+        if action == 'clearalldataoutputs':
+            self.enabled.clear()
+        elif action == 'uploadstimparameters':
+            self.upload_until = time.monotonic() + self.upload_seconds
+        elif action == 'manualstimtriggerpulse':
+            source = 'keypress' + (arguments[0].lower() if arguments else '')
+            self.pending_triggers.extend(channel for channel, name in enumerate(self.channels)
+                                         if self.parameters.get(name.lower() + '.stimenabled', '').lower() == 'true'
+                                         and self.parameters.get(name.lower() + '.source', '').lower() == source)
+        else:
+            return 'Error - Unrecognized action: {}'.format(action)
+        return None
+
+    # Waveform and spike ports
+
+    def streams(self):
+        """The enabled (channel index, band) streams, in the order they are sent."""
+        return sorted(self.enabled, key=lambda stream: (stream[0], BANDS.index(stream[1])))
+
+    def make_period(self, streams, num_blocks):
+        """num_blocks blocks of synthetic raw samples for streams, and the spikes in them.
+
+        Returns (blocks, spike_samples, spike_channels): the samples are
+        written into a preallocated block array that is sent over and over
+        (with new timestamps), and the spikes are sorted by sample.
+        """
+        num_samples = FRAMES_PER_BLOCK * num_blocks
+        num_channels = len(self.channels)
+        noise = self.rng.normal(0, self.noise_microvolts / 0.195, (len(streams), num_samples))
+
+        # Poisson spike trains: a 1 ms negative-then-positive deflection per spike.
+        num_spikes = self.rng.poisson(self.spike_rate * num_samples / self.sample_rate, num_channels)
+        spike_channels = np.repeat(np.arange(num_channels), num_spikes)
+        spike_samples = self.rng.integers(0, num_samples, len(spike_channels))
+        order = np.argsort(spike_samples, kind='stable')
+        spike_samples, spike_channels = spike_samples[order], spike_channels[order]
+        spike_shape = -80 / 0.195 * np.sin(np.linspace(0, 2 * np.pi, max(int(self.sample_rate / 1000), 2)))
+
+        for i, (channel, band) in enumerate(streams):
+            if band in ('wide', 'high', 'spike'):
+                for start in spike_samples[spike_channels == channel]:
+                    stop = min(start + len(spike_shape), num_samples)
+                    noise[i, start:stop] += spike_shape[:stop - start]
+            if band == 'stim':
+                noise[i] = 0
+        offsets = np.array([0 if band == 'stim' else 32768 for _, band in streams])
+        samples = np.clip(np.rint(noise) + offsets[:, np.newaxis], 0, 65535).astype(np.uint16)
+
+        blocks = np.empty(num_blocks, dtype=get_waveform_block_dtype(len(streams)))
+        blocks['magic'] = WAVEFORM_MAGIC
+        blocks['frames']['samples'] = samples.reshape(len(streams), num_blocks, FRAMES_PER_BLOCK).transpose(1, 2, 0)
+        return blocks, spike_samples, spike_channels
+
+    def add_stim_pulses(self, blocks, streams, channels):
+        """Writes a biphasic pulse at the start of blocks for each triggered channel."""
+        samples = blocks['frames']['samples']
+        for channel in set(channels):
+            name = self.channels[channel].lower()
+            pulse = []
+            for phase, sign in (('first', 1), ('second', 0)):
+                steps = float(self.parameters.get('{}.{}phaseamplitudemicroamps'.format(name, phase), 0))
+                steps = min(int(round(steps / self.stim_step_microamps)), 255)
+                duration = float(self.parameters.get('{}.{}phasedurationmicroseconds'.format(name, phase), 100))
+                # Stim words: magnitude in the low 8 bits, bit 8 set for negative current.
+                pulse += [(sign << 8) | steps] * max(int(round(duration * 1e-6 * self.sample_rate)), 1)
+            index = np.arange(min(len(pulse), FRAMES_PER_BLOCK * len(blocks)))
+            for i, (stream_channel, band) in enumerate(streams):
+                if stream_channel == channel:
+                    samples[index // FRAMES_PER_BLOCK, index % FRAMES_PER_BLOCK, i] = \
+                        pulse[:len(index)] if band == 'stim' else 65535
+
+    def serve_data(self, connection):
+        streams = None
+        period = None
+        position = 0
+        timestamp = 0
+        running = False
+        tic = None
+
+        while not self.stopping.is_set():
+            with self.lock:
+                run_mode = self.run_mode
+                triggers, self.pending_triggers = self.pending_triggers, []
+            if run_mode == 'Stop':
+                running = False
+                time.sleep(0.001)
+                continue
+
+            if not running:
+                # A new run: timestamps restart at zero, with the streams enabled now.
+                with self.lock:
+                    streams = self.streams()
+                num_period_blocks = self.blocks_per_write * max(int(self.sample_rate / FRAMES_PER_BLOCK
+                                                                    / self.blocks_per_write), 1)
+                period, spike_samples, spike_channels = self.make_period(streams, num_period_blocks)
+                period_samples = FRAMES_PER_BLOCK * len(period)
+                spike_names = np.array(self.channels, dtype='S5')[spike_channels]
+                spike_enabled = np.array([(channel, 'spike') in streams for channel in range(len(self.channels))],
+                                         dtype=bool)[spike_channels]
+                position = 0
+                timestamp = 0
+                running = True
+                tic = time.perf_counter()
+
+            blocks = period[position:position + self.blocks_per_write].copy()
+            num_samples = FRAMES_PER_BLOCK * len(blocks)
+            blocks['frames']['timestamp'] = np.arange(timestamp, timestamp + num_samples,
+                                                      dtype=np.int32).reshape(len(blocks), FRAMES_PER_BLOCK)
+            if triggers and streams:
+                with self.lock:
+                    self.add_stim_pulses(blocks, streams, triggers)
+
+            # Spike chunks for the samples in this write, on spike-enabled channels.
+            start = FRAMES_PER_BLOCK * position
+            first, last = np.searchsorted(spike_samples, [start, start + num_samples])
+            selected = np.flatnonzero(spike_enabled[first:last]) + first
+            chunks = None
+            if len(selected) > 0:
+                chunks = np.empty(len(selected), dtype=SPIKE_CHUNK_DTYPE)
+                chunks['magic'] = SPIKE_MAGIC
+                chunks['name'] = spike_names[selected]
+                chunks['timestamp'] = timestamp + spike_samples[selected] - start
+                chunks['id'] = 1
+
+            if self.speed is not None:
+                # Hold back until this write is due at speed times real time.
+                due = tic + (timestamp + num_samples) / (self.sample_rate * self.speed)
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if streams:
+                connection.sendall(blocks)
+                self.blocks_sent += len(blocks)
+            spike_connection = self.connections.get('spike')
+            if chunks is not None and spike_connection is not None:
+                try:
+                    spike_connection.sendall(chunks)
+                    self.spikes_sent += len(chunks)
+                except OSError:
+                    pass
+
+            timestamp += num_samples
+            position = (position + self.blocks_per_write) % len(period)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve simulated RHX command, waveform and spike ports.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--ports', default='5000,5001,5002', help='command, waveform and spike ports (default: %(default)s)')
+    parser.add_argument('--channels', type=int, default=32)
+    parser.add_argument('--sample-rate', type=int, default=30000)
+    parser.add_argument('--speed', type=float, default=1.0, help='times real time; 0 for as fast as possible')
+    args = parser.parse_args()
+
+    command_port, waveform_port, spike_port = [int(port) for port in args.ports.split(',')]
+    simulator = RhxSimulator(args.host, command_port, waveform_port, spike_port, args.channels,
+                             sample_rate=args.sample_rate, speed=args.speed or None)
+    with simulator:
+        print('Simulating RHX on {} ports {}, {}, {} (Ctrl-C to stop)'.format(
+            args.host, simulator.command_port, simulator.waveform_port, simulator.spike_port))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,66 @@
+#! /bin/env python
+#
+# Extraction of spike-aligned waveform snippets from decoded waveform data.
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def spike_sample_indices(timestamps, spike_timestamps):
+    """Maps spike timestamps to sample indices in a sorted timestamps array with np.searchsorted().
+
+    Returns (indices, found): indices[i] is the position of the first sample
+    whose timestamp is >= spike_timestamps[i] (clipped to the last sample),
+    and found[i] says whether that sample's timestamp is exactly the spike's
+    (False for spikes in a gap of the waveform data or outside it).
+    """
+    timestamps = np.asarray(timestamps)
+    spike_timestamps = np.asarray(spike_timestamps)
+    if len(timestamps) == 0:
+        return np.zeros(len(spike_timestamps), dtype=np.intp), np.zeros(len(spike_timestamps), dtype=bool)
+    indices = np.searchsorted(timestamps, spike_timestamps)
+    np.minimum(indices, len(timestamps) - 1, out=indices)
+    return indices, timestamps[indices] == spike_timestamps
+
+
+def extract_snippets(amplifier_data, timestamps, spike_timestamps, before=50, after=50, fill=None):
+    """Cuts a window of samples around every spike out of decoded waveform data.
+
+    amplifier_data is a (streams x samples) array, or a single stream, as
+    returned by decode_waveform_blocks(), and timestamps its (sorted) sample
+    timestamps.  Each spike's window covers the before samples preceding it
+    and the after - 1 samples following it, i.e. samples
+    index - before ... index + after - 1.  All windows are gathered at once
+    from a strided view of amplifier_data; windows running off either end
+    of the data are padded with fill (NaN for floating-point data, 0
+    otherwise).
+
+    Returns a dictionary with 'snippets' (spikes x streams x (before + after)),
+    'indices' (the spikes' sample indices) and 'found' (see
+    spike_sample_indices()).
+    """
+    data = np.atleast_2d(amplifier_data)
+    num_streams, num_samples = data.shape
+    window = before + after
+    if fill is None:
+        fill = np.nan if np.issubdtype(data.dtype, np.floating) else 0
+
+    indices, found = spike_sample_indices(timestamps, spike_timestamps)
+    snippets = np.empty((len(indices), num_streams, window), dtype=data.dtype)
+    starts = indices - before
+    inside = (starts >= 0) & (starts + window <= num_samples)
+
+    # (samples - window + 1) x streams x window view; indexing it copies only the wanted windows.
+    if num_samples >= window and window > 0:
+        windows = sliding_window_view(data, window, axis=1).transpose(1, 0, 2)
+        snippets[inside] = windows[starts[inside]]
+
+    # Windows at the edges of the data, filled sample range by sample range.
+    for i in np.flatnonzero(~inside):
+        first = max(starts[i], 0)
+        last = min(starts[i] + window, num_samples)
+        snippets[i] = fill
+        if last > first:
+            snippets[i, :, first - starts[i]:last - starts[i]] = data[:, first:last]
+
+    return {'snippets': snippets, 'indices': indices, 'found': found}
@@ -0,0 +1,148 @@
+#! /bin/env python
+#
+# Parsing of the RHX TCP spike output port.
+#
+# Every spike event is a 14-byte chunk: uint32 magic number, 5 chars of
+# native channel name (e.g. 'A-010'), uint32 timestamp and uint8 id.
+
+import numpy as np
+
+SPIKE_MAGIC = 0x3ae2710f
+
+SPIKE_CHUNK_DTYPE = np.dtype([('magic', '<u4'), ('name', 'S5'), ('timestamp', '<u4'), ('id', 'u1')])
+
+
+def parse_spike_chunks(buffer, sample_rate=None):
+    """Decodes a buffer of whole 14-byte spike chunks in one pass; see decode_spike_chunks()."""
+    if len(memoryview(buffer).cast('B')) % SPIKE_CHUNK_DTYPE.itemsize != 0:
+        raise Exception('An unexpected amount of data arrived that is not an integer multiple of the spike chunk size')
+    return decode_spike_chunks(np.frombuffer(buffer, dtype=SPIKE_CHUNK_DTYPE), sample_rate)
+
+
+def decode_spike_chunks(chunks, sample_rate=None):
+    """Decodes an array of SPIKE_CHUNK_DTYPE chunks.
+
+    Returns a dictionary with 'name' (native channel names as str),
+    'timestamp' (uint32), 'id' (uint8) and 't' (seconds, if sample_rate is
+    given), one entry per spike event.
+    """
+    if np.any(chunks['magic'] != SPIKE_MAGIC):
+        raise Exception('Error... magic number incorrect')
+
+    result = {'name': chunks['name'].astype(str),
+              'timestamp': chunks['timestamp'].copy(),
+              'id': chunks['id'].copy()}
+    if sample_rate is not None:
+        result['t'] = result['timestamp'] / sample_rate
+    return result
+
+
+def find_spike_chunk_offsets(buffer):
+    """Byte offsets of the whole spike chunks in buffer, skipping anything that does not start with the magic number.
+
+    Chunks are taken greedily from the first magic number found: a chunk
+    starts wherever the magic number appears at least 14 bytes after the
+    previous chunk started, and must fit in the buffer.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    magic = np.frombuffer(np.uint32(SPIKE_MAGIC).astype('<u4').tobytes(), dtype=np.uint8)
+    num_candidates = len(data) - SPIKE_CHUNK_DTYPE.itemsize + 1
+    if num_candidates <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    candidates = np.ones(num_candidates, dtype=bool)
+    for i in range(len(magic)):
+        candidates &= data[i:i + num_candidates] == magic[i]
+    candidates = np.flatnonzero(candidates)
+
+    # A magic number can also turn up inside another chunk's payload; keep
+    # only candidates at least one chunk apart, scanning left to right.
+    offsets = []
+    next_offset = 0
+    for offset in candidates.tolist():
+        if offset >= next_offset:
+            offsets.append(offset)
+            next_offset = offset + SPIKE_CHUNK_DTYPE.itemsize
+    return np.array(offsets, dtype=np.intp)
+
+
+def parse_spike_events(buffer, sample_rate=None):
+    """Decodes every whole spike chunk in buffer into a columnar event table.
+
+    Unlike parse_spike_chunks(), buffer may end with a partial chunk, and
+    bytes that do not belong to a chunk (e.g. after joining a stream
+    mid-chunk) are skipped by searching for the next magic number.  Returns
+    (events, consumed), where consumed is the number of bytes used up; the
+    rest of buffer is the start of a chunk still arriving, to be prepended
+    to the next read.
+
+    events is a dictionary with 'channels' (the sorted native channel names
+    present, as str), 'channel' (int16 index into channels, per event),
+    'timestamp' (uint32), 'id' (uint8), 't' (seconds, if sample_rate is
+    given) and 'skipped_bytes'.  See index_spike_events() for per-channel
+    lookups.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    chunk_size = SPIKE_CHUNK_DTYPE.itemsize
+    num_chunks = len(data) // chunk_size
+
+    # Fast path: the buffer is aligned on chunks, as it is when reads are
+    # carried over with consumed.
+    chunks = data[:num_chunks * chunk_size].view(SPIKE_CHUNK_DTYPE)
+    if np.all(chunks['magic'] == SPIKE_MAGIC):
+        consumed = num_chunks * chunk_size
+        skipped_bytes = 0
+    else:
+        offsets = find_spike_chunk_offsets(data)
+        chunks = data[offsets[:, np.newaxis] + np.arange(chunk_size)].view(SPIKE_CHUNK_DTYPE)[:, 0]
+        if len(offsets) > 0:
+            consumed = int(offsets[-1]) + chunk_size
+        else:
+            # Keep the last few bytes, in case they start a magic number.
+            consumed = max(len(data) - (chunk_size - 1), 0)
+        skipped_bytes = consumed - len(offsets) * chunk_size
+
+    # Sort the 5-byte names as big-endian integers rather than as strings;
+    # the order is the same and np.unique is much faster on integers.
+    name_bytes = np.ascontiguousarray(chunks['name']).view(np.uint8).reshape(-1, 5).astype(np.int64)
+    codes, channel = np.unique(name_bytes @ (256 ** np.arange(4, -1, -1)), return_inverse=True)
+    channels = (codes[:, np.newaxis] >> (8 * np.arange(4, -1, -1)) & 0xff).astype(np.uint8).copy().view('S5')[:, 0]
+    events = {'channels': channels.astype(str),
+              'channel': channel.astype(np.int16),
+              'timestamp': chunks['timestamp'].copy(),
+              'id': chunks['id'].copy(),
+              'skipped_bytes': skipped_bytes}
+    if sample_rate is not None:
+        events['t'] = events['timestamp'] / sample_rate
+    return events, consumed
+
+
+def index_spike_events(events):
+    """Groups a parse_spike_events() table by channel.
+
+    Returns a dictionary mapping each native channel name to a dictionary
+    of that channel's 'timestamp', 'id' (and 't') arrays, sorted by
+    timestamp, so that spikes_between() can search them.
+    """
+    order = np.lexsort((events['timestamp'], events['channel']))
+    bounds = np.searchsorted(events['channel'][order], np.arange(len(events['channels']) + 1))
+    columns = [key for key in ('timestamp', 'id', 't') if key in events]
+    sorted_columns = {key: events[key][order] for key in columns}
+
+    index = {}
+    for i, name in enumerate(events['channels']):
+        index[str(name)] = {key: sorted_columns[key][bounds[i]:bounds[i + 1]] for key in columns}
+    return index
+
+
+def spikes_between(index, name, start, stop):
+    """Events of channel name with start <= timestamp < stop, from an index_spike_events() index.
+
+    Two binary searches, so the cost does not grow with the number of
+    events outside the window.  Returns views into the index.
+    """
+    channel = index.get(name)
+    if channel is None:
+        return {'timestamp': np.empty(0, dtype=np.uint32), 'id': np.empty(0, dtype=np.uint8)}
+    first, last = np.searchsorted(channel['timestamp'], [start, stop])
+    return {key: value[first:last] for key, value in channel.items()}
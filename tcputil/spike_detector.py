@@ -0,0 +1,159 @@
+#! /bin/env python
+#
+# Online threshold spike detection on decoded wideband data, as an
+# alternative to the detection RHX does for the spike port.
+
+import time
+import numpy as np
+
+# Median absolute deviation of Gaussian noise, in standard deviations.
+MAD_TO_SIGMA = 0.6745
+
+
+def median_and_noise(x):
+    """Per-row median and noise level (median absolute deviation, in standard deviations) of x."""
+    median = np.median(x, axis=1)
+    return median, np.median(np.abs(x - median[:, np.newaxis]), axis=1) / MAD_TO_SIGMA
+
+
+class SpikeDetector(object):
+    """Detects threshold crossings in consecutive (channels x samples) arrays, all channels at once.
+
+    Each channel's threshold is threshold times its noise level above (or,
+    for a negative threshold, below) its baseline.  Baseline and noise level
+    are running estimates, the median and the median absolute deviation of
+    every array passed to process(), averaged exponentially over about
+    time_constant seconds; each array is tested against the estimates from
+    before it, and the very first array sets them.  To keep the medians
+    cheap and unbiased, they are taken over every estimate_step-th sample,
+    estimate_samples of them at a time.  A spike is the first sample past
+    the threshold, so a crossing that started in the previous
+    array is not reported again, and crossings less than refractory seconds
+    after the channel's last spike are ignored.
+
+        detector = SpikeDetector(64, 30000)
+        for data in receiver.iter_decoded():
+            events = detector.process(data['amplifier_data'], data['timestamps'])
+        print(detector.latency())
+
+    process() returns an event table like parse_spike_events()'s, so that
+    index_spike_events() and spikes_between() work on it.  For iter_chunks()
+    data, whose 't' is in seconds, pass np.rint(chunk['t'] * sample_rate)
+    as the timestamps.
+    """
+
+    def __init__(self, num_channels, sample_rate, threshold=-4.5, refractory=0.001, time_constant=5.0,
+                 estimate_step=4, estimate_samples=512, channel_names=None):
+        self.num_channels = num_channels
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.refractory_samples = int(round(refractory * sample_rate))
+        self.time_constant = time_constant
+        self.estimate_step = estimate_step
+        self.estimate_samples = estimate_samples
+        if channel_names is None:
+            channel_names = [str(channel) for channel in range(num_channels)]
+        self.channel_names = np.array(channel_names, dtype=str)
+
+        self.baseline = None
+        self.noise = None
+        self.estimate_pending = []
+        self.estimate_pending_samples = 0
+        self.was_beyond = np.zeros(num_channels, dtype=bool)
+        self.last_spike = np.full(num_channels, -self.refractory_samples - 1, dtype=np.int64)
+        self.samples_processed = 0
+        self.spikes_detected = 0
+
+        self.calls = 0
+        self.seconds_processing = 0.0
+        self.max_call_seconds = 0.0
+
+    def process(self, data, timestamps=None):
+        """Detects the spikes in the next data (channels x samples, e.g. microvolts).
+
+        timestamps (one per sample) label the events; without them, samples
+        are counted from the first call.  Returns a dictionary with
+        'channels' (the channel names), 'channel' (int16 index into
+        channels), 'timestamp', 'id' (always 1), 'amplitude' (the crossing
+        sample relative to the baseline) and 't' (seconds), in time order.
+        """
+        tic = time.perf_counter()
+        x = np.atleast_2d(data)
+        num_samples = x.shape[1]
+        if self.baseline is None:
+            self.baseline, self.noise = median_and_noise(x)
+
+        level = self.baseline + self.threshold * self.noise
+        beyond = x < level[:, np.newaxis] if self.threshold < 0 else x > level[:, np.newaxis]
+        onset = beyond.copy()
+        if num_samples > 0:
+            onset[:, 0] &= ~self.was_beyond
+            onset[:, 1:] &= ~beyond[:, :-1]
+            self.was_beyond = beyond[:, -1].copy()
+        channel, sample = np.nonzero(onset)
+        position = self.samples_processed + sample
+
+        keep = self.refractory(channel, position)
+        channel, sample, position = channel[keep], sample[keep], position[keep]
+        self.last_spike[channel] = position       # in channel and time order, so the last spike wins
+
+        order = np.argsort(position, kind='stable')
+        channel, sample, position = channel[order], sample[order], position[order]
+        events = {'channels': self.channel_names,
+                  'channel': channel.astype(np.int16),
+                  'timestamp': np.asarray(timestamps)[sample] if timestamps is not None else position,
+                  'id': np.ones(len(channel), dtype=np.uint8),
+                  'amplitude': x[channel, sample] - self.baseline[channel]}
+        events['t'] = events['timestamp'] / self.sample_rate
+
+        self.update_estimates(x)
+        self.samples_processed += num_samples
+        self.spikes_detected += len(channel)
+
+        seconds = time.perf_counter() - tic
+        self.calls += 1
+        self.seconds_processing += seconds
+        self.max_call_seconds = max(self.max_call_seconds, seconds)
+        return events
+
+    def refractory(self, channel, position):
+        """Which crossings (sorted by channel, then position) are at least refractory_samples after the channel's last spike."""
+        first = np.ones(len(channel), dtype=bool)
+        first[1:] = channel[1:] != channel[:-1]
+        previous = np.empty_like(position)
+        previous[first] = self.last_spike[channel[first]]
+        previous[~first] = position[np.flatnonzero(~first) - 1]
+        keep = position - previous >= self.refractory_samples
+
+        # A crossing far enough from the previous crossing is also far enough
+        # from the last spike; the rest depend on which earlier crossings
+        # were kept, so settle them in order.
+        for i in np.flatnonzero(~keep):
+            j = i - 1
+            while j >= 0 and channel[j] == channel[i] and not keep[j]:
+                j -= 1
+            last = position[j] if j >= 0 and channel[j] == channel[i] else self.last_spike[channel[i]]
+            keep[i] = position[i] - last >= self.refractory_samples
+        return keep
+
+    def update_estimates(self, x):
+        # Copied, since callers usually reuse their output arrays.
+        sample = x[:, (-self.samples_processed) % self.estimate_step::self.estimate_step].copy()
+        self.estimate_pending.append(sample)
+        self.estimate_pending_samples += sample.shape[1]
+        if self.estimate_pending_samples < self.estimate_samples:
+            return
+        median, noise = median_and_noise(np.concatenate(self.estimate_pending, axis=1))
+        weight = min(1.0, self.estimate_pending_samples * self.estimate_step / (self.time_constant * self.sample_rate))
+        self.baseline += weight * (median - self.baseline)
+        self.noise += weight * (noise - self.noise)
+        self.estimate_pending = []
+        self.estimate_pending_samples = 0
+
+    def latency(self):
+        """Processing time so far: calls, seconds, worst call, mean seconds per 128-sample block, and x real time."""
+        blocks = self.samples_processed / 128
+        return {'calls': self.calls, 'seconds': self.seconds_processing, 'max_call_seconds': self.max_call_seconds,
+                'seconds_per_block': self.seconds_processing / blocks if blocks else 0.0,
+                'realtime_factor': (self.samples_processed / self.sample_rate / self.seconds_processing
+                                    if self.seconds_processing > 0 else float('inf'))}
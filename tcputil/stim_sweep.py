@@ -0,0 +1,189 @@
+#! /bin/env python
+#
+# Stimulation parameter sweeps over the RHX command and waveform ports.
+#
+# Each trial uploads one set of stimulation parameters, waits for the
+# upload to finish, runs the controller, triggers stimulation and keeps a
+# fixed number of waveform blocks, as the 3-cycle loop in ex.m does.
+
+import select, time
+import numpy as np
+
+from tcputil.waveform_block import FRAMES_PER_BLOCK, get_waveform_block_dtype, decode_waveform_blocks
+
+
+def poll_until(client, parameter, value, timeout=10.0, first_delay=0.002, max_delay=0.05):
+    """Polls 'get parameter' until RHX reports value (compared case-insensitively).
+
+    The delay between polls starts at first_delay and doubles up to
+    max_delay, so a quick change is noticed within a few milliseconds and a
+    slow one costs few round trips.  Returns (seconds waited, number of
+    polls), or raises an exception after timeout seconds.
+    """
+    tic = time.perf_counter()
+    delay = first_delay
+    polls = 0
+    while True:
+        polls += 1
+        if client.get(parameter).lower() == value.lower():
+            return time.perf_counter() - tic, polls
+        if time.perf_counter() - tic > timeout:
+            raise Exception('RHX did not report {} {} within {} s'.format(parameter, value, timeout))
+        time.sleep(delay)
+        delay = min(2 * delay, max_delay)
+
+
+def wait_for_upload(client, timeout=10.0, first_delay=0.002, max_delay=0.05):
+    """Polls 'get uploadinprogress' until RHX reports False; see poll_until()."""
+    return poll_until(client, 'uploadinprogress', 'false', timeout, first_delay, max_delay)
+
+
+def wait_for_stop(client, timeout=10.0, first_delay=0.002, max_delay=0.05):
+    """Polls 'get runmode' until RHX reports Stop, i.e. it has sent its last waveform block; see poll_until()."""
+    return poll_until(client, 'runmode', 'stop', timeout, first_delay, max_delay)
+
+
+def drain_socket(sock, quiet_time=0.0):
+    """Discards whatever is waiting on sock (e.g. blocks sent after the last 'set runmode stop').
+
+    Returns once nothing has arrived for quiet_time seconds, so bytes still
+    in flight when the call starts are discarded too.
+    """
+    discarded = 0
+    while select.select([sock], [], [], quiet_time)[0]:
+        data = sock.recv(1 << 16)
+        if not data:
+            break
+        discarded += len(data)
+    return discarded
+
+
+def receive_exactly(sock, view, timeout):
+    """Fills the writable buffer view from sock, or raises an exception after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    received = 0
+    while received < len(view):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+            raise Exception('Timed out after {} of {} waveform bytes'.format(received, len(view)))
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise Exception('RHX closed the waveform connection')
+        received += n
+
+
+def amplitude_sweep(step_microamps, num_steps, duration_microseconds=5000):
+    """Trial parameters for a biphasic amplitude sweep in steps of step_microamps, as in ex.m.
+
+    Returns a list of num_steps dictionaries of channel parameters, with
+    amplitudes step_microamps, 2 * step_microamps, ...
+    """
+    return [{'firstphaseamplitudemicroamps': step_microamps * step,
+             'secondphaseamplitudemicroamps': step_microamps * step,
+             'firstphasedurationmicroseconds': duration_microseconds,
+             'secondphasedurationmicroseconds': duration_microseconds} for step in range(1, num_steps + 1)]
+
+
+def run_sweep(client, waveform_socket, channel, trials, num_streams, blocks_per_trial=100, sample_rate=None,
+              trigger='f1', trigger_delay=0.05, scale=True, timeout=10.0, drain_quiet_time=0.02):
+    """Runs one stimulation trial per dictionary of channel parameters in trials.
+
+    client is a CommandClient and waveform_socket the connected waveform
+    port, with num_streams streams enabled and the channel's stimulation
+    source already set to trigger's key (e.g. 'keypressf1' for 'f1').  For
+    each trial the parameters are set and uploaded in one batch, and the
+    run starts as soon as 'uploadinprogress' goes False (see
+    wait_for_upload()).  Before the run starts, run_sweep() waits for
+    'get runmode' to report Stop (see wait_for_stop()) and discards the
+    waveform data left over from the previous trial until none has arrived
+    for drain_quiet_time seconds; otherwise blocks sent after the previous
+    'set runmode stop' could be taken as this trial's first.  The first
+    blocks_per_trial blocks after 'set runmode run' are kept, and the
+    controller is stopped.  The same wait and drain follow the last trial,
+    so the waveform socket is left empty.
+
+    Returns a dictionary with 'timestamps' (trials x samples), 't' (if
+    sample_rate is given) and 'amplifier_data' (trials x streams x samples,
+    see decode_waveform_blocks()), all allocated before the first trial,
+    together with per-trial 'upload_seconds', 'upload_polls' and
+    'trial_seconds', and 'trials_per_minute'.
+    """
+    num_trials = len(trials)
+    num_samples = FRAMES_PER_BLOCK * blocks_per_trial
+    block_dtype = get_waveform_block_dtype(num_streams)
+
+    result = {'timestamps': np.empty((num_trials, num_samples), dtype=np.int32),
+              'amplifier_data': np.empty((num_trials, num_streams, num_samples),
+                                         dtype=np.float64 if scale else np.uint16),
+              'upload_seconds': np.empty(num_trials),
+              'upload_polls': np.empty(num_trials, dtype=np.int64),
+              'trial_seconds': np.empty(num_trials)}
+    if sample_rate is not None:
+        result['t'] = np.empty((num_trials, num_samples))
+    raw = bytearray(block_dtype.itemsize * blocks_per_trial)
+
+    tic = time.perf_counter()
+    for trial, parameters in enumerate(trials):
+        trial_tic = time.perf_counter()
+        with client.batch():
+            for parameter, value in parameters.items():
+                client.set('{}.{}'.format(channel, parameter), value)
+            client.execute('uploadstimparameters', channel)
+        result['upload_seconds'][trial], result['upload_polls'][trial] = wait_for_upload(client, timeout)
+
+        wait_for_stop(client, timeout)
+        drain_socket(waveform_socket, drain_quiet_time)
+        client.set('runmode', 'run')
+        client.flush()
+        if trigger is not None:
+            time.sleep(trigger_delay)
+            client.execute('manualstimtriggerpulse', trigger)
+            client.flush()
+        receive_exactly(waveform_socket, memoryview(raw), timeout)
+        client.set('runmode', 'stop')
+        client.flush()
+
+        out = {key: result[key][trial] for key in ('timestamps', 'amplifier_data', 't') if key in result}
+        decode_waveform_blocks(np.frombuffer(raw, dtype=block_dtype), sample_rate, scale, out)
+        result['trial_seconds'][trial] = time.perf_counter() - trial_tic
+
+    # Leave nothing from the last trial on the socket for the next reader.
+    wait_for_stop(client, timeout)
+    drain_socket(waveform_socket, drain_quiet_time)
+
+    seconds = time.perf_counter() - tic
+    result['trials_per_minute'] = 60 * num_trials / seconds if seconds > 0 else float('inf')
+    return result
+
+
+if __name__ == '__main__':
+    # Amplitude sweep on A-000 like ex.m: wide band of a-000 on the waveform
+    # port, 100 blocks per trial, one trial per stim step size multiple.
+    import argparse, socket
+    from tcputil.command_client import connect_command_client
+
+    parser = argparse.ArgumentParser(description='Run a stimulation amplitude sweep through RHX Remote TCP Control.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--channel', default='a-000')
+    parser.add_argument('--steps', type=int, default=3, help='number of amplitude steps (default: %(default)s)')
+    parser.add_argument('--blocks', type=int, default=100, help='waveform blocks per trial (default: %(default)s)')
+    args = parser.parse_args()
+
+    client = connect_command_client(args.host, 5000)
+    swaveform = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    swaveform.connect((args.host, 5001))
+
+    client.set('runmode', 'stop')
+    client.configure(['execute clearalldataoutputs',
+                      'set {}.tcpdataoutputenabled true'.format(args.channel),
+                      'set {}.stimenabled true'.format(args.channel),
+                      'set {}.source keypressf1'.format(args.channel)])
+    sample_rate = float(client.get('sampleratehertz'))
+    step = float(client.get('stimstepsizemicroamps'))
+
+    sweep = run_sweep(client, swaveform, args.channel, amplitude_sweep(step, args.steps), 1, args.blocks, sample_rate)
+    for trial in range(args.steps):
+        print('trial {}: {:.1f} uA, upload {:.3f} s ({} polls), trial {:.3f} s'.format(
+            trial + 1, step * (trial + 1), sweep['upload_seconds'][trial], sweep['upload_polls'][trial],
+            sweep['trial_seconds'][trial]))
+    print('{:.1f} trials per minute'.format(sweep['trials_per_minute']))
@@ -0,0 +1,215 @@
+#! /bin/env python
+#
+# Recording of the raw waveform and spike port bytes to disk while they are
+# decoded, and reading the recordings back.
+#
+# A recording named NAME in a directory is made of
+#
+#   NAME.json           record dtype and stream description
+#   NAME-000000.raw     the records, byte for byte as received, in segments
+#   NAME-000001.raw     of at most segment_bytes each
+#   ...
+#   NAME.index          one TEE_INDEX_DTYPE entry per batch of records
+
+import json, os, queue, threading
+import numpy as np
+
+TEE_INDEX_DTYPE = np.dtype([('segment', '<u4'), ('offset', '<u8'), ('num_records', '<u4'), ('timestamp', '<i8')])
+
+# os.writev() takes at most IOV_MAX (1024 on Linux) buffers.
+MAX_WRITE_BUFFERS = 1024
+
+
+def segment_filename(directory, name, segment):
+    return os.path.join(directory, '{}-{:06d}.raw'.format(name, segment))
+
+
+class TeeWriter(object):
+    """Appends batches of fixed-size records to rolling segment files on a background thread.
+
+    write() only copies the records and queues them, so the receiving and
+    decoding thread never waits for the disk.  The writer thread takes
+    everything queued at once and writes it with one os.writev() call,
+    starting a new segment whenever the next batch would take the current
+    one past segment_bytes.  If the disk falls more than max_pending_bytes
+    behind, new batches are dropped (and counted in bytes_dropped) rather
+    than blocking; the index only lists batches that were written.
+
+        tee = TeeWriter('session', 'waveform', receiver.record_dtype, {'num_streams': 64})
+        receiver.tee = tee
+        ...
+        tee.close()
+    """
+
+    def __init__(self, directory, name, record_dtype, metadata=None, segment_bytes=256 << 20,
+                 max_pending_bytes=256 << 20):
+        self.directory = directory
+        self.name = name
+        self.record_dtype = np.dtype(record_dtype)
+        self.segment_bytes = max(segment_bytes, self.record_dtype.itemsize)
+        self.max_pending_bytes = max_pending_bytes
+
+        os.makedirs(directory, exist_ok=True)
+        meta = {'name': name, 'record_dtype': np.lib.format.dtype_to_descr(self.record_dtype),
+                'segment_bytes': self.segment_bytes}
+        meta.update(metadata or {})
+        with open(os.path.join(directory, name + '.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+        self.index_file = open(os.path.join(directory, name + '.index'), 'wb')
+        self.segment = 0
+        self.segment_fd = os.open(segment_filename(directory, name, 0), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.segment_size = 0
+
+        self.pending = queue.Queue()
+        self.pending_lock = threading.Lock()
+        self.pending_bytes = 0
+        self.bytes_written = 0
+        self.bytes_dropped = 0
+        self.error = None
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, name='tee-' + name, daemon=True)
+        self.thread.start()
+
+    def write(self, records, timestamp=-1):
+        """Queues a copy of records (an array of record_dtype) with the timestamp of its first record."""
+        if self.error is not None:
+            raise self.error
+        data = records.tobytes()
+        with self.pending_lock:
+            if self.pending_bytes + len(data) > self.max_pending_bytes:
+                self.bytes_dropped += len(data)
+                return
+            self.pending_bytes += len(data)
+        self.pending.put((data, len(records), timestamp))
+
+    def run(self):
+        try:
+            while True:
+                batches = [self.pending.get()]
+                while len(batches) < MAX_WRITE_BUFFERS:
+                    try:
+                        batches.append(self.pending.get_nowait())
+                    except queue.Empty:
+                        break
+                closing = batches[-1] is None
+                if closing:
+                    batches.pop()
+                if batches:
+                    self.write_batches(batches)
+                if closing:
+                    return
+        except Exception as e:
+            self.error = e
+
+    def write_batches(self, batches):
+        """Writes queued batches with one os.writev() per segment, then their index entries."""
+        index = np.empty(len(batches), dtype=TEE_INDEX_DTYPE)
+        buffers = []
+        for i, (data, num_records, timestamp) in enumerate(batches):
+            if self.segment_size > 0 and self.segment_size + len(data) > self.segment_bytes:
+                self.flush(buffers)
+                buffers = []
+                os.close(self.segment_fd)
+                self.segment += 1
+                self.segment_fd = os.open(segment_filename(self.directory, self.name, self.segment),
+                                          os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                self.segment_size = 0
+            index[i] = (self.segment, self.segment_size, num_records, timestamp)
+            buffers.append(data)
+            self.segment_size += len(data)
+        self.flush(buffers)
+        index.tofile(self.index_file)
+        self.index_file.flush()
+
+        size = sum(len(data) for data, _, _ in batches)
+        with self.pending_lock:
+            self.pending_bytes -= size
+        self.bytes_written += size
+
+    def flush(self, buffers):
+        # writev() may write less than asked for; finish the rest.
+        while buffers:
+            n = os.writev(self.segment_fd, buffers)
+            while buffers and n >= len(buffers[0]):
+                n -= len(buffers[0])
+                buffers = buffers[1:]
+            if buffers and n > 0:
+                buffers[0] = buffers[0][n:]
+
+    def close(self):
+        """Writes everything still queued and closes the files."""
+        if self.closed:
+            return
+        self.closed = True
+        self.pending.put(None)
+        self.thread.join()
+        os.close(self.segment_fd)
+        self.index_file.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_tee(directory, name):
+    """Opens a TeeWriter recording for reading.
+
+    Returns a dictionary with 'meta' (the JSON description), 'record_dtype',
+    'index' (a TEE_INDEX_DTYPE array) and 'segments', one read-only memory
+    map of records per segment file, so that recordings can be re-decoded
+    at disk speed, e.g. with decode_waveform_blocks().
+    """
+    with open(os.path.join(directory, name + '.json')) as f:
+        meta = json.load(f)
+    record_dtype = np.lib.format.descr_to_dtype(meta['record_dtype'])
+    index = np.fromfile(os.path.join(directory, name + '.index'), dtype=TEE_INDEX_DTYPE)
+
+    segments = []
+    segment = 0
+    while os.path.exists(segment_filename(directory, name, segment)):
+        filename = segment_filename(directory, name, segment)
+        num_records = os.path.getsize(filename) // record_dtype.itemsize
+        segments.append(np.memmap(filename, dtype=record_dtype, mode='r', shape=(num_records,))
+                        if num_records > 0 else np.empty(0, dtype=record_dtype))
+        segment += 1
+    return {'meta': meta, 'record_dtype': record_dtype, 'index': index, 'segments': segments}
+
+
+def iter_tee_records(directory, name, records_per_batch=None):
+    """Yields the records of a recording segment by segment, or in batches of records_per_batch."""
+    for segment in open_tee(directory, name)['segments']:
+        step = records_per_batch or max(len(segment), 1)
+        for start in range(0, len(segment), step):
+            yield segment[start:start + step]
+
+
+if __name__ == '__main__':
+    # Re-decodes a recorded waveform stream and reports how fast that went.
+    import argparse, time
+    from tcputil.waveform_block import decode_waveform_blocks
+
+    parser = argparse.ArgumentParser(description='Replay a waveform recording made with TeeWriter.')
+    parser.add_argument('directory')
+    parser.add_argument('--name', default='waveform')
+    parser.add_argument('--blocks', type=int, default=1024, help='blocks decoded per batch (default: %(default)s)')
+    args = parser.parse_args()
+
+    tee = open_tee(args.directory, args.name)
+    sample_rate = tee['meta'].get('sample_rate')
+    num_blocks = 0
+    num_bytes = 0
+    tic = time.perf_counter()
+    for blocks in iter_tee_records(args.directory, args.name, args.blocks):
+        decode_waveform_blocks(blocks, sample_rate)
+        num_blocks += len(blocks)
+        num_bytes += blocks.nbytes
+    seconds = time.perf_counter() - tic
+    print('{} blocks in {} segments ({} index entries), {:.1f} MB in {:.2f} s ({:.0f} MB/s)'.format(
+        num_blocks, len(tee['segments']), len(tee['index']), num_bytes / 1e6, seconds,
+        num_bytes / 1e6 / seconds if seconds > 0 else float('inf')))
@@ -0,0 +1,96 @@
+#! /bin/env python
+#
+# Vectorized parsing of the RHX TCP waveform output port.
+#
+# Every block on the waveform port is a uint32 magic number followed by 128
+# frames; each frame is an int32 timestamp and one uint16 word per enabled
+# stream (channel / band pair, in the order RHX sends them).
+
+import numpy as np
+
+WAVEFORM_MAGIC = 0x2ef07a08
+FRAMES_PER_BLOCK = 128
+
+
+def get_waveform_block_dtype(num_streams):
+    """Builds a NumPy structured dtype for one waveform block with num_streams uint16 words per frame."""
+    frame = np.dtype([('timestamp', '<i4'), ('samples', '<u2', (num_streams,))])
+    return np.dtype([('magic', '<u4'), ('frames', frame, (FRAMES_PER_BLOCK,))])
+
+
+def waveform_bytes_per_block(num_streams):
+    """Number of bytes in one waveform block: 4 + 128 * (4 + 2 * num_streams)."""
+    return 4 + FRAMES_PER_BLOCK * (4 + 2 * num_streams)
+
+
+def parse_waveform_blocks(buffer, num_streams, sample_rate=None, scale=True):
+    """Decodes a buffer of whole waveform blocks in one pass.
+
+    buffer is anything supporting the buffer protocol (bytes, bytearray,
+    memoryview, ...) holding a whole number of blocks.  Returns a dictionary
+    with 'timestamps' (int32), 't' (seconds, if sample_rate is given) and
+    'amplifier_data', a (streams x samples) array in microvolts, or the raw
+    uint16 words with scale=False (e.g. for stim band streams, which are not
+    voltages).
+    """
+    block_dtype = get_waveform_block_dtype(num_streams)
+    if len(memoryview(buffer).cast('B')) % block_dtype.itemsize != 0:
+        raise Exception('An unexpected amount of data arrived that is not an integer multiple of the expected data size per block')
+
+    return decode_waveform_blocks(np.frombuffer(buffer, dtype=block_dtype), sample_rate, scale)
+
+
+def decode_waveform_blocks(blocks, sample_rate=None, scale=True, out=None):
+    """Decodes an array of get_waveform_block_dtype() blocks; see parse_waveform_blocks().
+
+    If out is given (a dictionary of arrays with at least as many samples as
+    blocks holds, e.g. from a previous call), results are written into the
+    leading samples of its arrays and views of them are returned, so that a
+    streaming consumer does not allocate per read.
+    """
+    if np.any(blocks['magic'] != WAVEFORM_MAGIC):
+        raise Exception('Error... magic number incorrect')
+
+    num_streams = blocks.dtype['frames'].base['samples'].shape[0]
+    num_samples = FRAMES_PER_BLOCK * len(blocks)
+    if out is None:
+        out = {'timestamps': np.empty(num_samples, dtype=np.int32),
+               'amplifier_data': np.empty((num_streams, num_samples), dtype=np.float64 if scale else np.uint16)}
+        if sample_rate is not None:
+            out['t'] = np.empty(num_samples)
+    result = {key: value[..., :num_samples] for key, value in out.items()}
+
+    result['timestamps'].reshape(len(blocks), FRAMES_PER_BLOCK)[...] = blocks['frames']['timestamp']
+    if sample_rate is not None:
+        np.divide(result['timestamps'], sample_rate, out=result['t'])
+
+    # (streams x blocks x 128) strided view of the samples, written straight
+    # into the channel-major output.
+    samples = blocks['frames']['samples'].transpose(2, 0, 1)
+    view = result['amplifier_data'].reshape(samples.shape)
+    if view.size > 0 and not np.may_share_memory(view, result['amplifier_data']):
+        raise Exception('Output array must be reshapeable to (streams, blocks, 128) without copying.')
+    if scale:
+        np.subtract(samples, 32768, out=view, dtype=view.dtype)
+        np.multiply(0.195, view, out=view) # units = microvolts
+    else:
+        view[...] = samples
+    return result
+
+
+def pack_waveform_blocks(timestamps, samples):
+    """Encodes timestamps (samples,) and raw uint16 samples (streams x samples) as waveform blocks.
+
+    The inverse of parse_waveform_blocks(..., scale=False); the number of
+    samples must be a multiple of 128.
+    """
+    samples = np.atleast_2d(samples)
+    num_samples = samples.shape[1]
+    if num_samples % FRAMES_PER_BLOCK != 0:
+        raise Exception('Waveform blocks hold a multiple of {} samples.'.format(FRAMES_PER_BLOCK))
+
+    blocks = np.empty(num_samples // FRAMES_PER_BLOCK, dtype=get_waveform_block_dtype(samples.shape[0]))
+    blocks['magic'] = WAVEFORM_MAGIC
+    blocks['frames']['timestamp'] = np.reshape(timestamps, (len(blocks), FRAMES_PER_BLOCK))
+    blocks['frames']['samples'] = samples.reshape(samples.shape[0], len(blocks), FRAMES_PER_BLOCK).transpose(1, 2, 0)
+    return blocks.tobytes()
@@ -0,0 +1,80 @@
+#! /bin/env python
+#
+# Continuous reception of the RHX TCP waveform output port.
+
+import numpy as np
+
+from tcputil.block_receiver import BlockReceiver
+from tcputil.waveform_block import WAVEFORM_MAGIC, FRAMES_PER_BLOCK, get_waveform_block_dtype, decode_waveform_blocks
+
+
+class WaveformReceiver(BlockReceiver):
+    """Streams whole waveform blocks from a connected waveform-port socket.
+
+    Bytes are received with socket.recv_into() into one preallocated buffer
+    of buffer_blocks blocks (see BlockReceiver); a block split across reads
+    is completed by the next read.  Nothing is allocated per read apart from
+    small array headers, so the receiver can run for as long as the
+    connection stays open:
+
+        receiver = WaveformReceiver(swaveform, num_streams=64, sample_rate=30000)
+        for data in receiver.iter_decoded():
+            process(data['t'], data['amplifier_data'])
+
+    Arrays handed out by receive() and iter_decoded() are only valid until
+    the next call; copy anything that must be kept.
+    """
+
+    def __init__(self, sock, num_streams, sample_rate=None, buffer_blocks=256, tee=None):
+        BlockReceiver.__init__(self, sock, get_waveform_block_dtype(num_streams), buffer_blocks, tee)
+        self.num_streams = num_streams
+        self.sample_rate = sample_rate
+        self.num_gaps = 0
+        self.last_timestamp = None
+
+    def check(self, blocks):
+        """Checks the magic numbers and counts breaks in the timestamp sequence."""
+        if np.any(blocks['magic'] != WAVEFORM_MAGIC):
+            raise Exception('Error... magic number incorrect')
+        first = blocks['frames']['timestamp'][:, 0]
+        last = blocks['frames']['timestamp'][:, -1]
+        if self.last_timestamp is not None and first[0] != self.last_timestamp + 1:
+            self.num_gaps += 1
+        self.num_gaps += int(np.count_nonzero(first[1:] != last[:-1] + 1))
+        self.last_timestamp = int(last[-1])
+
+    def first_timestamp(self, blocks):
+        return int(blocks['frames']['timestamp'][0, 0])
+
+    def decoded_buffers(self, scale=True, num_blocks=None):
+        """Output arrays for decode_waveform_blocks(), for num_blocks blocks (default: a full buffer)."""
+        if num_blocks is None:
+            num_blocks = len(self.buffer) // self.bytes_per_record
+        capacity = FRAMES_PER_BLOCK * num_blocks
+        out = {'timestamps': np.empty(capacity, dtype=np.int32),
+               'amplifier_data': np.empty((self.num_streams, capacity), dtype=np.float64 if scale else np.uint16)}
+        if self.sample_rate is not None:
+            out['t'] = np.empty(capacity)
+        return out
+
+    def iter_blocks(self):
+        """Yields the blocks from each non-empty receive() until the connection closes."""
+        return iter(self)
+
+    def iter_decoded(self, scale=True):
+        """Like iter_blocks(), but yields decode_waveform_blocks() results.
+
+        The output arrays are allocated once, sized for a full buffer, and
+        reused for every read.
+        """
+        out = self.decoded_buffers(scale)
+        for blocks in self:
+            yield decode_waveform_blocks(blocks, self.sample_rate, scale, out)
+
+    @property
+    def blocks_received(self):
+        return self.records_received
+
+    @property
+    def samples_received(self):
+        return FRAMES_PER_BLOCK * self.records_received
@@ -0,0 +1,10 @@
+# The loader is run from inside load_intan_rhs_format/ (it imports intanutil
+# as a top-level package) and tcputil from the repository root.
+
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOADER = os.path.join(ROOT, 'load_intan_rhs_format')
+for path in (ROOT, LOADER):
+    if path not in sys.path:
+        sys.path.insert(0, path)
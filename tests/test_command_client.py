@@ -0,0 +1,53 @@
+import select, socket, time
+
+from tcputil.simulator import RhxSimulator
+from tcputil.command_client import CommandReplyFramer, connect_command_client
+
+
+def test_simulator_joins_a_batch_split_at_any_byte():
+    # The batch ends with the acknowledging get, as CommandClient sends it.
+    batch = b'set a-000.tcpdataoutputenabled true;get sampleratehertz;get type;get runmode'
+    with RhxSimulator(command_port=0, waveform_port=0, spike_port=0, num_channels=4,
+                      command_quiet_time=0.05) as rhx:
+        sock = socket.create_connection(('127.0.0.1', rhx.command_port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(2.0)
+        framer = CommandReplyFramer()
+        for split in range(1, len(batch)):
+            sock.sendall(batch[:split])
+            time.sleep(0.005)
+            sock.sendall(batch[split:])
+            replies = []
+            while len(replies) < 3:
+                replies += framer.feed(sock.recv(1024))
+            assert replies == ['Return: SampleRateHertz 30000', 'Return: Type ControllerStimRecordUSB2',
+                               'Return: RunMode Stop'], split
+        sock.close()
+
+
+def test_client_frames_replies_split_across_slow_reads():
+    # Three-byte pieces 20 ms apart: no reply may be cut short by a quiet period.
+    with RhxSimulator(command_port=0, waveform_port=0, spike_port=0, num_channels=4, reply_split_bytes=3,
+                      reply_split_delay=0.02) as rhx:
+        client = connect_command_client('127.0.0.1', rhx.command_port)
+        assert client.get('runmode') == 'Stop'
+        client.set('runmode', 'run')
+        assert client.get('runmode') == 'Run'
+        client.set('runmode', 'stop')
+        client.flush()
+        assert client.get('sampleratehertz') == '30000'
+        assert client.errors == []
+        # Nothing is left on the socket for the next reader.
+        assert client.framer.pending == ''
+        assert not select.select([client.sock], [], [], 0.1)[0]
+
+
+def test_framer_splits_at_every_byte():
+    text = (b'Return: SampleRateHertz 30000Error - Unrecognized parameter: fooReturn: Type ControllerStimRecordUSB2'
+            b'Return: RunMode Stop')
+    for split in range(1, len(text)):
+        framer = CommandReplyFramer()
+        replies = framer.feed(text[:split]) + framer.feed(text[split:])
+        assert replies == ['Return: SampleRateHertz 30000', 'Error - Unrecognized parameter: foo',
+                           'Return: Type ControllerStimRecordUSB2', 'Return: RunMode Stop'], split
+        assert framer.pending == ''
@@ -0,0 +1,30 @@
+import asyncio, time
+
+import pytest
+
+from tcputil.simulator import RhxSimulator
+from tcputil.rhx_client import RhxClient
+
+
+def test_commands_are_acknowledged_without_fixed_delays():
+    async def run(rhx):
+        async with RhxClient('127.0.0.1', rhx.command_port, rhx.waveform_port, rhx.spike_port) as client:
+            tic = time.perf_counter()
+            await client.execute('clearalldataoutputs')
+            for channel in range(4):
+                await client.set('a-{:03d}.tcpdataoutputenabled'.format(channel), 'true')
+            await client.set('runmode', 'run')
+            assert await client.get('runmode') == 'Run'
+            await client.set('runmode', 'stop')
+            seconds = time.perf_counter() - tic
+            with pytest.raises(Exception, match='rejected'):
+                await client.get('nosuchparameter')
+            assert await client.get('sampleratehertz') == '30000'
+            return seconds, client.errors
+
+    with RhxSimulator(command_port=0, waveform_port=0, spike_port=0, num_channels=4, reply_split_bytes=5,
+                      reply_split_delay=0.01) as rhx:
+        seconds, errors = asyncio.run(run(rhx))
+    # Eight commands at the old 0.1 s each would take 0.7 s or more.
+    assert seconds < 0.5
+    assert len(errors) == 1
@@ -0,0 +1,18 @@
+import os, shutil
+
+from conftest import LOADER
+from load_intan_rhs_format import read_data
+from intanutil.session import Session
+
+FILENAME = os.path.join(LOADER, 'qwerty_210205_153318.rhs')
+
+
+def test_read_keys_match_read_data(tmp_path):
+    # The example file has amplifier and stimulation channels only, no ADC, DAC or digital channels.
+    shutil.copy(FILENAME, tmp_path)
+    session = Session(str(tmp_path))
+    result = read_data(FILENAME)
+    expected = {key for key in result if key == 't' or key.endswith('_data')}
+    assert 'board_adc_data' not in expected
+    assert set(session.read()) == expected
+    assert set(session.read(0.0, 0.5, signals=['amplifier'])) == {'t', 'amplifier_data'}
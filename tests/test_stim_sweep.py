@@ -0,0 +1,33 @@
+import select, socket
+
+import numpy as np
+
+from tcputil.simulator import RhxSimulator
+from tcputil.command_client import connect_command_client
+from tcputil.waveform_block import get_waveform_block_dtype, decode_waveform_blocks
+from tcputil.stim_sweep import run_sweep, amplitude_sweep, receive_exactly
+
+
+def test_sweep_leaves_the_waveform_socket_empty():
+    # speed=None streams as fast as the socket takes it, so plenty is in flight at each stop.
+    with RhxSimulator(command_port=0, waveform_port=0, spike_port=0, num_channels=4, speed=None) as rhx:
+        client = connect_command_client('127.0.0.1', rhx.command_port)
+        waveform_socket = socket.create_connection(('127.0.0.1', rhx.waveform_port))
+        client.configure(['execute clearalldataoutputs', 'set a-000.tcpdataoutputenabled true',
+                          'set a-000.stimenabled true', 'set a-000.source keypressf1'])
+
+        sweep = run_sweep(client, waveform_socket, 'a-000', amplitude_sweep(1.0, 3), 1, 20, 30000.0,
+                          trigger_delay=0.0)
+        assert np.all(sweep['timestamps'][:, 0] == 0)
+        assert not select.select([waveform_socket], [], [], 0.1)[0]
+
+        # The next reader starts at a block boundary of a new run.
+        raw = bytearray(get_waveform_block_dtype(1).itemsize * 10)
+        client.set('runmode', 'run')
+        client.flush()
+        receive_exactly(waveform_socket, memoryview(raw), 5.0)
+        client.set('runmode', 'stop')
+        client.flush()
+        data = decode_waveform_blocks(np.frombuffer(raw, dtype=get_waveform_block_dtype(1)))
+        assert np.array_equal(data['timestamps'], np.arange(1280))
+        waveform_socket.close()